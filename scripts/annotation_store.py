@@ -0,0 +1,303 @@
+"""
+annotation_store.py
+
+Compact, memory-mapped binary annotation store used as the pipeline's
+interchange format in place of verbose COCO JSON.
+
+Functionality:
+- Stores an image table (id, width, height, source, file name) and a box
+  table (float32 [x, y, w, h] pixel boxes, uint8 category id, int32 image
+  index) as .npy columns, with CSR-style per-image offsets into the box table.
+- Opens with np.load(mmap_mode="r") in milliseconds, whatever the dataset size.
+- Imports from / exports to COCO JSON and YOLO txt. COCO export restores the
+  original annotation order, ids, area and iscrowd; box coordinates keep the
+  precision of the box dtype (pass box_dtype="float64" for a bit-exact
+  COCO round trip).
+
+Layout of a store directory:
+    meta.json                           version, counts, dtypes, categories, sources
+    image_id.npy width.npy height.npy   one row per image
+    source.npy                          uint8 index into meta["sources"] (255 = none)
+    names.bin name_offsets.npy          UTF-8 file names, CSR offsets
+    offsets.npy                         int64, boxes of image i are offsets[i]:offsets[i+1]
+    boxes.npy cls.npy image_index.npy   one row per box, grouped by image
+    ann_id.npy area.npy iscrowd.npy ann_rank.npy
+
+Usage:
+    python scripts/annotation_store.py import-coco data/merged/merged_coco_cleaned.json data/merged/merged.store
+    python scripts/annotation_store.py export-coco data/merged/merged.store out.json
+    python scripts/annotation_store.py export-yolo data/merged/merged.store data/merged/labels/all
+"""
+
+import os
+import json
+import argparse
+from array import array
+from pathlib import Path
+
+import numpy as np
+from coco_io import CocoWriter, iter_images, iter_annotations, load_categories
+
+STORE_VERSION = 1
+BOX_DTYPE = "float32"
+NO_SOURCE = 255
+
+IMAGE_COLUMNS = ("image_id", "width", "height", "source", "name_offsets", "offsets")
+BOX_COLUMNS = ("boxes", "cls", "image_index", "ann_id", "area", "iscrowd", "ann_rank")
+
+
+def is_store(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, "meta.json"))
+
+
+class AnnotationStore:
+    """Read-only view over a store directory; columns are memory-mapped on first access."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported annotation store version: {self.meta.get('version')}")
+        self.categories = self.meta["categories"]
+        self.sources = self.meta["sources"]
+        self._columns = {}
+
+    def __getattr__(self, name):
+        if name in IMAGE_COLUMNS or name in BOX_COLUMNS:
+            if name not in self._columns:
+                self._columns[name] = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+            return self._columns[name]
+        raise AttributeError(name)
+
+    @property
+    def num_images(self):
+        return self.meta["num_images"]
+
+    @property
+    def num_boxes(self):
+        return self.meta["num_boxes"]
+
+    def file_name(self, i):
+        with open(os.path.join(self.path, "names.bin"), "rb") as f:
+            f.seek(self.name_offsets[i])
+            return f.read(self.name_offsets[i + 1] - self.name_offsets[i]).decode("utf-8")
+
+    @property
+    def file_names(self):
+        with open(os.path.join(self.path, "names.bin"), "rb") as f:
+            blob = f.read()
+        offsets = self.name_offsets.tolist()
+        return [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(self.num_images)]
+
+    def image_boxes(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.boxes[start:end], self.cls[start:end]
+
+    def class_counts(self):
+        """Returns {category_id: count} for every category id present."""
+        counts = np.bincount(self.cls, minlength=256)
+        return {int(c): int(counts[c]) for c in np.flatnonzero(counts)}
+
+
+def _save(path, name, arr):
+    np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(arr))
+
+
+def write_store(path, images, boxes, cls, ann_image_ids, ann_ids, area, iscrowd, categories,
+                box_dtype=BOX_DTYPE):
+    """Writes a store from an image list and per-annotation columns (in original annotation order)."""
+    os.makedirs(path, exist_ok=True)
+
+    image_ids = np.array([img["id"] for img in images], dtype=np.int64)
+    index_of = {img_id: i for i, img_id in enumerate(image_ids.tolist())}
+    try:
+        image_index = np.fromiter((index_of[i] for i in ann_image_ids), dtype=np.int64, count=len(ann_image_ids))
+    except KeyError as e:
+        raise KeyError(f"Annotation references unknown image_id {e.args[0]!r}") from None
+
+    cls = np.asarray(cls, dtype=np.int64)
+    if cls.size and (cls.min() < 0 or cls.max() >= 256):
+        raise ValueError("Category ids must fit in uint8 (0-255) for the annotation store")
+
+    # Group boxes by image; ann_rank remembers the original annotation order
+    order = np.argsort(image_index, kind="stable")
+    offsets = np.searchsorted(image_index[order], np.arange(len(images) + 1)).astype(np.int64)
+
+    sources = sorted({img["source"] for img in images if img.get("source") is not None})
+    source_index = {s: i for i, s in enumerate(sources)}
+    if len(sources) >= NO_SOURCE:
+        raise ValueError("Too many distinct image sources for the annotation store")
+
+    encoded = [img["file_name"].encode("utf-8") for img in images]
+    name_offsets = np.zeros(len(images) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=name_offsets[1:])
+    with open(os.path.join(path, "names.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+
+    _save(path, "image_id", image_ids)
+    _save(path, "width", np.array([img["width"] for img in images], dtype=np.int32))
+    _save(path, "height", np.array([img["height"] for img in images], dtype=np.int32))
+    _save(path, "source", np.array([source_index.get(img.get("source"), NO_SOURCE) for img in images], dtype=np.uint8))
+    _save(path, "name_offsets", name_offsets)
+    _save(path, "offsets", offsets)
+
+    _save(path, "boxes", np.asarray(boxes, dtype=np.float64).reshape(-1, 4)[order].astype(box_dtype))
+    _save(path, "cls", cls[order].astype(np.uint8))
+    _save(path, "image_index", image_index[order].astype(np.int32))
+    _save(path, "ann_id", np.asarray(ann_ids, dtype=np.int64)[order])
+    _save(path, "area", np.asarray(area, dtype=np.float64)[order])
+    _save(path, "iscrowd", np.asarray(iscrowd, dtype=np.uint8)[order])
+    _save(path, "ann_rank", order.astype(np.int64))
+
+    meta = {
+        "version": STORE_VERSION,
+        "num_images": len(images),
+        "num_boxes": int(len(cls)),
+        "box_dtype": str(np.dtype(box_dtype)),
+        "categories": categories,
+        "sources": sources,
+    }
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=4)
+    return AnnotationStore(path)
+
+
+def from_coco(json_path, store_path, box_dtype=BOX_DTYPE):
+    """Imports a COCO JSON file, streaming its annotations into typed columns."""
+    images = [{k: img.get(k) for k in ("id", "file_name", "width", "height", "source")}
+              for img in iter_images(json_path)]
+
+    boxes, ann_ids, area = array("d"), array("q"), array("d")
+    cls, ann_image_ids, iscrowd = array("q"), array("q"), array("B")
+    for ann in iter_annotations(json_path):
+        boxes.extend(ann["bbox"])
+        cls.append(ann["category_id"])
+        ann_image_ids.append(ann["image_id"])
+        ann_ids.append(ann["id"])
+        area.append(ann["area"])
+        iscrowd.append(ann.get("iscrowd", 0))
+
+    return write_store(store_path, images, np.frombuffer(boxes, dtype=np.float64), cls, ann_image_ids,
+                       ann_ids, area, iscrowd, load_categories(json_path), box_dtype)
+
+
+def from_yolo(label_dir, images, categories, store_path, box_dtype=BOX_DTYPE):
+    """Imports YOLO txt labels; `images` gives id/file_name/width/height for every image.
+
+    YOLO class indexes are positions in `categories` (as in convert_coco_to_yolo.py).
+    """
+    boxes, cls, ann_image_ids = [], [], []
+    for img in images:
+        label_path = os.path.join(label_dir, Path(img["file_name"]).stem + ".txt")
+        if not os.path.exists(label_path):
+            continue
+        with open(label_path) as f:
+            lines = f.read().split("\n")
+        if not any(line.strip() for line in lines):
+            continue
+        rows = np.loadtxt(lines, dtype=np.float64, ndmin=2)
+        xc, yc, w, h = rows[:, 1:5].T
+        W, H = img["width"], img["height"]
+        boxes.append(np.stack([(xc - w / 2) * W, (yc - h / 2) * H, w * W, h * H], axis=1))
+        cls.append(rows[:, 0].astype(np.int64))
+        ann_image_ids.extend([img["id"]] * len(rows))
+
+    boxes = np.concatenate(boxes) if boxes else np.zeros((0, 4))
+    class_index = np.concatenate(cls) if cls else np.zeros(0, dtype=np.int64)
+    category_ids = np.array([c["id"] for c in categories], dtype=np.int64)[class_index]
+    return write_store(store_path, images, boxes, category_ids, ann_image_ids, np.arange(len(boxes)),
+                       boxes[:, 2] * boxes[:, 3], np.zeros(len(boxes), dtype=np.uint8), categories, box_dtype)
+
+
+def _float_list(arr):
+    """Shortest decimal repr of each value in its own dtype (float32 1.1 -> 1.1, not 1.100000023841858)."""
+    if arr.dtype == np.float64:
+        return arr.tolist()
+    return [float(s) for s in arr.astype(str)]
+
+
+def to_coco(store, json_path, indent=4, compact=None):
+    """Exports a store back to COCO JSON in the original annotation order."""
+    store = store if isinstance(store, AnnotationStore) else AnnotationStore(store)
+    sources = store.sources
+
+    with CocoWriter(json_path, store.categories, indent=indent, compact=compact, interleaved=False) as writer:
+        for img_id, name, w, h, src in zip(store.image_id.tolist(), store.file_names, store.width.tolist(),
+                                           store.height.tolist(), store.source.tolist()):
+            image = {"id": img_id, "file_name": name, "width": w, "height": h}
+            if src != NO_SOURCE:
+                image["source"] = sources[src]
+            writer.add_image(image)
+
+        order = np.argsort(store.ann_rank, kind="stable")
+        image_ids = store.image_id[store.image_index[order]].tolist()
+        bboxes = np.asarray(store.boxes[order])
+        flat = _float_list(bboxes.reshape(-1))
+        for k, (ann_id, img_id, cat, area, crowd) in enumerate(zip(
+                store.ann_id[order].tolist(), image_ids, store.cls[order].tolist(),
+                store.area[order].tolist(), store.iscrowd[order].tolist())):
+            writer.add_annotation({
+                "id": ann_id,
+                "image_id": img_id,
+                "category_id": cat,
+                "bbox": flat[4 * k:4 * k + 4],
+                "area": area,
+                "iscrowd": crowd
+            })
+
+
+def to_yolo(store, output_dir, desc=None):
+    """Exports YOLO labels through the same engine as convert_coco_to_yolo.py."""
+    from convert_coco_to_yolo import convert_arrays
+
+    store = store if isinstance(store, AnnotationStore) else AnnotationStore(store)
+    index_of = np.full(256, -1, dtype=np.int64)
+    for idx, cat in enumerate(store.categories):
+        index_of[cat["id"]] = idx
+    class_ids = index_of[store.cls]
+    if (class_ids < 0).any():
+        raise KeyError("Annotation store contains boxes of a category missing from its categories")
+
+    convert_arrays(store.image_id.tolist(), store.file_names, store.width.astype(np.float64),
+                   store.height.astype(np.float64), store.image_id[store.image_index].tolist(),
+                   _float_list(np.asarray(store.boxes).reshape(-1)), class_ids, output_dir, desc=desc)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert between COCO JSON / YOLO txt and the binary annotation store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("import-coco")
+    p.add_argument("json_path")
+    p.add_argument("store_path")
+    p.add_argument("--box-dtype", default=BOX_DTYPE, choices=["float32", "float64"])
+
+    p = sub.add_parser("export-coco")
+    p.add_argument("store_path")
+    p.add_argument("json_path")
+
+    p = sub.add_parser("export-yolo")
+    p.add_argument("store_path")
+    p.add_argument("output_dir")
+
+    p = sub.add_parser("info")
+    p.add_argument("store_path")
+
+    args = parser.parse_args(argv)
+    if args.command == "import-coco":
+        store = from_coco(args.json_path, args.store_path, args.box_dtype)
+        print(f" Store written: {args.store_path} ({store.num_images} images, {store.num_boxes} boxes)")
+    elif args.command == "export-coco":
+        to_coco(args.store_path, args.json_path)
+        print(f" COCO JSON written: {args.json_path}")
+    elif args.command == "export-yolo":
+        to_yolo(args.store_path, args.output_dir)
+        print(f" YOLO labels written: {args.output_dir}")
+    else:
+        store = AnnotationStore(args.store_path)
+        print(json.dumps({k: v for k, v in store.meta.items() if k != "categories"}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
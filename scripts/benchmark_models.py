@@ -0,0 +1,254 @@
+"""
+benchmark_models.py
+
+Export / quantization benchmark for the trained road-defect model on CPU.
+
+Functionality:
+- Builds every variant of best.pt per input size (IMG_SIZES):
+    pt             the PyTorch checkpoint itself
+    onnx_fp32      ultralytics ONNX export (batch 1, fixed size)
+    onnx_int8_dyn  ONNX Runtime dynamic quantization (int8 weights)
+    onnx_int8_qdq  ONNX Runtime static QDQ quantization, calibrated on
+                   CALIB_IMAGES images sampled from the training split
+    openvino       ultralytics OpenVINO export, only if openvino is installed
+- Runs each variant through the same ultralytics predict path on a sample
+  of test images: per-image latency percentiles (p50/p90/p99) at batch 1 and
+  throughput over a batch of THROUGHPUT_BATCH images.
+- Validates each variant on the test split (model.val, as in the notebook)
+  for mAP@0.5 overall and per class.
+- Prints one table and writes it to RESULTS_PATH (JSON) and a CSV next to it.
+
+Usage:
+    python scripts/benchmark_models.py
+    python scripts/benchmark_models.py --sizes 320 640 --variants pt onnx_fp32 onnx_int8_qdq
+"""
+
+import os
+import csv
+import json
+import time
+import random
+import argparse
+import importlib.util
+
+import cv2
+import numpy as np
+
+from onnx_inference import preprocess
+from sliced_inference import list_images
+
+# CONFIG
+WEIGHTS = "runs/detect/road_defects_yolov85/weights/best.pt"
+DATA_YAML = "data/merged/data.yaml"
+TRAIN_IMAGES = "data/merged/images/train"
+TEST_IMAGES = "data/merged/images/test"
+OUTPUT_DIR = "runs/benchmark"
+RESULTS_PATH = os.path.join(OUTPUT_DIR, "benchmark.json")
+IMG_SIZES = [320, 480, 640]
+VARIANTS = ["pt", "onnx_fp32", "onnx_int8_dyn", "onnx_int8_qdq", "openvino"]
+CALIB_IMAGES = 200
+LATENCY_IMAGES = 100
+WARMUP = 5
+THROUGHPUT_BATCH = 16
+THREADS = os.cpu_count()
+SEED = 42
+
+
+def available_variants(variants=VARIANTS):
+    kept = []
+    for variant in variants:
+        if variant.startswith("onnx_int8") and importlib.util.find_spec("onnxruntime") is None:
+            print(f" Skipping {variant}: onnxruntime is not installed")
+        elif variant == "openvino" and importlib.util.find_spec("openvino") is None:
+            print(" Skipping openvino: openvino is not installed")
+        else:
+            kept.append(variant)
+    return kept
+
+
+class CalibrationReader:
+    """Feeds letterboxed training images to onnxruntime's static quantizer."""
+
+    def __init__(self, paths, input_name, imgsz):
+        self.paths = iter(paths)
+        self.input_name = input_name
+        self.imgsz = imgsz
+
+    def get_next(self):
+        for path in self.paths:
+            img = cv2.imread(path)
+            if img is not None:
+                return {self.input_name: preprocess(img, self.imgsz)[0][None]}
+        return None
+
+    def rewind(self):
+        pass
+
+
+def copy_metadata(src, dst):
+    """Keeps the ultralytics metadata (names, stride, imgsz) on a quantized model."""
+    import onnx
+
+    model = onnx.load(dst)
+    del model.metadata_props[:]
+    model.metadata_props.extend(onnx.load(src, load_external_data=False).metadata_props)
+    onnx.save(model, dst)
+
+
+def export_variant(variant, weights, imgsz, out_dir, calib_paths):
+    """Returns the model path of a variant at one input size, exporting/quantizing it if needed."""
+    from ultralytics import YOLO
+
+    if variant == "pt":
+        return weights
+    stem = os.path.join(out_dir, f"{os.path.splitext(os.path.basename(weights))[0]}_{imgsz}")
+    if variant == "openvino":
+        path = stem + "_openvino_model"
+        if not os.path.exists(path):
+            exported = YOLO(weights).export(format="openvino", imgsz=imgsz, batch=1)
+            os.replace(exported, path)
+        return path
+
+    fp32 = stem + ".onnx"
+    if not os.path.exists(fp32):
+        exported = YOLO(weights).export(format="onnx", imgsz=imgsz, batch=1, dynamic=False, simplify=True)
+        os.replace(exported, fp32)
+    if variant == "onnx_fp32":
+        return fp32
+
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+    path = stem + ("_int8_dyn.onnx" if variant == "onnx_int8_dyn" else "_int8_qdq.onnx")
+    if os.path.exists(path):
+        return path
+    if variant == "onnx_int8_dyn":
+        quantize_dynamic(fp32, path, weight_type=QuantType.QUInt8)
+    else:
+        import onnxruntime as ort
+        input_name = ort.InferenceSession(fp32, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+        quantize_static(fp32, path, CalibrationReader(calib_paths, input_name, imgsz), quant_format=QuantFormat.QDQ,
+                        per_channel=True, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    copy_metadata(fp32, path)
+    return path
+
+
+def model_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+    return os.path.getsize(path)
+
+
+def measure_speed(model, images, imgsz, batched=False, warmup=WARMUP, batch=THROUGHPUT_BATCH):
+    """Batch-1 latency percentiles (ms) and throughput (images/s) through model.predict.
+
+    Fixed-shape exports take one image per call; `batched` models (the
+    PyTorch checkpoint) get the throughput images as one batch.
+    """
+    if not images:
+        raise ValueError("No images to time")
+    kwargs = {"imgsz": imgsz, "verbose": False, "device": "cpu"}
+    for img in images[:warmup]:
+        model.predict(img, **kwargs)
+
+    latencies = []
+    for img in images:
+        start = time.perf_counter()
+        model.predict(img, **kwargs)
+        latencies.append(time.perf_counter() - start)
+    p50, p90, p99 = np.percentile(np.array(latencies) * 1000, [50, 90, 99])
+
+    chunk = (images * (batch // len(images) + 1))[:batch]
+    start = time.perf_counter()
+    if batched:
+        model.predict(chunk, **kwargs)
+    else:
+        for img in chunk:
+            model.predict(img, **kwargs)
+    throughput = batch / (time.perf_counter() - start)
+    return {"p50_ms": round(p50, 2), "p90_ms": round(p90, 2), "p99_ms": round(p99, 2),
+            "mean_ms": round(float(np.mean(latencies)) * 1000, 2), "throughput": round(throughput, 2)}
+
+
+def measure_accuracy(model, data_yaml, imgsz):
+    """Test-split mAP@0.5, overall and per class."""
+    metrics = model.val(data=data_yaml, split="test", imgsz=imgsz, batch=1, device="cpu", plots=False,
+                        verbose=False)
+    per_class = {model.names[int(c)]: round(float(ap), 4)
+                 for c, ap in zip(metrics.box.ap_class_index, metrics.box.ap50)}
+    return {"map50": round(float(metrics.box.map50), 4), "map50_95": round(float(metrics.box.map), 4),
+            "ap50_per_class": per_class}
+
+
+def print_table(rows):
+    classes = sorted({c for row in rows for c in row.get("ap50_per_class", {})})
+    columns = ["size_mb", "p50_ms", "p90_ms", "p99_ms", "throughput", "map50"]
+    header = ["MB", "p50 ms", "p90 ms", "p99 ms", "img/s", "mAP50"] + [c[:12] for c in classes]
+    print("\n " + f"{'variant':15s}{'imgsz':>6s}" + "".join(f"{h:>13s}" for h in header))
+    for row in rows:
+        values = [row.get(c) for c in columns] + [row.get("ap50_per_class", {}).get(c) for c in classes]
+        print(" " + f"{row['variant']:15s}{row['imgsz']:>6d}" + "".join(f"{'-' if v is None else v:>13}"
+                                                                         for v in values))
+
+
+def write_results(rows, results_path=RESULTS_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(results_path)), exist_ok=True)
+    with open(results_path, "w") as f:
+        json.dump(rows, f, indent=2)
+    csv_path = os.path.splitext(results_path)[0] + ".csv"
+    classes = sorted({c for row in rows for c in row.get("ap50_per_class", {})})
+    columns = ["variant", "imgsz", "path", "size_mb", "p50_ms", "p90_ms", "p99_ms", "mean_ms", "throughput",
+               "map50", "map50_95"]
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns + [f"ap50_{c}" for c in classes])
+        for row in rows:
+            writer.writerow([row.get(c) for c in columns] + [row.get("ap50_per_class", {}).get(c) for c in classes])
+    print(f"\n Results saved: {results_path}, {csv_path}")
+
+
+def run_benchmark(weights=WEIGHTS, data_yaml=DATA_YAML, sizes=IMG_SIZES, variants=VARIANTS, output_dir=OUTPUT_DIR,
+                  results_path=RESULTS_PATH, skip_accuracy=False):
+    from ultralytics import YOLO
+    import torch
+
+    torch.set_num_threads(THREADS)
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(SEED)
+    train_images = list_images(TRAIN_IMAGES)
+    calib_paths = rng.sample(train_images, min(CALIB_IMAGES, len(train_images)))
+    test_paths = list_images(TEST_IMAGES)
+    test_images = [img for img in (cv2.imread(p) for p in rng.sample(test_paths, min(LATENCY_IMAGES,
+                                                                                      len(test_paths))))
+                   if img is not None]
+    if not test_images:
+        raise FileNotFoundError(f"No readable test images in {TEST_IMAGES}")
+
+    rows = []
+    for imgsz in sizes:
+        for variant in available_variants(variants):
+            print(f"\n [{variant} @ {imgsz}]")
+            path = export_variant(variant, weights, imgsz, output_dir, calib_paths)
+            model = YOLO(path, task="detect")
+            row = {"variant": variant, "imgsz": imgsz, "path": path,
+                   "size_mb": round(model_size(path) / 2 ** 20, 1)}
+            row.update(measure_speed(model, test_images, imgsz, batched=variant == "pt"))
+            if not skip_accuracy:
+                row.update(measure_accuracy(model, data_yaml, imgsz))
+            rows.append(row)
+            write_results(rows, results_path)  # keep partial results if a later variant fails
+
+    print_table(rows)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPU latency / accuracy matrix over export formats and sizes.")
+    parser.add_argument("--weights", default=WEIGHTS)
+    parser.add_argument("--data", default=DATA_YAML)
+    parser.add_argument("--sizes", type=int, nargs="+", default=IMG_SIZES)
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=VARIANTS)
+    parser.add_argument("--output", default=OUTPUT_DIR)
+    parser.add_argument("--skip-accuracy", action="store_true", help="only measure speed")
+    args = parser.parse_args()
+
+    run_benchmark(args.weights, args.data, args.sizes, args.variants, args.output,
+                  os.path.join(args.output, "benchmark.json"), args.skip_accuracy)
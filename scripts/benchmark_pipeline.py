@@ -0,0 +1,258 @@
+"""
+benchmark_pipeline.py
+
+Scaling benchmark for the dataset preparation scripts on synthetic data.
+
+Functionality:
+- Generates (or reuses) synthetic_data.py datasets at each scale and runs
+  the real stage functions on them in order: convert_voc_to_coco (RDD2022 +
+  UAV-PDD2023), yolo_to_coco (HighRPD), merge, clean (remove classes), split,
+  remap and convert_annotations (COCO -> YOLO).
+- Every stage runs in its own forked process, so its wall time, CPU time
+  (including worker processes) and peak RSS are measured in isolation; stage
+  output goes to a log file instead of the terminal.
+- Compares each (scale, stage) with a stored baseline and flags wall time or
+  memory regressions beyond the tolerances; --save-baseline records the
+  current run as the new baseline. Exits with status 1 on a regression.
+
+Usage:
+    python scripts/benchmark_pipeline.py --scales 1000 10000 100000
+    python scripts/benchmark_pipeline.py --scales 1000000 --save-baseline
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import argparse
+import multiprocessing
+
+import image_probe
+from synthetic_data import generate, load_manifest
+
+# CONFIG
+SYNTHETIC_ROOT = "data/synthetic"
+SCALES = [1000, 10000, 100000]
+BASELINE_PATH = os.path.join(SYNTHETIC_ROOT, "baseline.json")
+RESULTS_PATH = os.path.join(SYNTHETIC_ROOT, "results.json")
+WORKERS = os.cpu_count()
+WALL_TOLERANCE = 0.25  # flag stages more than 25% slower than the baseline...
+MIN_WALL_DELTA = 0.5  # ...and at least this many seconds slower (timer noise on small scales)
+MEMORY_TOLERANCE = 0.25
+MIN_MEMORY_DELTA = 32 * 2 ** 20  # bytes
+REMOVE_IDS = {2, 4, 8}
+
+
+# Stages: fn(manifest, work_dir), run inside the forked child
+def stage_convert_voc(manifest, work_dir):
+    import rdd2022_to_coco
+    import uavpdd2023_to_coco
+    from voc_reader import make_executor
+
+    executor = make_executor(WORKERS)
+    try:
+        for ds in manifest["voc"]:
+            if ds["converter"] == "rdd2022":
+                rdd2022_to_coco.convert_voc_to_coco(ds["xml_dir"], ds["json"], ds["img_dir"], executor=executor,
+                                                    cache=image_probe.load_cache())
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    for ds in manifest["voc"]:
+        if ds["converter"] == "uavpdd2023":
+            uavpdd2023_to_coco.convert(ds["xml_dir"], ds["json"], ds["img_dir"], workers=WORKERS)
+
+
+def stage_yolo_to_coco(manifest, work_dir):
+    import highrpd_to_coco
+
+    for ds in manifest["yolo"]:
+        highrpd_to_coco.yolo_to_coco(ds["img_dir"], ds["label_dir"], ds["json"], image_probe.load_cache())
+
+
+def stage_merge(manifest, work_dir):
+    from merge_coco_and_images import merge_datasets
+
+    merge_datasets(manifest["merge_datasets"], os.path.join(work_dir, "images"),
+                   os.path.join(work_dir, "merged_coco.json"),
+                   size_report_path=os.path.join(work_dir, "size_mismatches.json"))
+
+
+def stage_clean(manifest, work_dir):
+    from remove_irrelavant_classes import remove_classes
+
+    remove_classes(os.path.join(work_dir, "merged_coco.json"), os.path.join(work_dir, "images"),
+                   os.path.join(work_dir, "merged_coco_cleaned.json"), REMOVE_IDS, delete_orphans=False)
+
+
+def stage_split(manifest, work_dir):
+    from split_cleaned_code import split_dataset
+
+    split_dataset(os.path.join(work_dir, "merged_coco_cleaned.json"), os.path.join(work_dir, "images"),
+                  os.path.join(work_dir, "annotations"), os.path.join(work_dir, "images"), output_base=work_dir)
+
+
+def stage_remap(manifest, work_dir):
+    import remap_coco_category_ids as remap
+
+    for split in remap.splits:
+        remap.remap_file(os.path.join(work_dir, "annotations", f"{split}_coco.json"),
+                         os.path.join(work_dir, "annotations", f"{split}_coco_reindexed.json"),
+                         remap.id_remap, remap.new_categories)
+
+
+def stage_convert_annotations(manifest, work_dir):
+    from convert_coco_to_yolo import convert_splits
+    from remap_coco_category_ids import splits
+
+    convert_splits(os.path.join(work_dir, "annotations"), os.path.join(work_dir, "labels"),
+                   {split: f"{split}_coco_reindexed.json" for split in splits})
+
+
+STAGES = [
+    ("convert_voc_to_coco", stage_convert_voc),
+    ("yolo_to_coco", stage_yolo_to_coco),
+    ("merge", stage_merge),
+    ("clean", stage_clean),
+    ("split", stage_split),
+    ("remap", stage_remap),
+    ("convert_annotations", stage_convert_annotations),
+]
+
+
+def _max_rss_bytes(who):
+    rss = resource.getrusage(who).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024  # Linux reports KiB
+
+
+def _child(fn, manifest, work_dir, log_path, conn):
+    with open(log_path, "a") as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        sys.stdout = os.fdopen(1, "w", buffering=1)
+        sys.stderr = os.fdopen(2, "w", buffering=1)
+    image_probe.CACHE_PATH = os.path.join(manifest["root"], ".image_sizes.json")
+    start_rss = _max_rss_bytes(resource.RUSAGE_SELF)
+    start, cpu = time.perf_counter(), time.process_time()
+    error = None
+    try:
+        fn(manifest, work_dir)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    conn.send({"wall_s": time.perf_counter() - start,
+               "cpu_s": time.process_time() - cpu + children.ru_utime + children.ru_stime,
+               "peak_rss": max(_max_rss_bytes(resource.RUSAGE_SELF), _max_rss_bytes(resource.RUSAGE_CHILDREN)),
+               "start_rss": start_rss, "error": error})
+    conn.close()
+
+
+def run_isolated(fn, manifest, work_dir, log_path):
+    """Runs one stage in a forked process; returns its measurements."""
+    ctx = multiprocessing.get_context("fork")
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_child, args=(fn, manifest, work_dir, log_path, child_conn))
+    process.start()
+    result = parent_conn.recv() if parent_conn.poll(None) else None
+    process.join()
+    if result is None:
+        result = {"error": f"stage process exited with code {process.exitcode}"}
+    return result
+
+
+def prepare(scale, synthetic_root=SYNTHETIC_ROOT):
+    """Synthetic sources for one scale, generated once and reused across runs."""
+    root = os.path.join(synthetic_root, str(scale))
+    if os.path.exists(os.path.join(root, "manifest.json")):
+        manifest = load_manifest(root)
+        if manifest["annotations"] == scale:
+            return manifest
+    return generate(root, scale)
+
+
+def run_scale(scale, synthetic_root=SYNTHETIC_ROOT):
+    manifest = prepare(scale, synthetic_root)
+    work_dir = os.path.join(manifest["root"], "merged")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    cache_path = os.path.join(manifest["root"], ".image_sizes.json")
+    if os.path.exists(cache_path):
+        os.remove(cache_path)  # cold size probes, as on a first run
+    log_path = os.path.join(manifest["root"], "benchmark.log")
+    open(log_path, "w").close()
+
+    results = {}
+    for name, fn in STAGES:
+        result = run_isolated(fn, manifest, work_dir, log_path)
+        result["annotations"] = scale
+        results[name] = result
+        if result.get("error"):
+            print(f"  {name:22s} FAILED: {result['error']} (see {log_path})")
+            break
+        print(f"  {name:22s} {result['wall_s']:8.2f}s wall {result['cpu_s']:8.2f}s cpu "
+              f"{result['peak_rss'] / 2 ** 20:8.0f} MB peak  {scale / max(result['wall_s'], 1e-9):10.0f} ann/s")
+    return results
+
+
+def compare(results, baseline):
+    """Returns a list of regression messages against the baseline."""
+    regressions = []
+    for scale, stages in results.items():
+        for name, current in stages.items():
+            base = baseline.get(scale, {}).get(name)
+            if not base or current.get("error") or base.get("error"):
+                continue
+            wall, base_wall = current["wall_s"], base["wall_s"]
+            if wall > base_wall * (1 + WALL_TOLERANCE) and wall - base_wall > MIN_WALL_DELTA:
+                regressions.append(f"{scale}/{name}: wall {base_wall:.2f}s -> {wall:.2f}s "
+                                   f"(+{(wall / base_wall - 1) * 100:.0f}%)")
+            rss, base_rss = current["peak_rss"], base["peak_rss"]
+            if rss > base_rss * (1 + MEMORY_TOLERANCE) and rss - base_rss > MIN_MEMORY_DELTA:
+                regressions.append(f"{scale}/{name}: peak RSS {base_rss / 2 ** 20:.0f} MB -> {rss / 2 ** 20:.0f} MB")
+    return regressions
+
+
+def run_benchmark(scales=SCALES, synthetic_root=SYNTHETIC_ROOT, baseline_path=BASELINE_PATH,
+                  results_path=RESULTS_PATH, save_baseline=False):
+    results = {}
+    for scale in scales:
+        print(f"\n Scale: {scale} annotations")
+        results[str(scale)] = run_scale(scale, synthetic_root)
+
+    os.makedirs(os.path.dirname(os.path.abspath(results_path)), exist_ok=True)
+    with open(results_path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n Results saved: {results_path}")
+
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline)
+    if baseline:
+        print(f" Regressions against {baseline_path}: {len(regressions)}")
+        for message in regressions:
+            print(f"  REGRESSION {message}")
+
+    if save_baseline:
+        for scale, stages in results.items():
+            baseline.setdefault(scale, {}).update({k: v for k, v in stages.items() if not v.get("error")})
+        with open(baseline_path, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f" Baseline saved: {baseline_path}")
+    return results, regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time and memory-profile the pipeline stages on synthetic data.")
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES, help="annotation counts")
+    parser.add_argument("--root", default=SYNTHETIC_ROOT)
+    parser.add_argument("--baseline", help="baseline JSON (default: <root>/baseline.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    args = parser.parse_args()
+
+    _, found = run_benchmark(args.scales, args.root, args.baseline or os.path.join(args.root, "baseline.json"),
+                             os.path.join(args.root, "results.json"), args.save_baseline)
+    sys.exit(1 if found and not args.save_baseline else 0)
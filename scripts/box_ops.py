@@ -0,0 +1,149 @@
+"""
+box_ops.py
+
+Vectorized box geometry shared by the inference and evaluation scripts.
+
+Functionality:
+- Pairwise IoU / intersection-over-smaller matrices for [x1, y1, x2, y2]
+  boxes, computed with NumPy broadcasting.
+- Class-aware greedy NMS, weighted box fusion and union merging (a box cut
+  by a tile border rejoins its other parts). All use the same
+  clustering: every box is assigned to the highest-scoring box of its class
+  that overlaps it above the threshold, with one vectorized overlap
+  computation per kept box.
+- Conversions to the YOLO txt layout written by ultralytics'
+  predict(save_txt=True, save_conf=True).
+"""
+
+import numpy as np
+
+# ultralytics writes ("%g " * len(line)).rstrip() % (cls, xc, yc, w, h, conf)
+PREDICTION_FORMAT = "%g %g %g %g %g %g"
+
+
+def box_area(boxes):
+    return np.clip(boxes[..., 2] - boxes[..., 0], 0, None) * np.clip(boxes[..., 3] - boxes[..., 1], 0, None)
+
+
+def intersection(a, b):
+    """Intersection areas between every box of a (n, 4) and b (m, 4), shape (n, m)."""
+    w = np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0])
+    h = np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1])
+    return np.clip(w, 0, None) * np.clip(h, 0, None)
+
+
+def overlap_matrix(a, b, metric="iou"):
+    """IoU (metric="iou") or intersection over the smaller box (metric="ios"), shape (n, m).
+
+    IoS suits boxes cut by a tile border: the clipped part of a crack is
+    mostly contained in the full detection but has a low IoU with it.
+    """
+    inter = intersection(a, b)
+    area_a, area_b = box_area(a)[:, None], box_area(b)[None, :]
+    if metric == "iou":
+        denom = area_a + area_b - inter
+    elif metric == "ios":
+        denom = np.minimum(area_a, area_b)
+    else:
+        raise ValueError(f"Unknown overlap metric {metric!r}")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denom > 0, inter / denom, 0.0)
+
+
+def cluster_boxes(boxes, scores, classes, threshold=0.5, metric="iou", groups=None):
+    """Greedy clustering behind NMS, box fusion and union merging.
+
+    With groups (one id per box, e.g. the tile it came from), a box only joins
+    the cluster of a head from another group. Returns (keep, assignment):
+    indexes of the cluster heads in descending score order, and for every box
+    the index of its head.
+    """
+    order = np.argsort(-scores, kind="stable")
+    assignment = np.full(len(boxes), -1, dtype=np.int64)
+    keep = []
+    for i in order:
+        if assignment[i] >= 0:
+            continue
+        assignment[i] = i
+        keep.append(i)
+        free = np.flatnonzero((assignment < 0) & (classes == classes[i]))
+        if groups is not None:
+            free = free[groups[free] != groups[i]]
+        if free.size:
+            overlaps = overlap_matrix(boxes[i:i + 1], boxes[free], metric)[0]
+            assignment[free[overlaps > threshold]] = i
+    return np.array(keep, dtype=np.int64), assignment
+
+
+def _cluster_slots(keep, assignment):
+    """Position in `keep` of every box's cluster head."""
+    slot = np.full(len(assignment), -1, dtype=np.int64)
+    slot[keep] = np.arange(len(keep))
+    return slot[assignment]
+
+
+def nms(boxes, scores, classes, threshold=0.5, metric="iou"):
+    """Class-aware NMS; returns the kept indexes in descending score order."""
+    if not len(boxes):
+        return np.empty(0, dtype=np.int64)
+    return cluster_boxes(boxes, scores, classes, threshold, metric)[0]
+
+
+def fuse_boxes(boxes, scores, classes, threshold=0.5, metric="iou"):
+    """Weighted box fusion: each cluster becomes the score-weighted mean of its boxes.
+
+    The fused score is the best score of the cluster. Returns (boxes, scores, classes).
+    """
+    if not len(boxes):
+        return boxes, scores, classes
+    keep, assignment = cluster_boxes(boxes, scores, classes, threshold, metric)
+    cluster = _cluster_slots(keep, assignment)
+
+    weights = np.bincount(cluster, weights=scores, minlength=len(keep))
+    fused = np.stack([np.bincount(cluster, weights=scores * boxes[:, k], minlength=len(keep)) for k in range(4)],
+                     axis=1) / weights[:, None]
+    return fused, scores[keep], classes[keep]
+
+
+def union_boxes(boxes, scores, classes, threshold=0.5, metric="ios", groups=None):
+    """Non-maximum merging: each cluster becomes the box enclosing all its members.
+
+    Rebuilds defects larger than the tile overlap, which every tile sees only
+    in part; pass the tile of every box as groups so that only parts from
+    different tiles are joined. Returns (boxes, scores, classes).
+    """
+    if not len(boxes):
+        return boxes, scores, classes
+    keep, assignment = cluster_boxes(boxes, scores, classes, threshold, metric, groups)
+    cluster = _cluster_slots(keep, assignment)
+    merged = boxes[keep].copy()
+    np.minimum.at(merged[:, 0], cluster, boxes[:, 0])
+    np.minimum.at(merged[:, 1], cluster, boxes[:, 1])
+    np.maximum.at(merged[:, 2], cluster, boxes[:, 2])
+    np.maximum.at(merged[:, 3], cluster, boxes[:, 3])
+    return merged, scores[keep], classes[keep]
+
+
+def merge_detections(boxes, scores, classes, mode="nms", threshold=0.5, metric="iou"):
+    """Merges duplicate detections with "nms", "fusion" or "union"; returns (boxes, scores, classes)."""
+    if mode == "nms":
+        keep = nms(boxes, scores, classes, threshold, metric)
+        return boxes[keep], scores[keep], classes[keep]
+    if mode == "fusion":
+        return fuse_boxes(boxes, scores, classes, threshold, metric)
+    if mode == "union":
+        return union_boxes(boxes, scores, classes, threshold, metric)
+    raise ValueError(f"Unknown merge mode {mode!r}")
+
+
+def xyxy_to_xywhn(boxes, width, height):
+    """Pixel [x1, y1, x2, y2] -> normalized YOLO [xc, yc, w, h]."""
+    x1, y1, x2, y2 = np.clip(boxes, 0, [width, height, width, height]).T
+    return np.stack([(x1 + x2) / 2 / width, (y1 + y2) / 2 / height, (x2 - x1) / width, (y2 - y1) / height], axis=1)
+
+
+def prediction_lines(boxes, scores, classes, width, height):
+    """Detections as the lines of a predict(save_txt=True, save_conf=True) label file."""
+    xywhn = xyxy_to_xywhn(boxes, width, height)
+    return [PREDICTION_FORMAT % (int(c), *box, s) for c, box, s in zip(classes.tolist(), xywhn.tolist(),
+                                                                       scores.tolist())]
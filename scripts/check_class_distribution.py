@@ -6,34 +6,45 @@ Visualizes the distribution of defect classes in YOLO label format across a data
 Functionality:
 - Scans a specified labels directory.
 - Counts occurrences of each class label.
+- Computes dataset statistics with NumPy bincount/histogram, per split and
+  per source dataset: class counts, boxes per image, box size and aspect
+  ratio histograms (pixels and normalized), image sizes and small-object
+  fractions at the training resolution. Reads COCO JSON, annotation stores
+  or YOLO label folders, and writes JSON that can be diffed between versions.
 
 Usage:
 Run this script to verify class balance after annotation or merging.
+    python scripts/check_class_distribution.py                     # split files, or COCO_JSON_PATH
+    python scripts/check_class_distribution.py --input train=data/merged/labels/train \
+        --images data/merged/images --imgsz 640 --output stats.json
 """
 
+import os
 import json
-from collections import Counter
+import argparse
+from array import array
 
-# Path to COCO JSON
-COCO_JSON_PATH = "data/merged/merged_coco_cleaned.json"
-
-def load_coco_annotations(json_path):
-    with open(json_path, 'r') as f:
-        data = json.load(f)
-    return data
+import numpy as np
 
-def get_category_mapping(categories):
-    """Returns a dictionary {id: name}"""
-    return {cat['id']: cat['name'] for cat in categories}
+from coco_io import iter_sections
+from annotation_store import AnnotationStore, is_store
+from image_probe import probe_dir
+from remap_coco_category_ids import new_categories
 
-def count_annotations(annotations):
-    """Counts occurrences of each category_id in annotations"""
-    return Counter([a['category_id'] for a in annotations])
+# Path to COCO JSON (or binary annotation store directory)
+COCO_JSON_PATH = "data/merged/merged_coco_cleaned.json"
 
-def print_class_distribution(data):
-    cat_map = get_category_mapping(data['categories'])
-    counts = count_annotations(data['annotations'])
+# Statistics defaults: the per-split files written by remap_coco_category_ids.py
+SPLIT_INPUTS = {split: f"data/merged/annotations/{split}_coco_reindexed.json" for split in ("train", "val", "test")}
+STATS_PATH = "data/merged/dataset_stats.json"
+IMGSZ = 640  # training resolution (longest side after letterboxing)
+SMALL_SIDES = (8, 16, 32)  # report boxes whose shorter side is below these at IMGSZ
+SIZE_BINS = np.array([0, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, np.inf])  # sqrt(area), pixels
+NORM_BINS = np.linspace(0, 1, 21)
+ASPECT_BINS = np.array([0, 1 / 8, 1 / 4, 1 / 2, 2 / 3, 3 / 2, 2, 4, 8, np.inf])  # width / height
+UNKNOWN_SOURCE = "unknown"
 
+def print_counts(cat_map, counts):
     print("\n Class Distribution:")
     for cat_id, count in sorted(counts.items()):
         name = cat_map.get(cat_id, "Unknown")
@@ -45,6 +56,274 @@ def print_class_distribution(data):
         for m in missing:
             print(f"  {m:2d} - {cat_map[m]}")
 
+# Statistics engine
+# A table is a dict of NumPy columns: per image (width, height, source) and
+# per box (image_index, cls as category position, w, h in pixels and normalized).
+def _table(width, height, source, sources, image_index, cls, box_w, box_h, categories, box_wn=None, box_hn=None):
+    width, height = np.asarray(width, dtype=np.float64), np.asarray(height, dtype=np.float64)
+    image_index = np.asarray(image_index, dtype=np.int64)
+    box_w, box_h = np.asarray(box_w, dtype=np.float64), np.asarray(box_h, dtype=np.float64)
+    return {"width": width, "height": height,
+            "source": np.asarray(source, dtype=np.int64), "sources": sources,
+            "image_index": image_index, "cls": np.asarray(cls, dtype=np.int64),
+            "box_w": box_w, "box_h": box_h,
+            "box_wn": box_w / width[image_index] if box_wn is None else np.asarray(box_wn, dtype=np.float64),
+            "box_hn": box_h / height[image_index] if box_hn is None else np.asarray(box_hn, dtype=np.float64),
+            "categories": categories}
+
+def _category_positions(categories, category_ids):
+    lookup = {cat["id"]: i for i, cat in enumerate(categories)}
+    return np.fromiter((lookup.get(c, -1) for c in category_ids), dtype=np.int64, count=len(category_ids))
+
+def load_coco_table(path):
+    """Reads a COCO JSON file (single streaming pass) or an annotation store into a table."""
+    if is_store(path):
+        store = AnnotationStore(path)
+        sources = store.sources + [UNKNOWN_SOURCE]
+        source = np.where(store.source == 255, len(store.sources), store.source)
+        cls = _category_positions(store.categories, store.cls.tolist())
+        return _table(store.width, store.height, source, sources, store.image_index, cls,
+                      store.boxes[:, 2], store.boxes[:, 3], store.categories)
+
+    width, height, source, image_ids = array("d"), array("d"), array("q"), []
+    ann_image_ids, category_ids, bboxes = array("q"), array("q"), array("d")
+    sources, categories = {}, []
+    for key, items in iter_sections(path):
+        if key == "images":
+            for img in items:
+                image_ids.append(img["id"])
+                width.append(img["width"])
+                height.append(img["height"])
+                source.append(sources.setdefault(img.get("source") or UNKNOWN_SOURCE, len(sources)))
+        elif key == "annotations":
+            for ann in items:
+                ann_image_ids.append(ann["image_id"])
+                category_ids.append(ann["category_id"])
+                bboxes.extend(ann["bbox"][:4])
+        else:
+            categories = list(items)
+
+    index_of = {img_id: i for i, img_id in enumerate(image_ids)}
+    image_index = np.fromiter((index_of.get(i, -1) for i in ann_image_ids), dtype=np.int64, count=len(ann_image_ids))
+    boxes = np.frombuffer(bboxes, dtype=np.float64).reshape(-1, 4)
+    keep = image_index >= 0
+    return _table(width, height, source, list(sources), image_index[keep],
+                  _category_positions(categories, category_ids)[keep], boxes[keep, 2], boxes[keep, 3], categories)
+
+def load_yolo_table(label_dir, img_dir=None, categories=new_categories, source_map=None):
+    """Reads a YOLO label folder into a table.
+
+    Pixel sizes come from the image headers in img_dir (same file stem);
+    without it, pixel statistics are NaN and only normalized ones are
+    meaningful. source_map ({file stem: source}) attributes images to datasets.
+    """
+    names = sorted(f for f in os.listdir(label_dir) if f.endswith(".txt"))
+    stems = [os.path.splitext(f)[0] for f in names]
+    width = np.full(len(names), np.nan)
+    height = np.full(len(names), np.nan)
+    if img_dir:
+        images = {os.path.splitext(f)[0]: f for f in os.listdir(img_dir)}
+        sizes = probe_dir(img_dir, [images[s] for s in stems if s in images])
+        for i, stem in enumerate(stems):
+            size = sizes.get(images.get(stem))
+            if size:
+                width[i], height[i] = size
+
+    sources = {}
+    source = np.array([sources.setdefault((source_map or {}).get(stem, UNKNOWN_SOURCE), len(sources))
+                       for stem in stems], dtype=np.int64)
+
+    tokens, image_index = [], array("q")
+    for i, fname in enumerate(names):
+        with open(os.path.join(label_dir, fname)) as f:
+            rows = [line.split() for line in f if line.strip()]
+        rows = [r for r in rows if len(r) == 5]
+        tokens += [t for r in rows for t in r]
+        image_index.extend([i] * len(rows))
+    rows = np.array(tokens, dtype=np.float64).reshape(-1, 5)
+    image_index = np.frombuffer(image_index, dtype=np.int64)
+
+    return _table(width, height, source, list(sources), image_index, rows[:, 0].astype(np.int64),
+                  rows[:, 3] * width[image_index], rows[:, 4] * height[image_index], categories,
+                  box_wn=rows[:, 3], box_hn=rows[:, 4])
+
+def load_table(path, img_dir=None, source_map=None):
+    if os.path.isdir(path) and not is_store(path):
+        return load_yolo_table(path, img_dir, source_map=source_map)
+    return load_coco_table(path)
+
+def source_map_from_coco(path):
+    """{file stem: source} from a COCO file whose images carry a "source" field."""
+    from coco_io import iter_images
+    return {os.path.splitext(img["file_name"])[0]: img.get("source") or UNKNOWN_SOURCE for img in iter_images(path)}
+
+def _histogram(values, bins):
+    index = np.searchsorted(bins, values[np.isfinite(values)], side="right") - 1
+    index = index[(index >= 0) & (index < len(bins) - 1)]
+    counts = np.bincount(index, minlength=len(bins) - 1)
+    # The open upper edge is written as null (JSON has no infinity)
+    return {"bins": [round(float(b), 6) if np.isfinite(b) else None for b in bins], "counts": counts.tolist()}
+
+def _summary(values):
+    values = values[np.isfinite(values)]
+    if not values.size:
+        return None
+    p = np.percentile(values, [5, 50, 95])
+    return {"mean": float(values.mean()), "p5": float(p[0]), "median": float(p[1]), "p95": float(p[2]),
+            "min": float(values.min()), "max": float(values.max())}
+
+def compute_stats(table, image_mask, imgsz=IMGSZ):
+    """Statistics for the images selected by image_mask (and their boxes)."""
+    num_classes = len(table["categories"])
+    box_mask = image_mask[table["image_index"]]
+    image_index, cls = table["image_index"][box_mask], table["cls"][box_mask]
+    box_w, box_h = table["box_w"][box_mask], table["box_h"][box_mask]
+    box_wn, box_hn = table["box_wn"][box_mask], table["box_hn"][box_mask]
+    width, height = table["width"][image_index], table["height"][image_index]
+
+    valid_cls = (cls >= 0) & (cls < num_classes)
+    class_counts = np.bincount(cls[valid_cls], minlength=num_classes)
+    # Images containing each class (count each (image, class) pair once)
+    pairs = np.unique(image_index[valid_cls] * num_classes + cls[valid_cls])
+    images_per_class = np.bincount(pairs % num_classes, minlength=num_classes)
+
+    per_image = np.bincount(image_index, minlength=len(image_mask))[image_mask]
+    names = [cat["name"] for cat in table["categories"]]
+
+    # Letterbox scale to imgsz, as the YOLO dataloader resizes the longest side
+    scale = imgsz / np.maximum(width, height)
+    train_w, train_h = box_w * scale, box_h * scale
+    train_side = np.sqrt(train_w * train_h)
+    shorter = np.minimum(train_w, train_h)
+    measured = np.isfinite(train_side)
+    n_measured = int(measured.sum())
+
+    def fraction(mask):
+        return float(mask.sum() / n_measured) if n_measured else None
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        aspect = np.where(np.isfinite(box_w / box_h), box_w / box_h, box_wn / box_hn)
+
+    img_w, img_h = table["width"][image_mask], table["height"][image_mask]
+    known = np.isfinite(img_w) & np.isfinite(img_h)
+    sizes, size_counts = np.unique(np.column_stack([img_w[known], img_h[known]]), axis=0, return_counts=True)
+
+    return {
+        "images": int(image_mask.sum()),
+        "boxes": int(box_mask.sum()),
+        "background_images": int((per_image == 0).sum()),
+        "classes": {name: {"boxes": int(class_counts[i]), "images": int(images_per_class[i])}
+                    for i, name in enumerate(names)},
+        "invalid_class_boxes": int((~valid_cls).sum()),
+        "boxes_per_image": {"histogram": np.bincount(per_image).tolist(), **(_summary(per_image.astype(float)) or {})},
+        "image_sizes": {f"{int(w)}x{int(h)}": int(c) for (w, h), c in zip(sizes, size_counts)},
+        "box_size_px": {"sqrt_area": _summary(np.sqrt(box_w * box_h)), "width": _summary(box_w),
+                        "height": _summary(box_h), "histogram": _histogram(np.sqrt(box_w * box_h), SIZE_BINS)},
+        "box_size_norm": {"width": _summary(box_wn), "height": _summary(box_hn),
+                          "width_histogram": _histogram(box_wn, NORM_BINS),
+                          "height_histogram": _histogram(box_hn, NORM_BINS)},
+        # Pixel aspect ratio; normalized ratio when image sizes are unknown
+        "aspect_ratio": {**(_summary(aspect) or {}), "histogram": _histogram(aspect, ASPECT_BINS)},
+        f"at_imgsz_{imgsz}": {
+            "sqrt_area": _summary(train_side),
+            "histogram": _histogram(train_side, SIZE_BINS),
+            # COCO size classes: small < 32^2, medium < 96^2 pixels of area
+            "small_fraction": fraction(train_side[measured] < 32),
+            "medium_fraction": fraction((train_side[measured] >= 32) & (train_side[measured] < 96)),
+            "large_fraction": fraction(train_side[measured] >= 96),
+            "shorter_side_below": {str(s): fraction(shorter[measured] < s) for s in SMALL_SIDES},
+            "boxes_measured": n_measured,
+        },
+    }
+
+def dataset_stats(tables, imgsz=IMGSZ):
+    """Statistics per split ({split: table}) and per source within it, plus per source over all splits."""
+    result = {"imgsz": imgsz, "splits": {}, "sources": {}}
+    for split, table in tables.items():
+        everything = np.ones(len(table["width"]), dtype=bool)
+        result["splits"][split] = {
+            "all": compute_stats(table, everything, imgsz),
+            "sources": {name: compute_stats(table, table["source"] == table["sources"].index(name), imgsz)
+                        for name in sorted(table["sources"])},
+        }
+
+    # Per source across splits: concatenate the tables
+    combined = concat_tables(list(tables.values()))
+    result["all"] = compute_stats(combined, np.ones(len(combined["width"]), dtype=bool), imgsz)
+    result["sources"] = {name: compute_stats(combined, combined["source"] == combined["sources"].index(name), imgsz)
+                         for name in sorted(combined["sources"])}
+    return result
+
+def concat_tables(tables):
+    sources = []
+    for table in tables:
+        sources += [s for s in table["sources"] if s not in sources]
+    code = {s: i for i, s in enumerate(sources)}
+    offsets = np.cumsum([0] + [len(t["width"]) for t in tables])
+    return _table(
+        np.concatenate([t["width"] for t in tables]), np.concatenate([t["height"] for t in tables]),
+        np.concatenate([np.array([code[s] for s in t["sources"]], dtype=np.int64)[t["source"]] for t in tables]),
+        sources,
+        np.concatenate([t["image_index"] + off for t, off in zip(tables, offsets)]),
+        np.concatenate([t["cls"] for t in tables]),
+        np.concatenate([t["box_w"] for t in tables]), np.concatenate([t["box_h"] for t in tables]),
+        tables[0]["categories"],
+        np.concatenate([t["box_wn"] for t in tables]), np.concatenate([t["box_hn"] for t in tables]))
+
+def print_stats(stats):
+    overall = stats["all"]
+    cat_map = dict(enumerate(overall["classes"]))
+    print_counts(cat_map, {i: c["boxes"] for i, c in enumerate(overall["classes"].values()) if c["boxes"]})
+    at = overall[f"at_imgsz_{stats['imgsz']}"]
+    print(f"\n Images: {overall['images']} ({overall['background_images']} without boxes), boxes: {overall['boxes']}")
+    if at["boxes_measured"]:
+        print(f" At imgsz={stats['imgsz']}: small {at['small_fraction']:.1%}, medium {at['medium_fraction']:.1%}, "
+              f"large {at['large_fraction']:.1%}")
+    for split, split_stats in stats["splits"].items():
+        s = split_stats["all"]
+        at = s[f"at_imgsz_{stats['imgsz']}"]
+        small = f", small {at['small_fraction']:.1%}" if at["boxes_measured"] else ""
+        print(f"  {split:8s}: {s['images']:6d} images, {s['boxes']:7d} boxes{small}")
+
+def write_stats(inputs, output_path=STATS_PATH, imgsz=IMGSZ, img_dir=None, source_coco=None):
+    """inputs: {split: COCO JSON, annotation store or YOLO label folder}."""
+    source_map = source_map_from_coco(source_coco) if source_coco else None
+    tables = {}
+    for split, path in inputs.items():
+        split_img_dir = os.path.join(img_dir, split) if img_dir and os.path.isdir(os.path.join(img_dir, split)) else img_dir
+        tables[split] = load_table(path, split_img_dir, source_map)
+    stats = dataset_stats(tables, imgsz)
+    if output_path:
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        with open(output_path, "w") as f:
+            json.dump(stats, f, indent=2)
+    print_stats(stats)
+    if output_path:
+        print(f"\n Statistics saved: {output_path}")
+    return stats
+
+def parse_inputs(values):
+    inputs = {}
+    for value in values:
+        name, sep, path = value.partition("=")
+        if not sep:
+            name, path = os.path.splitext(os.path.basename(value.rstrip("/")))[0], value
+        inputs[name] = path
+    return inputs
+
 if __name__ == "__main__":
-    data = load_coco_annotations(COCO_JSON_PATH)
-    print_class_distribution(data)
+    parser = argparse.ArgumentParser(description="Class distribution and dataset statistics.")
+    parser.add_argument("--input", nargs="+", help="[split=]path of a COCO JSON, annotation store or YOLO label folder")
+    parser.add_argument("--images", help="image folder (with optional <split>/ subfolders) for YOLO inputs")
+    parser.add_argument("--sources", help="COCO JSON with image \"source\" fields, to attribute YOLO labels")
+    parser.add_argument("--imgsz", type=int, default=IMGSZ)
+    parser.add_argument("--output", default=STATS_PATH)
+    args = parser.parse_args()
+
+    if args.input:
+        inputs = parse_inputs(args.input)
+    elif all(os.path.exists(p) for p in SPLIT_INPUTS.values()):
+        inputs = SPLIT_INPUTS
+    else:
+        inputs = {"all": COCO_JSON_PATH}
+    write_stats(inputs, args.output, args.imgsz, args.images, args.sources)
@@ -0,0 +1,197 @@
+"""
+checkpoint.py
+
+Chunked, resumable COCO output for the long-running converters and merge.
+
+Functionality:
+- ResumableCocoWriter has the CocoWriter interface, but writes images and
+  annotations into numbered part files under <output>.partial/.
+  commit(state, changes) makes the current chunk durable (fsync + rename)
+  and then atomically replaces journal.json with the ID counters and the
+  caller's progress state (position, counters). What the caller's indexes
+  gained in the chunk (ID map entries, hashes, report entries) is stored
+  with the chunk instead, so a commit costs the same at any dataset size.
+- After a crash, a writer opened on the same output with the same
+  fingerprint (inputs and settings) continues from the journal: parts of
+  the chunk that was not committed are dropped, the counters and state are
+  restored, the caller replays committed_changes() to rebuild its indexes
+  and skips the work the state says is done.
+- close() joins the parts into the output JSON, byte-identical to what
+  CocoWriter writes in one go, and removes <output>.partial/.
+
+Used by voc_reader.py (RDD2022 / UAV-PDD2023), highrpd_to_coco.py and
+merge_coco_and_images.py.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+
+from coco_io import COMPACT_JSON, CocoWriter
+
+# Records (images or annotations) written between two commits
+CHUNK_SIZE = 1000
+
+# Continue from an existing journal; False always starts over
+RESUME = True
+
+JOURNAL = "journal.json"
+
+
+def fingerprint(*parts):
+    """Digest of the inputs and settings a journal is valid for."""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _fsync_replace(tmp_path, path):
+    with open(tmp_path, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ResumableCocoWriter(CocoWriter):
+    """CocoWriter committing its output in chunks, resumable from its journal.
+
+    `state` holds the caller's progress from the last commit ({} on a fresh
+    start) and `resumed` tells whether a journal was picked up.
+    """
+
+    def __init__(self, path, categories=None, key=None, resume=RESUME, indent=4, compact=None):
+        # Formatting settings of CocoWriter; the output file itself is only written by close()
+        self.path = path
+        self.categories = categories if categories is not None else []
+        self.compact = COMPACT_JSON if compact is None else compact
+        self.indent = None if self.compact else indent
+        self.interleaved = True
+        self.num_images = 0
+        self.num_annotations = 0
+        self._f = None
+
+        self.dir = path + ".partial"
+        self.key = fingerprint(key, self.categories, self.indent)
+        self.chunk = 0
+        self.state = {}
+        self.resumed = False
+        journal = self._load_journal() if resume else None
+        if journal is None:
+            shutil.rmtree(self.dir, ignore_errors=True)
+        else:
+            self.chunk = journal["chunk"]
+            self.num_images = journal["num_images"]
+            self.num_annotations = journal["num_annotations"]
+            self.state = journal["state"]
+            self.resumed = True
+            print(f" Resuming {os.path.basename(path)} after {self.num_images} images, "
+                  f"{self.num_annotations} annotations")
+        os.makedirs(self.dir, exist_ok=True)
+        self._discard_uncommitted()
+        self._open_parts()
+
+    def _load_journal(self):
+        path = os.path.join(self.dir, JOURNAL)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            journal = json.load(f)
+        if journal.get("key") != self.key:
+            print(f" Discarding the journal of {os.path.basename(self.path)}: inputs or settings changed")
+            return None
+        return journal
+
+    def _part(self, chunk, kind):
+        return os.path.join(self.dir, f"{chunk:06d}.{kind}")
+
+    def _discard_uncommitted(self):
+        for name in os.listdir(self.dir):
+            stem, _, kind = name.partition(".")
+            if kind.endswith(".part") or (stem.isdigit() and int(stem) >= self.chunk):
+                os.remove(os.path.join(self.dir, name))
+
+    def _open_parts(self):
+        self._images = open(self._part(self.chunk, "images") + ".part", "w")
+        self._annotations = open(self._part(self.chunk, "annotations") + ".part", "w")
+
+    def _seal_parts(self):
+        for f, kind in ((self._images, "images"), (self._annotations, "annotations")):
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            os.replace(f.name, self._part(self.chunk, kind))
+
+    # CocoWriter API
+    def add_image(self, image):
+        self._images.write(self._item(image, self.num_images))
+        self.num_images += 1
+
+    def add_annotation(self, ann):
+        self._annotations.write(self._item(ann, self.num_annotations))
+        self.num_annotations += 1
+
+    def commit(self, state, changes=None):
+        """Makes everything written so far durable, together with the caller's progress state.
+
+        `state` replaces the previous one and should stay small; `changes`
+        belongs to this chunk and is handed back by committed_changes().
+        """
+        if changes is not None:
+            tmp_path = self._part(self.chunk, "changes") + ".part"
+            with open(tmp_path, "w") as f:
+                json.dump(changes, f)
+            _fsync_replace(tmp_path, self._part(self.chunk, "changes"))
+        self._seal_parts()
+        self.chunk += 1
+        self.state = state
+        journal = {"key": self.key, "chunk": self.chunk, "num_images": self.num_images,
+                   "num_annotations": self.num_annotations, "state": state}
+        tmp_path = os.path.join(self.dir, JOURNAL + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(journal, f)
+        _fsync_replace(tmp_path, os.path.join(self.dir, JOURNAL))
+        self._open_parts()
+
+    def committed_changes(self):
+        """The `changes` of every committed chunk, in commit order."""
+        for chunk in range(self.chunk):
+            path = self._part(chunk, "changes")
+            if os.path.exists(path):
+                with open(path) as f:
+                    yield json.load(f)
+
+    def close(self):
+        if self._images is None:
+            return
+        self._seal_parts()
+        self._images = self._annotations = None
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as self._f:
+            self._f.write("{")
+            self._open_section("images")
+            for chunk in range(self.chunk + 1):
+                with open(self._part(chunk, "images")) as part:
+                    shutil.copyfileobj(part, self._f)
+            self._close_section(self.num_images)
+            self._open_section("annotations", first=False)
+            for chunk in range(self.chunk + 1):
+                with open(self._part(chunk, "annotations")) as part:
+                    shutil.copyfileobj(part, self._f)
+            self._close_section(self.num_annotations)
+
+            self._open_section("categories", first=False)
+            for i, cat in enumerate(self.categories):
+                self._f.write(self._item(cat, i))
+            self._close_section(len(self.categories))
+            self._f.write(self._newline(0) + "}")
+        self._f = None
+        os.replace(tmp_path, self.path)
+        shutil.rmtree(self.dir)
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._images is not None:
+            # Keep the journal; the chunk in progress is dropped on resume
+            self._images.close()
+            self._annotations.close()
+            self._images = self._annotations = None
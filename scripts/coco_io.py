@@ -0,0 +1,262 @@
+"""
+coco_io.py
+
+Streaming reader/writer for COCO JSON files.
+
+Functionality:
+- CocoWriter emits images and annotations as they are produced instead of
+  building the whole document in memory. Indented output is byte-identical
+  to json.dump(coco, f, indent=N); a compact mode drops all whitespace.
+- iter_images / iter_annotations yield one record at a time from a COCO file
+  without materializing the full document.
+- load_categories reads the small top-level sections only.
+- iter_sections walks several top-level arrays in a single read.
+
+Used by every script in this folder that reads or writes COCO JSON.
+"""
+
+import os
+import re
+import json
+import shutil
+import tempfile
+
+# Write compact (non-indented) JSON everywhere; the readers accept both forms
+COMPACT_JSON = False
+
+READ_CHUNK_SIZE = 1 << 20
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_DECODER = json.JSONDecoder()
+
+
+class CocoWriter:
+    """Incrementally writes {"images": [...], "annotations": [...], "categories": [...]}.
+
+    With interleaved=True (the default) images and annotations may arrive in
+    any order; annotations are spooled to a temporary file next to the output
+    and appended on close. With interleaved=False all images must be added
+    before the first annotation, and both are written straight through.
+    """
+
+    def __init__(self, path, categories=None, indent=4, compact=None, interleaved=True):
+        self.path = path
+        self.categories = categories if categories is not None else []
+        self.compact = COMPACT_JSON if compact is None else compact
+        self.indent = None if self.compact else indent
+        self.interleaved = interleaved
+        self.num_images = 0
+        self.num_annotations = 0
+
+        out_dir = os.path.dirname(os.path.abspath(path))
+        os.makedirs(out_dir, exist_ok=True)
+        self._f = open(path, "w")
+        self._f.write("{")
+        self._open_section("images")
+        self._images_open = True
+        self._spool = tempfile.TemporaryFile("w+", dir=out_dir) if interleaved else None
+
+    # Formatting helpers
+    def _newline(self, level):
+        return "" if self.indent is None else "\n" + " " * (self.indent * level)
+
+    def _dumps(self, obj, level):
+        if self.indent is None:
+            return json.dumps(obj, separators=(",", ":"))
+        return json.dumps(obj, indent=self.indent).replace("\n", self._newline(level))
+
+    def _open_section(self, key, first=True):
+        sep = ":" if self.indent is None else ": "
+        self._f.write(("" if first else ",") + self._newline(1) + json.dumps(key) + sep + "[")
+
+    def _close_section(self, count):
+        self._f.write((self._newline(1) if count else "") + "]")
+
+    def _item(self, obj, index):
+        return ("," if index else "") + self._newline(2) + self._dumps(obj, 2)
+
+    def _end_images(self):
+        if self._images_open:
+            self._close_section(self.num_images)
+            self._open_section("annotations", first=False)
+            self._images_open = False
+
+    # Public API
+    def add_image(self, image):
+        if not self._images_open:
+            raise RuntimeError("add_image() called after annotations were started with interleaved=False")
+        self._f.write(self._item(image, self.num_images))
+        self.num_images += 1
+
+    def add_annotation(self, ann):
+        if self._spool is not None:
+            self._spool.write(self._item(ann, self.num_annotations))
+        else:
+            self._end_images()
+            self._f.write(self._item(ann, self.num_annotations))
+        self.num_annotations += 1
+
+    def add_images(self, images):
+        for image in images:
+            self.add_image(image)
+
+    def add_annotations(self, annotations):
+        for ann in annotations:
+            self.add_annotation(ann)
+
+    def close(self):
+        if self._f is None:
+            return
+        self._end_images()
+        if self._spool is not None:
+            self._spool.seek(0)
+            shutil.copyfileobj(self._spool, self._f)
+            self._spool.close()
+        self._close_section(self.num_annotations)
+
+        self._open_section("categories", first=False)
+        for i, cat in enumerate(self.categories):
+            self._f.write(self._item(cat, i))
+        self._close_section(len(self.categories))
+        self._f.write(self._newline(0) + "}")
+        self._f.close()
+        self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._f.close()
+            if self._spool is not None:
+                self._spool.close()
+            self._f = None
+
+
+def write_coco(path, coco, indent=4, compact=None):
+    """Drop-in replacement for json.dump(coco, f, indent=indent)."""
+    with CocoWriter(path, coco["categories"], indent=indent, compact=compact, interleaved=False) as writer:
+        writer.add_images(coco["images"])
+        writer.add_annotations(coco["annotations"])
+
+
+class _Scanner:
+    """Minimal pull parser over a JSON text file, decoding one value at a time."""
+
+    def __init__(self, f, chunk_size=READ_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        data = self.f.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, ch):
+        found = self.peek()
+        if found != ch:
+            raise ValueError(f"Malformed COCO JSON: expected {ch!r}, found {found!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = _DECODER.raw_decode(self.buf, self.pos)
+                # A value ending exactly at the buffer edge may be truncated (e.g. a number)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def array(self):
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ",":
+                self.pos += 1
+            else:
+                self.expect("]")
+                return
+
+    def members(self, wanted=None):
+        """Yields (key, value) of the top-level object; keys in `wanted` yield an item iterator."""
+        self.expect("{")
+        if self.peek() == "}":
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            if wanted is not None and key in wanted:
+                yield key, self.array()
+            elif self.peek() == "[":
+                # Skip large arrays one element at a time
+                for _ in self.array():
+                    pass
+            else:
+                yield key, self.value()
+            if self.peek() == ",":
+                self.pos += 1
+            else:
+                self.expect("}")
+                return
+
+
+def iter_section(path, key):
+    """Yields the elements of the top-level array `key` one at a time."""
+    with open(path, "r") as f:
+        for name, items in _Scanner(f).members(wanted={key}):
+            if name == key:
+                yield from items
+                return
+
+
+def iter_sections(path, keys=("images", "annotations", "categories")):
+    """Yields (key, item iterator) for the wanted top-level arrays in file order, in one read.
+
+    Each item iterator must be consumed before advancing to the next section.
+    """
+    with open(path, "r") as f:
+        for name, items in _Scanner(f).members(wanted=set(keys)):
+            if name in keys:
+                yield name, items
+
+
+def iter_images(path):
+    return iter_section(path, "images")
+
+
+def iter_annotations(path):
+    return iter_section(path, "annotations")
+
+
+def load_categories(path):
+    return list(iter_section(path, "categories"))
+
+
+def load_coco(path):
+    with open(path, "r") as f:
+        return json.load(f)
@@ -4,9 +4,13 @@ convert_coco_to_yolo.py
 Converts COCO-format annotation JSON files to YOLOv8 format.
 
 Functionality:
-- Reads a COCO JSON file containing image and annotation data.
-- Extracts bounding boxes and remaps category IDs.
-- Saves YOLO-style '.txt' files into train/val/test label folders.
+- Reads a COCO JSON file (or a binary annotation store, see annotation_store.py)
+  containing image and annotation data.
+- Builds image/category indexes once and normalizes all bounding boxes
+  with NumPy array math instead of per-annotation lookups.
+- Groups boxes by image with a stable argsort and writes the label files in bulk.
+- Saves YOLO-style '.txt' files into train/val/test label folders,
+  optionally converting the splits in parallel worker processes.
 
 Use this script after generating or receiving COCO-formatted labels.
 """
@@ -14,46 +18,126 @@ Use this script after generating or receiving COCO-formatted labels.
 import os
 import json
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 from tqdm import tqdm
+from annotation_store import is_store, to_yolo
+import instrument
 
-def convert_annotations(coco_json_path, output_dir):
-    with open(coco_json_path, 'r') as f:
-        data = json.load(f)
+# Convert the train/val/test splits in separate worker processes
+PARALLEL_SPLITS = True
+
+# "split": labels/<split>/*.txt (images/<split> layout)
+# "flat": labels/*.txt for all splits (manifest layout, see split_cleaned_code.py)
+LABEL_LAYOUT = "split"
 
-    image_id_to_filename = {img['id']: img['file_name'] for img in data['images']}
+LINE_FORMAT = "%d %.6f %.6f %.6f %.6f"
+
+
+def build_indexes(data):
+    """Returns (image_ids, file_names, widths, heights, category_id_to_index)"""
+    # A dict keeps the first position of an id and the last record seen for it,
+    # which is what the original per-id dicts did.
+    images = {img['id']: img for img in data['images']}
+    image_ids = list(images)
+    file_names = [images[i]['file_name'] for i in image_ids]
+    widths = np.array([images[i]['width'] for i in image_ids], dtype=np.float64)
+    heights = np.array([images[i]['height'] for i in image_ids], dtype=np.float64)
     category_id_to_index = {cat['id']: idx for idx, cat in enumerate(data['categories'])}
+    return image_ids, file_names, widths, heights, category_id_to_index
+
+
+def lookup(keys, table, what):
+    """Maps every value in `keys` through `table`, raising on unknown values."""
+    try:
+        return np.fromiter((table[k] for k in keys), dtype=np.int64, count=len(keys))
+    except KeyError as e:
+        raise KeyError(f"Annotation references unknown {what} {e.args[0]!r}") from None
+
+
+def normalize_boxes(bboxes, widths, heights):
+    """COCO [x, y, w, h] pixel boxes -> YOLO [xc, yc, w, h] normalized boxes.
+
+    The operation order matches the scalar implementation so that the
+    formatted output is byte-identical.
+    """
+    x, y, w, h = bboxes.T
+    x_center = (x + w / 2) / widths
+    y_center = (y + h / 2) / heights
+    return np.stack([x_center, y_center, w / widths, h / heights], axis=1)
+
+
+def format_labels(num_images, image_index, class_ids, boxes):
+    """Returns one label file body per image, grouping rows with a stable argsort."""
+    order = np.argsort(image_index, kind="stable")
+    sorted_index = image_index[order]
+    bounds = np.searchsorted(sorted_index, np.arange(num_images + 1))
+
+    rows = zip(class_ids[order].tolist(), *boxes[order].T.tolist())
+    lines = [LINE_FORMAT % row for row in rows]
+    return ["\n".join(lines[bounds[i]:bounds[i + 1]]) for i in range(num_images)]
+
+
+def write_labels(label_output_dir, file_names, bodies, desc=None):
+    for file_name, body in tqdm(zip(file_names, bodies), total=len(file_names), desc=desc):
+        filename = Path(file_name).stem + ".txt"
+        with open(label_output_dir / filename, 'w') as f:
+            f.write(body)
+
+
+def convert_arrays(image_ids, file_names, widths, heights, ann_image_ids, bboxes,
+                   class_ids, output_dir, desc=None):
+    """Array-level conversion engine shared by the JSON and binary-store readers."""
+    image_index_of = {img_id: idx for idx, img_id in enumerate(image_ids)}
+    image_index = lookup(ann_image_ids, image_index_of, "image_id")
+
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    boxes = normalize_boxes(bboxes, widths[image_index], heights[image_index])
+    bodies = format_labels(len(image_ids), image_index, np.asarray(class_ids), boxes)
 
     # Create output folder
     label_output_dir = Path(output_dir)
     label_output_dir.mkdir(parents=True, exist_ok=True)
+    with instrument.span("write labels", files=len(file_names), boxes=len(boxes)):
+        write_labels(label_output_dir, file_names, bodies, desc=desc)
 
-    # Prepare label dict
-    label_dict = {img['id']: [] for img in data['images']}
 
-    for ann in tqdm(data['annotations'], desc=f"Processing {Path(coco_json_path).name}"):
-        img_id = ann['image_id']
-        bbox = ann['bbox']  # [x, y, width, height]
-        category_id = ann['category_id']
+def convert_annotations(coco_json_path, output_dir):
+    # Binary annotation stores (annotation_store.py) skip JSON parsing entirely
+    if is_store(coco_json_path):
+        to_yolo(coco_json_path, output_dir, desc=f"Processing {Path(coco_json_path).name}")
+        return
 
-        x, y, w, h = bbox
-        x_center = x + w / 2
-        y_center = y + h / 2
+    with instrument.span("load json"), open(coco_json_path, 'r') as f:
+        data = json.load(f)
 
-        img_info = next(img for img in data['images'] if img['id'] == img_id)
-        img_w, img_h = img_info['width'], img_info['height']
+    image_ids, file_names, widths, heights, category_id_to_index = build_indexes(data)
+    annotations = data['annotations']
 
-        x_center /= img_w
-        y_center /= img_h
-        w /= img_w
-        h /= img_h
+    ann_image_ids = [ann['image_id'] for ann in annotations]
+    bboxes = [ann['bbox'] for ann in annotations]  # [x, y, width, height]
+    class_ids = lookup([ann['category_id'] for ann in annotations], category_id_to_index, "category_id")
 
-        class_id = category_id_to_index[category_id]
-        label_dict[img_id].append(f"{class_id} {x_center:.6f} {y_center:.6f} {w:.6f} {h:.6f}")
+    convert_arrays(image_ids, file_names, widths, heights, ann_image_ids, bboxes, class_ids,
+                   output_dir, desc=f"Processing {Path(coco_json_path).name}")
+
+
+def convert_splits(base_path, out_base, splits, parallel=PARALLEL_SPLITS, layout=LABEL_LAYOUT):
+    """Converts every split, one worker process per split when `parallel` is set."""
+    jobs = [(os.path.join(base_path, filename), out_base if layout == "flat" else os.path.join(out_base, split))
+            for split, filename in splits.items()]
+
+    if not parallel or len(jobs) < 2:
+        for coco_json_path, output_dir in jobs:
+            convert_annotations(coco_json_path, output_dir)
+        return
+
+    with ProcessPoolExecutor(max_workers=len(jobs)) as pool:
+        futures = [pool.submit(convert_annotations, *job) for job in jobs]
+        for future in futures:
+            future.result()
 
-    for img_id, lines in label_dict.items():
-        filename = Path(image_id_to_filename[img_id]).stem + ".txt"
-        with open(label_output_dir / filename, 'w') as f:
-            f.write("\n".join(lines))
 
 if __name__ == "__main__":
     base_path = "data/merged/annotations"
@@ -65,9 +149,6 @@ if __name__ == "__main__":
         "test": "test_coco_reindexed.json"
     }
 
-    for split, filename in splits.items():
-        coco_json_path = os.path.join(base_path, filename)
-        output_dir = os.path.join(out_base, split)
-        convert_annotations(coco_json_path, output_dir)
+    convert_splits(base_path, out_base, splits)
 
-    print(" All annotations converted to YOLO format.")
\ No newline at end of file
+    print(" All annotations converted to YOLO format.")
@@ -0,0 +1,321 @@
+"""
+evaluate_predictions.py
+
+Offline detection metrics from saved prediction files, without the model.
+
+Functionality:
+- Reads the YOLO txt predictions written by predict(save_txt=True,
+  save_conf=True) (or sliced_inference.py / onnx_inference.py) and the
+  ground truth of a split: a COCO JSON (e.g. test_coco_reindexed.json) or a
+  YOLO label folder.
+- Matches predictions to ground truth once for all IoU thresholds
+  (0.50:0.05:0.95): IoU matrices per image with box_ops.overlap_matrix, then
+  one vectorized assignment per threshold over all candidate pairs.
+- AP from cumulative-sum precision/recall curves with COCO 101-point
+  interpolation; reports mAP@0.5 and mAP@0.5:0.95 overall and per class.
+- Slices the same matches by source dataset ("source" field written by
+  merge_coco_and_images.py) and COCO box-size bucket (small / medium /
+  large by pixel area; predictions matched to boxes of another bucket are
+  ignored, as in COCOeval).
+
+Usage:
+    python scripts/evaluate_predictions.py --predictions runs/detect/predict/labels \
+        --ground-truth data/merged/annotations/test_coco_reindexed.json --output runs/detect/predict/metrics.json
+    python scripts/evaluate_predictions.py --ground-truth data/merged/labels/test --images data/merged/images/test \
+        --sources data/merged/merged_coco_cleaned.json
+"""
+
+import os
+import json
+import time
+import argparse
+from array import array
+
+import numpy as np
+
+from box_ops import overlap_matrix
+from coco_io import iter_sections
+from image_probe import probe_dir
+from check_class_distribution import UNKNOWN_SOURCE, source_map_from_coco
+from remap_coco_category_ids import new_categories
+
+# CONFIG
+PREDICTIONS_DIR = "runs/detect/predict/labels"
+GROUND_TRUTH = "data/merged/annotations/test_coco_reindexed.json"
+OUTPUT_PATH = None  # e.g. "runs/detect/predict/metrics.json"
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+RECALL_POINTS = np.linspace(0, 1, 101)
+# COCO area ranges in original-image pixels
+SIZE_BUCKETS = {"small": (0, 32 ** 2), "medium": (32 ** 2, 96 ** 2), "large": (96 ** 2, np.inf)}
+
+
+def xywh_to_xyxy(boxes):
+    xy, wh = boxes[:, :2], boxes[:, 2:4]
+    return np.concatenate([xy - wh / 2, xy + wh / 2], axis=1)
+
+
+def read_label_rows(label_dir, names, columns):
+    """Rows with `columns` values from every label file, plus the file index of each row."""
+    tokens, file_index = [], array("q")
+    for i, name in enumerate(names):
+        path = os.path.join(label_dir, name)
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            rows = [r for r in (line.split() for line in f) if len(r) == columns]
+        tokens += [t for r in rows for t in r]
+        file_index.extend([i] * len(rows))
+    return np.array(tokens, dtype=np.float64).reshape(-1, columns), np.frombuffer(file_index, dtype=np.int64)
+
+
+# Ground truth: per image (stem, width, height, source) and per box
+# (image_index, cls as category position, normalized xyxy box).
+def _ground_truth(stems, width, height, source, sources, image_index, cls, boxes, names):
+    return {"stems": stems, "width": np.asarray(width, dtype=np.float64),
+            "height": np.asarray(height, dtype=np.float64), "source": np.asarray(source, dtype=np.int64),
+            "sources": sources, "image_index": np.asarray(image_index, dtype=np.int64),
+            "cls": np.asarray(cls, dtype=np.int64), "boxes": boxes, "names": names}
+
+
+def load_coco_ground_truth(path):
+    """Ground truth from a COCO JSON (single streaming pass); classes are category positions."""
+    stems, image_ids, width, height, source = [], [], array("d"), array("d"), array("q")
+    ann_image_ids, category_ids, bboxes = array("q"), array("q"), array("d")
+    sources, categories = {}, []
+    for key, items in iter_sections(path):
+        if key == "images":
+            for img in items:
+                image_ids.append(img["id"])
+                stems.append(os.path.splitext(img["file_name"])[0])
+                width.append(img["width"])
+                height.append(img["height"])
+                source.append(sources.setdefault(img.get("source") or UNKNOWN_SOURCE, len(sources)))
+        elif key == "annotations":
+            for ann in items:
+                ann_image_ids.append(ann["image_id"])
+                category_ids.append(ann["category_id"])
+                bboxes.extend(ann["bbox"][:4])
+        else:
+            categories = list(items)
+
+    index_of = {img_id: i for i, img_id in enumerate(image_ids)}
+    position = {cat["id"]: i for i, cat in enumerate(categories)}
+    image_index = np.fromiter((index_of.get(i, -1) for i in ann_image_ids), dtype=np.int64,
+                              count=len(ann_image_ids))
+    cls = np.fromiter((position.get(c, -1) for c in category_ids), dtype=np.int64, count=len(category_ids))
+    keep = (image_index >= 0) & (cls >= 0)
+    image_index, cls = image_index[keep], cls[keep]
+
+    width, height = np.frombuffer(width, dtype=np.float64), np.frombuffer(height, dtype=np.float64)
+    xywh = np.frombuffer(bboxes, dtype=np.float64).reshape(-1, 4)[keep]
+    scale = np.stack([width, height, width, height], axis=1)[image_index]
+    boxes = np.concatenate([xywh[:, :2], xywh[:, :2] + xywh[:, 2:]], axis=1) / scale
+    return _ground_truth(stems, width, height, source, list(sources), image_index, cls, boxes,
+                         [cat["name"] for cat in categories])
+
+
+def load_yolo_ground_truth(label_dir, img_dir=None, categories=new_categories, source_map=None):
+    """Ground truth from a YOLO label folder.
+
+    Pixel sizes (needed for the size buckets) come from the image headers in
+    img_dir; source_map ({file stem: source}) attributes images to datasets.
+    """
+    names = sorted(f for f in os.listdir(label_dir) if f.endswith(".txt"))
+    stems = [os.path.splitext(f)[0] for f in names]
+    width, height = np.full(len(names), np.nan), np.full(len(names), np.nan)
+    if img_dir:
+        images = {os.path.splitext(f)[0]: f for f in os.listdir(img_dir)}
+        sizes = probe_dir(img_dir, [images[s] for s in stems if s in images])
+        for i, stem in enumerate(stems):
+            size = sizes.get(images.get(stem))
+            if size:
+                width[i], height[i] = size
+
+    sources = {}
+    source = [sources.setdefault((source_map or {}).get(stem, UNKNOWN_SOURCE), len(sources)) for stem in stems]
+    rows, image_index = read_label_rows(label_dir, names, 5)
+    return _ground_truth(stems, width, height, source, list(sources), image_index, rows[:, 0].astype(np.int64),
+                         xywh_to_xyxy(rows[:, 1:5]), [cat["name"] for cat in categories])
+
+
+def load_ground_truth(path, img_dir=None, source_map=None):
+    if os.path.isdir(path):
+        return load_yolo_ground_truth(path, img_dir, source_map=source_map)
+    return load_coco_ground_truth(path)
+
+
+def load_predictions(pred_dir, stems):
+    """Predictions for the ground-truth images (same file stem); returns (predictions, files without ground truth)."""
+    files = {os.path.splitext(f)[0] for f in os.listdir(pred_dir) if f.endswith(".txt")}
+    rows, image_index = read_label_rows(pred_dir, [f"{stem}.txt" for stem in stems], 6)
+    unmatched = len(files - set(stems))
+    return {"image_index": image_index, "cls": rows[:, 0].astype(np.int64), "boxes": xywh_to_xyxy(rows[:, 1:5]),
+            "conf": rows[:, 5]}, unmatched
+
+
+def _group_bounds(image_index, num_images):
+    order = np.argsort(image_index, kind="stable")
+    return order, np.searchsorted(image_index[order], np.arange(num_images + 1))
+
+
+def match_predictions(gt, pred, iou_thresholds=IOU_THRESHOLDS):
+    """Index of the ground-truth box each prediction matches, per IoU threshold: (n_pred, T), -1 if none.
+
+    Candidate pairs (same image, same class, IoU >= the lowest threshold)
+    are collected with one IoU matrix per image; each threshold then takes
+    the pairs above it in descending IoU order, using every prediction and
+    every ground-truth box at most once (the assignment of ultralytics' val).
+    """
+    num_images = len(gt["stems"])
+    gt_order, gt_bounds = _group_bounds(gt["image_index"], num_images)
+    pred_order, pred_bounds = _group_bounds(pred["image_index"], num_images)
+
+    pair_gt, pair_pred, pair_iou = [], [], []
+    for i in np.flatnonzero((np.diff(gt_bounds) > 0) & (np.diff(pred_bounds) > 0)):
+        g = gt_order[gt_bounds[i]:gt_bounds[i + 1]]
+        p = pred_order[pred_bounds[i]:pred_bounds[i + 1]]
+        iou = overlap_matrix(gt["boxes"][g], pred["boxes"][p])
+        iou[gt["cls"][g][:, None] != pred["cls"][p][None, :]] = 0
+        gi, pi = np.nonzero(iou >= iou_thresholds[0])
+        pair_gt.append(g[gi])
+        pair_pred.append(p[pi])
+        pair_iou.append(iou[gi, pi])
+
+    matched = np.full((len(pred["conf"]), len(iou_thresholds)), -1, dtype=np.int64)
+    if not pair_iou:
+        return matched
+    pair_gt, pair_pred, pair_iou = np.concatenate(pair_gt), np.concatenate(pair_pred), np.concatenate(pair_iou)
+    order = np.argsort(-pair_iou, kind="stable")
+    pair_gt, pair_pred, pair_iou = pair_gt[order], pair_pred[order], pair_iou[order]
+    for t, threshold in enumerate(iou_thresholds):
+        sel = np.flatnonzero(pair_iou >= threshold)
+        sel = np.sort(sel[np.unique(pair_pred[sel], return_index=True)[1]])  # best pair per prediction
+        sel = sel[np.unique(pair_gt[sel], return_index=True)[1]]  # then best per ground-truth box
+        matched[pair_pred[sel], t] = pair_gt[sel]
+    return matched
+
+
+def average_precision(tp, valid, conf, num_gt):
+    """AP per IoU threshold from (n, T) true-positive / counted flags, COCO 101-point interpolation."""
+    if num_gt == 0:
+        return np.full(tp.shape[1], np.nan)
+    order = np.argsort(-conf, kind="stable")
+    tp, valid = tp[order], valid[order]
+    tpc = np.cumsum(tp, axis=0)
+    fpc = np.cumsum(valid & ~tp, axis=0)
+    recall = tpc / num_gt
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(tpc + fpc > 0, tpc / (tpc + fpc), 0.0)
+    precision = np.maximum.accumulate(precision[::-1], axis=0)[::-1]  # monotone envelope
+
+    ap = np.zeros(tp.shape[1])
+    for t in range(tp.shape[1]):
+        idx = np.searchsorted(recall[:, t], RECALL_POINTS, side="left")
+        ap[t] = precision[idx[idx < len(recall)], t].sum() / len(RECALL_POINTS)  # unreached recall counts as 0
+    return ap
+
+
+def slice_metrics(gt, pred, matched, gt_keep, pred_keep, pred_in_range=None):
+    """Metrics over the ground truth in gt_keep and the predictions in pred_keep.
+
+    Predictions matched to ground truth outside the slice are ignored; with
+    an area range (pred_in_range), so are unmatched predictions outside it.
+    """
+    hit = matched >= 0
+    tp = hit.copy()
+    tp[hit] = gt_keep[matched[hit]]  # indexing only matched entries also works with no ground truth
+    valid = pred_keep[:, None] & (tp | ~hit)
+    if pred_in_range is not None:
+        valid &= tp | pred_in_range[:, None]
+
+    num_classes = len(gt["names"])
+    num_gt = np.bincount(gt["cls"][gt_keep], minlength=num_classes)
+    ap = np.full((num_classes, matched.shape[1]), np.nan)
+    for c in range(num_classes):
+        rows = (pred["cls"] == c) & valid.any(axis=1)
+        ap[c] = average_precision(tp[rows], valid[rows], pred["conf"][rows], num_gt[c])
+
+    present = num_gt > 0
+    summary = {"ground_truth": int(num_gt.sum()), "predictions": int(valid[:, 0].sum()),
+               "map50": round(float(ap[present, 0].mean()), 4) if present.any() else None,
+               "map50_95": round(float(ap[present].mean()), 4) if present.any() else None, "classes": {}}
+    for c, name in enumerate(gt["names"]):
+        if present[c]:
+            summary["classes"][name] = {"ground_truth": int(num_gt[c]), "ap50": round(float(ap[c, 0]), 4),
+                                        "ap50_95": round(float(ap[c].mean()), 4)}
+    return summary
+
+
+def evaluate(gt, pred, iou_thresholds=IOU_THRESHOLDS):
+    """Overall, per-source and per-size-bucket metrics."""
+    matched = match_predictions(gt, pred, iou_thresholds)
+    all_gt = np.ones(len(gt["cls"]), dtype=bool)
+    all_pred = np.ones(len(pred["conf"]), dtype=bool)
+    result = {"iou_thresholds": [round(float(t), 2) for t in iou_thresholds], "images": len(gt["stems"]),
+              "all": slice_metrics(gt, pred, matched, all_gt, all_pred), "sources": {}, "sizes": {}}
+
+    for s, name in enumerate(gt["sources"]):
+        image_keep = gt["source"] == s
+        result["sources"][name] = slice_metrics(gt, pred, matched, image_keep[gt["image_index"]],
+                                                image_keep[pred["image_index"]])
+
+    def pixel_area(boxes, image_index):
+        wh = boxes[:, 2:] - boxes[:, :2]
+        return wh[:, 0] * wh[:, 1] * gt["width"][image_index] * gt["height"][image_index]
+
+    gt_area = pixel_area(gt["boxes"], gt["image_index"])
+    pred_area = pixel_area(pred["boxes"], pred["image_index"])
+    if np.isfinite(gt_area).any():
+        for name, (low, high) in SIZE_BUCKETS.items():
+            result["sizes"][name] = slice_metrics(gt, pred, matched, (gt_area >= low) & (gt_area < high), all_pred,
+                                                  (pred_area >= low) & (pred_area < high))
+    return result
+
+
+def print_results(result):
+    def row(label, summary):
+        fmt = lambda v: "-" if v is None else f"{v:.4f}"
+        print(f"  {label:28s}{summary['ground_truth']:>9d}{summary.get('predictions', ''):>9}"
+              f"{fmt(summary.get('map50', summary.get('ap50'))):>10s}"
+              f"{fmt(summary.get('map50_95', summary.get('ap50_95'))):>11s}")
+
+    print(f"\n  {'slice':28s}{'boxes':>9s}{'preds':>9s}{'mAP50':>10s}{'mAP50-95':>11s}")
+    row("all", result["all"])
+    for name, summary in result["all"]["classes"].items():
+        row(f"  class {name}", summary)
+    for name, summary in result["sources"].items():
+        row(f"source {name}", summary)
+    for name, summary in result["sizes"].items():
+        row(f"size {name}", summary)
+
+
+def evaluate_predictions(pred_dir=PREDICTIONS_DIR, ground_truth=GROUND_TRUTH, img_dir=None, source_coco=None,
+                         output_path=OUTPUT_PATH):
+    start = time.perf_counter()
+    source_map = source_map_from_coco(source_coco) if source_coco else None
+    gt = load_ground_truth(ground_truth, img_dir, source_map)
+    pred, unmatched = load_predictions(pred_dir, gt["stems"])
+    if unmatched:
+        print(f" Warning: {unmatched} prediction files have no ground-truth image and were ignored")
+    result = evaluate(gt, pred)
+    print_results(result)
+    print(f"\n Evaluated {len(gt['stems'])} images, {len(gt['cls'])} boxes, {len(pred['conf'])} predictions "
+          f"in {time.perf_counter() - start:.2f}s")
+    if output_path:
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        with open(output_path, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f" Metrics saved: {output_path}")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="mAP from saved YOLO txt predictions, by class, source and size.")
+    parser.add_argument("--predictions", default=PREDICTIONS_DIR, help="folder of <stem>.txt prediction files")
+    parser.add_argument("--ground-truth", default=GROUND_TRUTH, help="COCO JSON or YOLO label folder")
+    parser.add_argument("--images", help="image folder, for pixel sizes of YOLO ground truth")
+    parser.add_argument("--sources", help="COCO JSON with image \"source\" fields, to attribute YOLO ground truth")
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    args = parser.parse_args()
+
+    evaluate_predictions(args.predictions, args.ground_truth, args.images, args.sources, args.output)
@@ -0,0 +1,138 @@
+"""
+file_placement.py
+
+Places image files into the merged/split dataset folders without copying
+the bytes where the filesystem allows it, and detects byte-identical files.
+
+Functionality:
+- place_file() hardlinks, reflinks (copy-on-write clone) or symlinks a file,
+  falling back to a regular copy when the link cannot be made.
+- ContentIndex finds byte-identical files by size first and content hash
+  second, so only files whose sizes collide are ever hashed.
+
+Used by merge_coco_and_images.py and split_cleaned_code.py.
+"""
+
+import os
+import sys
+import shutil
+import hashlib
+
+# "auto" tries reflink, then hardlink, then falls back to copy
+LINK_MODES = ("copy", "hardlink", "reflink", "symlink", "auto")
+
+# ioctl request number of FICLONE on Linux (btrfs, XFS, bcachefs, ...)
+FICLONE = 0x40049409
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def _reflink(src, dst):
+    if not sys.platform.startswith("linux"):
+        raise OSError("reflink is only supported on Linux")
+    import fcntl
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+    shutil.copymode(src, dst)
+
+
+def _link(src, dst, mode):
+    if mode == "hardlink":
+        os.link(src, dst)
+    elif mode == "reflink":
+        _reflink(src, dst)
+    elif mode == "symlink":
+        os.symlink(os.path.abspath(src), dst)
+    else:
+        raise ValueError(f"Unknown link mode: {mode!r} (expected one of {LINK_MODES})")
+
+
+def place_file(src, dst, mode="copy"):
+    """Places `src` at `dst` and returns the method actually used.
+
+    Any existing `dst` is replaced, as shutil.copy did. Link failures (cross
+    device, unsupported filesystem, no permission) fall back to a copy.
+    Note that hardlinked files share their bytes with the source, so they
+    must not be modified in place.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    attempts = {"auto": ["reflink", "hardlink"], "copy": []}.get(mode, [mode])
+    for method in attempts:
+        try:
+            _link(src, dst, method)
+            return method
+        except OSError:
+            continue
+
+    shutil.copy(src, dst)
+    return "copy"
+
+
+def file_digest(path):
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ContentIndex:
+    """Maps file contents to the key of the first file seen with those bytes."""
+
+    def __init__(self, track_changes=False):
+        self.by_size = {}  # size -> [[path, digest or None, key], ...]
+        self._changes = [] if track_changes else None
+
+    def find_or_add(self, path, key, size=None):
+        """Returns the key of an identical earlier file, or registers `path` under `key` and returns None."""
+        if size is None:
+            size = os.path.getsize(path)
+        entries = self.by_size.setdefault(size, [])
+        if not entries:
+            self._add(size, [path, None, key])
+            return None
+
+        digest = file_digest(path)
+        for position, entry in enumerate(entries):
+            if entry[1] is None:
+                entry[1] = file_digest(entry[0])
+                if self._changes is not None:
+                    self._changes.append(["digest", size, position, entry[1]])
+            if entry[1] == digest:
+                return entry[2]
+        self._add(size, [path, digest, key])
+        return None
+
+    def _add(self, size, entry):
+        self.by_size[size].append(entry)
+        if self._changes is not None:
+            self._changes.append(["add", size, *entry])
+
+    def changes(self):
+        """Entries added or hashed since the previous call (needs track_changes), for checkpoint journals."""
+        changes, self._changes = self._changes, []
+        return changes
+
+    def replay(self, changes):
+        for op, size, *args in changes:
+            if op == "add":
+                self.by_size.setdefault(size, []).append(args)
+            else:
+                position, digest = args
+                self.by_size[size][position][1] = digest
+
+
+def format_bytes(num_bytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
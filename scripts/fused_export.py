@@ -0,0 +1,161 @@
+"""
+fused_export.py
+
+Single-pass replacement for remove_irrelavant_classes.py → split_cleaned_code.py
+→ remap_coco_category_ids.py → convert_coco_to_yolo.py.
+
+Functionality:
+- Reads the merged COCO file once, dropping removed classes on the fly.
+- Splits the remaining images with the same seed/strategy as split_cleaned_code.py.
+- Remaps category IDs and writes the per-split {split}_coco_reindexed.json
+  files and YOLO labels directly, without the intermediate JSON round trips.
+- Output is the same as running the four scripts in sequence (the
+  intermediate merged_coco_cleaned.json and {split}_coco.json are not written).
+
+Configuration defaults are taken from the individual scripts, so both paths
+stay in sync.
+"""
+
+import os
+import json
+import tempfile
+from array import array
+
+import numpy as np
+from tqdm import tqdm
+
+import remove_irrelavant_classes as clean
+import split_cleaned_code as split_cfg
+import remap_coco_category_ids as remap_cfg
+import convert_coco_to_yolo as yolo_cfg
+from coco_io import CocoWriter, iter_sections
+from split_cleaned_code import SPLITS, make_splits, copy_split_images, write_manifests
+
+# CONFIG
+MERGED_JSON_PATH = clean.merged_json_path
+IMAGE_DIR = clean.image_dir
+OUTPUT_BASE = split_cfg.OUTPUT_BASE
+ANNOTATIONS_DIR = split_cfg.ANNOTATIONS_DIR
+LABELS_DIR = os.path.join(OUTPUT_BASE, "labels")
+
+REMOVE_IDS = clean.remove_ids
+ID_REMAP = remap_cfg.id_remap
+NEW_CATEGORIES = remap_cfg.new_categories
+SEED = split_cfg.SEED
+VAL_RATIO = split_cfg.VAL_RATIO
+TEST_RATIO = split_cfg.TEST_RATIO
+DELETE_ORPHANS = True
+
+
+def scan_merged(json_path, remove_ids, spool):
+    """One pass over the merged file.
+
+    Returns (images, categories, kept annotation image/category ids). Kept
+    annotations are spooled to `spool` as JSON lines so memory holds only
+    the image list and two integer columns.
+    """
+    images, categories = [], []
+    ann_image_ids, ann_category_ids = array("q"), array("q")
+
+    for key, items in iter_sections(json_path):
+        if key == "images":
+            images = list(items)
+        elif key == "categories":
+            categories = list(items)
+        else:
+            for ann in tqdm(items, desc="Scanning annotations"):
+                if ann["category_id"] in remove_ids:
+                    continue
+                spool.write(json.dumps(ann) + "\n")
+                ann_image_ids.append(ann["image_id"])
+                ann_category_ids.append(ann["category_id"])
+    return images, categories, ann_image_ids, ann_category_ids
+
+
+def fused_export(merged_json_path=MERGED_JSON_PATH, image_dir=IMAGE_DIR, annotations_dir=ANNOTATIONS_DIR,
+                 labels_dir=LABELS_DIR, remove_ids=REMOVE_IDS, id_remap=ID_REMAP, new_categories=NEW_CATEGORIES,
+                 seed=SEED, val_ratio=VAL_RATIO, test_ratio=TEST_RATIO, strategy=split_cfg.SPLIT_STRATEGY,
+                 group_key=split_cfg.GROUP_KEY, placement=split_cfg.PLACEMENT, link_mode=split_cfg.LINK_MODE,
+                 label_layout=yolo_cfg.LABEL_LAYOUT, delete_orphans=DELETE_ORPHANS, output_base=OUTPUT_BASE,
+                 duplicate_clusters=split_cfg.DUPLICATE_CLUSTERS):
+    os.makedirs(annotations_dir, exist_ok=True)
+    group_key = split_cfg.with_duplicate_clusters(group_key, duplicate_clusters)
+
+    with tempfile.TemporaryFile("w+", dir=annotations_dir) as spool:
+        images, categories, ann_image_ids, ann_category_ids = scan_merged(merged_json_path, remove_ids, spool)
+
+        # Clean: keep images that still have annotations
+        valid_image_ids = set(ann_image_ids)
+        cleaned_images = [img for img in images if img["id"] in valid_image_ids]
+        orphans = [img["file_name"] for img in images if img["id"] not in valid_image_ids]
+        cleaned_categories = [c for c in categories if c["id"] not in remove_ids]
+
+        # Split
+        kept = ({"image_id": i, "category_id": c} for i, c in zip(ann_image_ids, ann_category_ids))
+        splits = make_splits(strategy, cleaned_images, kept, cleaned_categories, seed, val_ratio, test_ratio,
+                             group_key)
+        image_id_to_split = {img["id"]: split for split, imgs in splits.items() for img in imgs}
+
+        # Remap + write reindexed COCO, collecting YOLO columns per split
+        writers, columns = {}, {}
+        for split, imgs in splits.items():
+            writers[split] = CocoWriter(os.path.join(annotations_dir, f"{split}_coco_reindexed.json"),
+                                        new_categories, indent=2, interleaved=False)
+            writers[split].add_images(imgs)
+            columns[split] = (array("q"), array("d"), array("q"))
+
+        category_index = {cat["id"]: idx for idx, cat in enumerate(new_categories)}
+        spool.seek(0)
+        for line in spool:
+            ann = json.loads(line)
+            old_id = ann["category_id"]
+            split = image_id_to_split.get(ann["image_id"])
+            if split is None or old_id not in id_remap:
+                continue
+            ann["category_id"] = id_remap[old_id]
+            writers[split].add_annotation(ann)
+
+            image_ids, bboxes, class_ids = columns[split]
+            image_ids.append(ann["image_id"])
+            bboxes.extend(ann["bbox"])
+            class_ids.append(category_index[ann["category_id"]])
+
+    for writer in writers.values():
+        writer.close()
+
+    # YOLO labels through the vectorized converter engine
+    for split, imgs in splits.items():
+        images_by_id = {img["id"]: img for img in imgs}
+        image_ids = list(images_by_id)
+        image_ids_col, bboxes, class_ids = columns[split]
+        yolo_cfg.convert_arrays(
+            image_ids,
+            [images_by_id[i]["file_name"] for i in image_ids],
+            np.array([images_by_id[i]["width"] for i in image_ids], dtype=np.float64),
+            np.array([images_by_id[i]["height"] for i in image_ids], dtype=np.float64),
+            image_ids_col, np.frombuffer(bboxes, dtype=np.float64), np.frombuffer(class_ids, dtype=np.int64),
+            labels_dir if label_layout == "flat" else os.path.join(labels_dir, split),
+            desc=f"Writing {split} labels")
+
+    # Images: delete orphans, then place split images or write manifests
+    deleted = 0
+    if delete_orphans:
+        for fname in orphans:
+            img_path = os.path.join(image_dir, fname)
+            if os.path.exists(img_path):
+                os.remove(img_path)
+                deleted += 1
+    if placement == "manifest":
+        write_manifests(splits, image_dir, output_base)
+    else:
+        copy_split_images(splits, image_dir, os.path.join(output_base, "images"), link_mode)
+
+    print("\n Fused export complete:")
+    for split in SPLITS:
+        print(f"  {split:5s}: {writers[split].num_images} images, {writers[split].num_annotations} annotations")
+    print(f"  Deleted orphan images: {deleted}")
+    return splits
+
+
+if __name__ == "__main__":
+    fused_export()
@@ -5,17 +5,24 @@ Converts HighRPD dataset's annotations to COCO JSON format.
 
 Functionality:
 - Parses each entry to create COCO 'images', 'annotations', and 'categories'.
-- Outputs a clean and valid COCO file for downstream conversion.
+- Reads each image's width/height from its header (see image_probe.py)
+  instead of assuming 640x640, and reports the images that differ.
+- Streams a clean and valid COCO file to disk for downstream conversion,
+  committed in chunks so an interrupted run resumes where it stopped
+  (see checkpoint.py).
 
 """
 
 import os
-import json
+from checkpoint import CHUNK_SIZE, RESUME, ResumableCocoWriter
+from image_probe import SizeReport, probe_dir, load_cache, report_path
+import image_probe
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 IMG_DIR = os.path.join(BASE_DIR, "../data/HighRPD/images")
 LBL_DIR = os.path.join(BASE_DIR, "../data/HighRPD/labels")
 OUT_JSON = os.path.join(BASE_DIR, "../data/HighRPD/highrpd_coco.json")
+DEFAULT_SIZE = (640, 640)  # used when an image header cannot be read
 
 categories = [
 {
@@ -52,20 +59,33 @@ categories = [
 }
 ]
 
-def yolo_to_coco(images_dir, labels_dir, output_json):
-    coco = {"images": [], "annotations": [], "categories": categories}
-    ann_id = 0
-    for img_id, fname in enumerate(sorted(os.listdir(images_dir))):
+def yolo_to_coco(images_dir, labels_dir, output_json, cache=None, resume=RESUME):
+    fnames = sorted(os.listdir(images_dir))
+    sizes = probe_dir(images_dir, [f for f in fnames if f.endswith(".jpg")], cache=cache)
+    labels = sorted((f, os.path.getsize(os.path.join(labels_dir, f))) for f in os.listdir(labels_dir))
+    key = ["yolo", fnames, labels, image_probe.FIX_SIZES, DEFAULT_SIZE]
+    writer = ResumableCocoWriter(output_json, categories, key, resume)
+    report = SizeReport()
+    for changes in writer.committed_changes():
+        report.replay(changes)
+    start = writer.state.get("files", 0)
+    ann_id = writer.num_annotations
+    for img_id in range(start, len(fnames)):
+        if img_id > start and img_id % CHUNK_SIZE == 0:
+            writer.commit({"files": img_id}, report.changes())
+        fname = fnames[img_id]
         if not fname.endswith(".jpg"): continue
         img_path = os.path.join(images_dir, fname)
         lbl_path = os.path.join(labels_dir, fname.replace(".jpg", ".txt"))
         if not os.path.exists(lbl_path): continue
 
-        coco["images"].append({
+        image = {"file_name": fname, "width": DEFAULT_SIZE[0], "height": DEFAULT_SIZE[1]}
+        width, height = report.check(image, sizes.get(fname))
+        writer.add_image({
             "id": img_id,
             "file_name": fname,
-            "width": 640,
-            "height": 640
+            "width": width,
+            "height": height
         })
 
         with open(lbl_path, "r") as f:
@@ -74,21 +94,22 @@ def yolo_to_coco(images_dir, labels_dir, output_json):
                 if len(parts) != 5:
                     continue
                 class_id, xc, yc, w, h = parts
-                x = (xc - w / 2) * 640
-                y = (yc - h / 2) * 640
-                coco["annotations"].append({
+                x = (xc - w / 2) * width
+                y = (yc - h / 2) * height
+                writer.add_annotation({
                     "id": ann_id,
                     "image_id": img_id,
                     "category_id": int(class_id) + 6,
-                    "bbox": [x, y, w * 640, h * 640],
-                    "area": w * h * 640 * 640,
+                    "bbox": [x, y, w * width, h * height],
+                    "area": w * h * width * height,
                     "iscrowd": 0
                 })
                 ann_id += 1
 
-    with open(output_json, "w") as f:
-        json.dump(coco, f, indent=4)
+    writer.close()
+    report.write(report_path(output_json))
     print(f"COCO JSON created at: {output_json}")
+    print(f" Image sizes: {report.summary()}")
 
 if __name__ == "__main__":
-    yolo_to_coco(IMG_DIR, LBL_DIR, OUT_JSON)
+    yolo_to_coco(IMG_DIR, LBL_DIR, OUT_JSON, load_cache())
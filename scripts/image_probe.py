@@ -0,0 +1,279 @@
+"""
+image_probe.py
+
+Reads image dimensions from JPEG/PNG headers without decoding the pixels.
+
+Functionality:
+- probe_size reads only the PNG IHDR chunk or walks the JPEG marker segments
+  up to the first SOF frame header (a few hundred bytes for most files).
+- probe_sizes / probe_dir run the probe over many files in a thread pool.
+- SizeCache persists results keyed by (path, size, mtime), so reruns only
+  touch new or modified files.
+- SizeReport collects files whose recorded width/height disagree with the
+  header (or that cannot be read) and writes them as a JSON report.
+
+Used by the *_to_coco converters and merge_coco_and_images.py to fill in and
+cross-check image sizes.
+
+Usage:
+    python scripts/image_probe.py data/merged/images
+    python scripts/image_probe.py --coco data/merged/merged_coco.json --img-dir data/merged/images \\
+        --report data/merged/size_mismatches.json
+"""
+
+import os
+import json
+import time
+import struct
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_PATH = os.path.join(BASE_DIR, "../data/.image_sizes.json")
+WORKERS = min(32, (os.cpu_count() or 1) * 4)  # header reads are I/O bound
+BATCH_SIZE = 512
+
+# Use the header size when it disagrees with the recorded one (False: only report)
+FIX_SIZES = True
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# SOF0-SOF15 carry the frame size; C4 (DHT), C8 (JPG) and CC (DAC) share the range
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Markers without a length field
+_JPEG_STANDALONE = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+
+def _jpeg_size(f):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b"\xff":  # tolerate garbage between segments
+            byte = f.read(1)
+        while byte == b"\xff":  # fill bytes
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in _JPEG_STANDALONE:
+            continue
+        if marker == 0xD9:  # EOI before any frame header
+            return None
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        if marker in _JPEG_SOF:
+            header = f.read(5)
+            if len(header) < 5:
+                return None
+            height, width = struct.unpack(">HH", header[1:5])
+            return width, height
+        f.seek(struct.unpack(">H", length)[0] - 2, os.SEEK_CUR)
+
+
+def probe_size(path):
+    """Returns (width, height) from the file header, or None if it is not a readable JPEG/PNG."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(24)
+            if head[:8] == _PNG_SIGNATURE and head[12:16] == b"IHDR":
+                return struct.unpack(">II", head[16:24])
+            if head[:2] == b"\xff\xd8":
+                size = _jpeg_size(f)
+                return size if size and size[0] and size[1] else None
+    except OSError:
+        pass
+    return None
+
+
+class SizeCache:
+    """Probe results persisted as {path: [file_size, mtime_ns, width, height]}."""
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+
+    def get(self, path, st):
+        entry = self.entries.get(path)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            return tuple(entry[2:]) if entry[2] is not None else None
+        return False
+
+    def put(self, path, st, size):
+        self.entries[path] = [st.st_size, st.st_mtime_ns] + (list(size) if size else [None, None])
+        self.dirty = True
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+def _probe_batch(paths, cache):
+    results = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            results.append((path, None, None))
+            continue
+        cached = cache.get(os.path.abspath(path), st) if cache is not None else False
+        if cached is not False:
+            results.append((path, cached, None))
+        else:
+            results.append((path, probe_size(path), st))
+    return results
+
+
+def probe_sizes(paths, workers=WORKERS, cache=None, desc=None):
+    """Returns {path: (width, height) or None} for every path, probed in a thread pool."""
+    paths = list(paths)
+    batches = [paths[i:i + BATCH_SIZE] for i in range(0, len(paths), BATCH_SIZE)]
+    sizes = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            tqdm(total=len(paths), desc=desc, disable=desc is None) as bar:
+        for results in executor.map(lambda batch: _probe_batch(batch, cache), batches):
+            for path, size, st in results:
+                sizes[path] = size
+                if st is not None and cache is not None:
+                    cache.put(os.path.abspath(path), st, size)
+            bar.update(len(results))
+
+    if cache is not None:
+        cache.save()
+    return sizes
+
+
+def probe_dir(img_dir, file_names=None, workers=WORKERS, cache=None, desc=None):
+    """Returns {file_name: (width, height) or None} for images in img_dir (or the given names)."""
+    if file_names is None:
+        if not os.path.isdir(img_dir):
+            return {}
+        file_names = sorted(f for f in os.listdir(img_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+    paths = {os.path.join(img_dir, name): name for name in file_names}
+    return {paths[p]: size for p, size in probe_sizes(paths, workers, cache, desc).items()}
+
+
+def load_cache(path=None):
+    """Returns the shared SizeCache at `path` (default CACHE_PATH), or None when CACHE_PATH is None."""
+    path = path or CACHE_PATH
+    return SizeCache(path) if path else None
+
+
+class SizeReport:
+    """Collects recorded-vs-header size disagreements for one or more datasets."""
+
+    def __init__(self):
+        self.checked = 0
+        self.mismatches = []
+        self.unreadable = []
+        self._logged = (0, 0, 0)
+
+    def check(self, image, actual, source=None):
+        """Compares image["width"/"height"] with the probed size.
+
+        Returns the (width, height) to use: the header size when FIX_SIZES is
+        set and the two disagree, or when no size was recorded (0 / missing),
+        otherwise the recorded one.
+        """
+        self.checked += 1
+        recorded = (image.get("width"), image.get("height"))
+        entry = {"file_name": image["file_name"]}
+        if source is not None:
+            entry["source"] = source
+
+        if actual is None:
+            self.unreadable.append(entry)
+            return recorded
+        if tuple(actual) != recorded:
+            self.mismatches.append({**entry, "recorded": list(recorded), "actual": list(actual)})
+            if FIX_SIZES or not all(recorded):
+                return tuple(actual)
+        return recorded
+
+    def changes(self):
+        """What was checked since the previous call, for checkpoint journals (see checkpoint.py)."""
+        checked, mismatches, unreadable = self._logged
+        changes = {"checked": self.checked - checked, "mismatches": self.mismatches[mismatches:],
+                   "unreadable": self.unreadable[unreadable:]}
+        self._logged = (self.checked, len(self.mismatches), len(self.unreadable))
+        return changes
+
+    def replay(self, changes):
+        self.checked += changes["checked"]
+        self.mismatches += changes["mismatches"]
+        self.unreadable += changes["unreadable"]
+        self._logged = (self.checked, len(self.mismatches), len(self.unreadable))
+
+    def summary(self):
+        return (f"{self.checked} checked, {len(self.mismatches)} size mismatches, "
+                f"{len(self.unreadable)} unreadable")
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({
+                "checked": self.checked,
+                "fixed": FIX_SIZES,
+                "mismatches": self.mismatches,
+                "unreadable": self.unreadable
+            }, f, indent=2)
+
+
+def report_path(output_json):
+    """Mismatch report written next to a converter's COCO output."""
+    return os.path.splitext(output_json)[0] + "_size_mismatches.json"
+
+
+def check_coco(coco_json, img_dir, report, workers=WORKERS, cache=None):
+    """Cross-checks every image record of a COCO file against its header."""
+    from coco_io import iter_images
+
+    images = list(iter_images(coco_json))
+    sizes = probe_dir(img_dir, [img["file_name"] for img in images], workers, cache, desc="Probing")
+    for image in images:
+        report.check(image, sizes.get(image["file_name"]), image.get("source"))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Probe image sizes from file headers.")
+    parser.add_argument("dirs", nargs="*", help="image directories to probe")
+    parser.add_argument("--coco", help="COCO JSON whose width/height to cross-check")
+    parser.add_argument("--img-dir", help="image directory for --coco")
+    parser.add_argument("--report", help="where to write the mismatch report (JSON)")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--no-cache", action="store_true", help="do not read or update the size cache")
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else load_cache()
+    start = time.perf_counter()
+    total = 0
+
+    for img_dir in args.dirs:
+        sizes = probe_dir(img_dir, workers=args.workers, cache=cache, desc=img_dir)
+        total += len(sizes)
+        print(f" {img_dir}: {len(sizes)} images, {sum(s is None for s in sizes.values())} unreadable")
+
+    if args.coco:
+        report = check_coco(args.coco, args.img_dir or os.path.dirname(args.coco), SizeReport(), args.workers, cache)
+        total += report.checked
+        print(f" {args.coco}: {report.summary()}")
+        if args.report:
+            report.write(args.report)
+            print(f" Report saved: {args.report}")
+
+    elapsed = time.perf_counter() - start
+    print(f" Probed {total} images in {elapsed:.2f}s ({total / max(elapsed, 1e-9):.0f} images/s)")
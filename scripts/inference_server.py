@@ -0,0 +1,363 @@
+"""
+inference_server.py
+
+Local HTTP service around the trained road-defect detector with dynamic
+micro-batching. Standard library asyncio only, no web framework needed.
+
+Functionality:
+- POST /predict with the raw image bytes as the body (JPEG/PNG) returns the
+  detections as JSON with the class names from data.yaml.
+- Uploads are decoded in a thread pool, then queued for a batcher that
+  forms micro-batches: it waits for the first request and adds more until
+  MAX_BATCH_SIZE is reached or MAX_LATENCY_MS after the oldest request,
+  so light load gets low latency and heavy load gets full batches.
+- The model runs on its own single thread; the event loop keeps accepting
+  and decoding while a batch is in flight.
+- Backpressure: at most MAX_QUEUE requests are decoding or waiting for the
+  model and at most MAX_CONNECTIONS are served at once; beyond that requests
+  get 503 with Retry-After instead of piling up.
+- GET /metrics exposes Prometheus counters and histograms (request latency,
+  queue wait, batch size, inference time, rejections); GET /health.
+
+load_test.py is the matching load generator.
+
+Usage:
+    python scripts/inference_server.py --port 8000
+    python scripts/inference_server.py --onnx runs/detect/road_defects_yolov85/weights/best.onnx
+    curl --data-binary @image.jpg http://127.0.0.1:8000/predict
+"""
+
+import os
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from remap_coco_category_ids import new_categories
+
+# CONFIG
+WEIGHTS = "runs/detect/road_defects_yolov85/weights/best.pt"
+DATA_YAML = "data/merged/data.yaml"  # class names; the remapped categories if missing
+HOST = "127.0.0.1"
+PORT = 8000
+IMGSZ = 640
+CONF = 0.25
+MAX_BATCH_SIZE = 8
+MAX_LATENCY_MS = 20  # longest a request waits for its batch to fill
+MAX_QUEUE = 64  # requests decoding or waiting for the model before new ones get 503
+MAX_CONNECTIONS = 256
+MAX_BODY = 20 * 1024 * 1024
+DECODE_WORKERS = os.cpu_count()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+def load_names(data_yaml=DATA_YAML):
+    """{class id: name} from the names: block of a data.yaml (the layout the notebook writes)."""
+    if data_yaml and os.path.exists(data_yaml):
+        names, in_names = {}, False
+        with open(data_yaml) as f:
+            for line in f:
+                if line.startswith("names:"):
+                    in_names = True
+                elif in_names and line.startswith((" ", "\t")) and ":" in line:
+                    key, value = line.split(":", 1)
+                    names[int(key)] = value.strip().strip("'\"")
+                elif in_names and line.strip():
+                    break
+        if names:
+            return names
+    return {i: cat["name"] for i, cat in enumerate(new_categories)}
+
+
+# Metrics
+class Counter:
+    def __init__(self, name, help_text):
+        self.name, self.help = name, help_text
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter", f"{self.name} {self.value}"]
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name, self.help = name, help_text
+        self.buckets = np.array(buckets, dtype=np.float64)
+        self.counts = np.zeros(len(buckets) + 1, dtype=np.int64)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[np.searchsorted(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = np.cumsum(self.counts)
+        for bound, count in zip(self.buckets.tolist(), cumulative.tolist()):
+            lines.append(f'{self.name}_bucket{{le="{bound:g}"}} {count}')
+        lines += [f'{self.name}_bucket{{le="+Inf"}} {cumulative[-1]}', f"{self.name}_sum {self.sum:.6f}",
+                  f"{self.name}_count {cumulative[-1]}"]
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        self.requests = Counter("defect_requests_total", "Prediction requests answered")
+        self.rejected = Counter("defect_requests_rejected_total", "Requests refused with 503 (backpressure)")
+        self.errors = Counter("defect_request_errors_total", "Requests answered with a 4xx/5xx error")
+        self.latency = Histogram("defect_request_latency_seconds", "Time from request read to response",
+                                 LATENCY_BUCKETS)
+        self.queue_wait = Histogram("defect_queue_wait_seconds", "Time a decoded request waited for its batch",
+                                    LATENCY_BUCKETS)
+        self.inference = Histogram("defect_inference_seconds", "Model time per batch", LATENCY_BUCKETS)
+        self.batch_size = Histogram("defect_batch_size", "Requests per model batch", BATCH_BUCKETS)
+
+    def render(self, queue_depth):
+        lines = []
+        for metric in (self.requests, self.rejected, self.errors, self.latency, self.queue_wait, self.inference,
+                       self.batch_size):
+            lines += metric.render()
+        lines += ["# HELP defect_queue_depth Requests waiting for the model", "# TYPE defect_queue_depth gauge",
+                  f"defect_queue_depth {queue_depth}"]
+        return "\n".join(lines) + "\n"
+
+
+class _Request:
+    __slots__ = ("image", "future", "enqueued")
+
+    def __init__(self, image, future):
+        self.image = image
+        self.future = future
+        self.enqueued = time.perf_counter()
+
+
+class MicroBatcher:
+    """Collects queued requests into batches under a latency deadline and runs them on the model thread."""
+
+    def __init__(self, backend, names, metrics, max_batch_size=MAX_BATCH_SIZE, max_latency_ms=MAX_LATENCY_MS,
+                 max_queue=MAX_QUEUE):
+        self.backend = backend
+        self.names = names
+        self.metrics = metrics
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.model_thread = ThreadPoolExecutor(max_workers=1)  # the backend is not shared across threads
+
+    def submit(self, image):
+        """Queues a decoded image; returns a future, or None when the queue is full."""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait(_Request(image, future))
+        except asyncio.QueueFull:
+            return None
+        return future
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        # Requests that queued up during the previous batch go in right away
+        while len(batch) < self.max_batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        deadline = batch[0].enqueued + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            now = time.perf_counter()
+            for request in batch:
+                self.metrics.queue_wait.observe(now - request.enqueued)
+            self.metrics.batch_size.observe(len(batch))
+
+            try:
+                results = await loop.run_in_executor(self.model_thread, self.backend, [r.image for r in batch])
+            except Exception as e:  # answer the whole batch with the error instead of dying
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+            self.metrics.inference.observe(time.perf_counter() - now)
+
+            for request, (boxes, scores, classes) in zip(batch, results):
+                if not request.future.done():  # the client may have gone away
+                    request.future.set_result((self.detections(boxes, scores, classes), len(batch)))
+
+    def detections(self, boxes, scores, classes):
+        return [{"name": self.names.get(c, str(c)), "class": c, "confidence": round(s, 5),
+                 "box": dict(zip(("x1", "y1", "x2", "y2"), (round(v, 2) for v in box)))}
+                for box, s, c in zip(boxes.tolist(), scores.tolist(), classes.tolist())]
+
+
+def decode_image(body):
+    return cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+class InferenceServer:
+    def __init__(self, backend, names, max_batch_size=MAX_BATCH_SIZE, max_latency_ms=MAX_LATENCY_MS,
+                 max_queue=MAX_QUEUE, max_connections=MAX_CONNECTIONS, decode_workers=DECODE_WORKERS):
+        self.metrics = Metrics()
+        self.batcher = MicroBatcher(backend, names, self.metrics, max_batch_size, max_latency_ms, max_queue)
+        self.decoders = ThreadPoolExecutor(max_workers=decode_workers)
+        self.connections = asyncio.Semaphore(max_connections)
+        self.in_flight = 0
+        self.names = names
+
+    async def predict(self, body):
+        if not body:
+            return 400, {"error": "empty body; send the image bytes"}
+        # Requests still being decoded count against the queue limit too
+        if self.in_flight >= self.batcher.queue.maxsize:
+            self.metrics.rejected.inc()
+            return 503, {"error": "server busy, retry later"}
+        self.in_flight += 1
+        try:
+            image = await asyncio.get_running_loop().run_in_executor(self.decoders, decode_image, body)
+            if image is None:
+                return 400, {"error": "cannot decode image"}
+            future = self.batcher.submit(image)
+            if future is None:
+                self.metrics.rejected.inc()
+                return 503, {"error": "server busy, retry later"}
+            detections, batch_size = await future
+        finally:
+            self.in_flight -= 1
+        return 200, {"detections": detections, "image_size": list(image.shape[1::-1]), "batch_size": batch_size}
+
+    async def respond(self, method, path, body):
+        if path == "/predict":
+            if method != "POST":
+                return 405, {"error": "use POST"}
+            return await self.predict(body)
+        if path == "/metrics":
+            return 200, self.metrics.render(self.batcher.queue.qsize())
+        if path == "/health":
+            return 200, {"status": "ok", "classes": self.names, "queue": self.batcher.queue.qsize()}
+        return 404, {"error": f"unknown path {path}"}
+
+    async def handle(self, reader, writer):
+        if self.connections.locked():
+            self.metrics.rejected.inc()
+            await write_response(writer, 503, {"error": "too many connections"}, keep_alive=False)
+            writer.close()
+            return
+        async with self.connections:
+            try:
+                while True:
+                    request = await read_request(reader)
+                    if request is None:
+                        break
+                    method, path, headers, body = request
+                    start = time.perf_counter()
+                    if body is False:
+                        status, payload = 413, {"error": f"body larger than {MAX_BODY} bytes"}
+                    else:
+                        try:
+                            status, payload = await self.respond(method, path, body)
+                        except Exception as e:
+                            status, payload = 500, {"error": str(e)}
+                    if path == "/predict":
+                        self.metrics.latency.observe(time.perf_counter() - start)
+                        self.metrics.requests.inc()
+                    if status >= 400 and status != 503:
+                        self.metrics.errors.inc()
+                    keep_alive = headers.get("connection", "").lower() != "close" and body is not False
+                    await write_response(writer, status, payload, keep_alive)
+                    if not keep_alive:
+                        break
+            except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+                pass
+            finally:
+                writer.close()
+
+    async def serve(self, host=HOST, port=PORT):
+        batcher_task = asyncio.create_task(self.batcher.run())
+        server = await asyncio.start_server(self.handle, host, port, backlog=MAX_CONNECTIONS)
+        print(f" Serving on http://{host}:{port} (batch <= {self.batcher.max_batch_size}, "
+              f"deadline {self.batcher.max_latency * 1000:.0f} ms, queue {self.batcher.queue.maxsize})")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher_task.cancel()
+
+
+async def read_request(reader):
+    """Parses one HTTP/1.1 request; returns (method, path, headers, body) or None at EOF.
+
+    body is False when Content-Length exceeds MAX_BODY (the body is not read).
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError:
+        return None
+    lines = head.decode("latin-1").split("\r\n")
+    method, target, _ = lines[0].split(" ", 2)
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY:
+        return method, target.split("?", 1)[0], headers, False
+    body = await reader.readexactly(length) if length else b""
+    return method, target.split("?", 1)[0], headers, body
+
+
+async def write_response(writer, status, payload, keep_alive=True):
+    if isinstance(payload, str):
+        body, content_type = payload.encode(), "text/plain; version=0.0.4"
+    else:
+        body, content_type = json.dumps(payload).encode(), "application/json"
+    head = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}", f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    if status == 503:
+        head.append("Retry-After: 1")
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+    await writer.drain()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Road-defect detection HTTP server with micro-batching.")
+    parser.add_argument("--weights", default=WEIGHTS)
+    parser.add_argument("--onnx", help="serve an exported .onnx model with ONNX Runtime instead of --weights")
+    parser.add_argument("--data", default=DATA_YAML, help="data.yaml with the class names")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-latency-ms", type=float, default=MAX_LATENCY_MS)
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE)
+    args = parser.parse_args()
+
+    if args.onnx:
+        from onnx_inference import OnnxBackend
+        backend = OnnxBackend(args.onnx, conf=CONF)
+    else:
+        from sliced_inference import UltralyticsBackend
+        backend = UltralyticsBackend(args.weights, imgsz=IMGSZ, conf=CONF)
+    server = InferenceServer(backend, load_names(args.data), args.max_batch, args.max_latency_ms, args.max_queue)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,357 @@
+"""
+instrument.py
+
+Opt-in stage instrumentation for the scripts in scripts/.
+
+Functionality:
+- span(name, **items) context manager: records wall time, CPU time (this
+  process plus reaped worker processes), peak and delta RSS, files opened
+  for reading / writing, bytes read / written (Linux /proc/self/io) and item
+  counts for a stage; spans nest into sub-phases ("merge/probe sizes").
+  count(**items) adds counts to the innermost open span.
+- Disabled by default: span() and count() do nothing until enable() is
+  called, by a script's --trace flag, by the INSTRUMENT_TRACE environment
+  variable, or by running a script through this module (`run` below).
+- Writes the spans as JSON (<output>) and as a Chrome trace
+  (<output stem>.trace.json, open in chrome://tracing or ui.perfetto.dev).
+- `compare` aggregates two runs by span path and prints the differences, to
+  attribute a regression or confirm a speedup.
+
+Peak RSS is per span where the kernel allows resetting the high-water mark
+(/proc/self/clear_refs); otherwise it is the process peak so far. Bytes and
+file counts cover this process only, not worker processes.
+
+Usage:
+    python scripts/instrument.py run --output runs/trace/merge.json scripts/merge_coco_and_images.py
+    INSTRUMENT_TRACE=runs/trace/pipeline.json python scripts/pipeline.py
+    python scripts/instrument.py summary runs/trace/pipeline.json
+    python scripts/instrument.py compare runs/trace/before.json runs/trace/after.json
+"""
+
+import os
+import sys
+import json
+import time
+import runpy
+import atexit
+import resource
+import argparse
+import threading
+from contextlib import contextmanager, nullcontext
+
+# CONFIG
+ENV_VAR = "INSTRUMENT_TRACE"
+TRACE_DIR = "runs/trace"
+# Opens of Python modules, extensions and /proc (read by the recorder itself) are not data files
+IGNORED_SUFFIXES = (".py", ".pyc", ".so", ".pth")
+IGNORED_PREFIXES = ("/proc/",)
+MIN_WALL_CHANGE = 0.05  # compare: hide spans that changed by less (seconds)...
+MIN_RELATIVE_CHANGE = 0.05  # ...or by less than this fraction
+
+_recorder = None
+_DISABLED = nullcontext()
+
+
+def _read_proc(path, keys):
+    try:
+        with open(path) as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return None
+    return [int(fields[k].split()[0]) if k in fields else 0 for k in keys]
+
+
+def _rss():
+    """(current RSS, high-water mark) in bytes."""
+    values = _read_proc("/proc/self/status", ("VmRSS", "VmHWM"))
+    if values is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak if sys.platform == "darwin" else peak * 1024
+        return peak, peak
+    return values[0] * 1024, values[1] * 1024
+
+
+def _reset_peak():
+    """Resets the kernel's RSS high-water mark; False where not supported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class _Span:
+    __slots__ = ("name", "path", "depth", "thread", "start", "cpu", "children_cpu", "io", "files", "rss", "peak",
+                 "items")
+
+
+class Recorder:
+    """Collects finished spans; one per process, see enable()."""
+
+    def __init__(self, output):
+        self.output = output
+        self.origin = time.perf_counter()
+        self.started = time.time()
+        self.spans = []
+        self.files = [0, 0]  # opened for reading, writing
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.per_span_peak = _reset_peak()
+        sys.addaudithook(self._audit)
+
+    def _audit(self, event, args):
+        if event != "open" or self is not _recorder:
+            return
+        path, mode, flags = args
+        if not isinstance(path, (str, bytes)):
+            return
+        path = os.fsdecode(path)
+        if path.endswith(IGNORED_SUFFIXES) or path.startswith(IGNORED_PREFIXES):
+            return
+        if mode is not None:
+            writing = any(c in mode for c in "wax+")
+        else:
+            writing = bool(flags & (os.O_WRONLY | os.O_RDWR))
+        self.files[writing] += 1
+
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def _io(self):
+        return _read_proc("/proc/self/io", ("rchar", "wchar")) or [0, 0]
+
+    def begin(self, name, items):
+        stack = self.stack()
+        span = _Span()
+        span.name = name
+        span.path = "/".join([s.name for s in stack] + [name])
+        span.depth = len(stack)
+        span.thread = threading.get_ident()
+        span.items = dict(items)
+
+        rss, peak = _rss()
+        for parent in stack:
+            parent.peak = max(parent.peak, peak)
+        if self.per_span_peak:
+            _reset_peak()
+        span.rss, span.peak = rss, rss if self.per_span_peak else peak
+        span.io = self._io()
+        span.files = list(self.files)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        span.children_cpu = children.ru_utime + children.ru_stime
+        span.cpu = time.process_time()
+        span.start = time.perf_counter()
+        stack.append(span)
+        return span
+
+    def end(self, span):
+        end = time.perf_counter()
+        cpu = time.process_time() - span.cpu
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        io = self._io()
+        rss, peak = _rss()
+        span.peak = max(span.peak, peak)
+
+        stack = self.stack()
+        stack.remove(span)
+        for parent in stack:
+            parent.peak = max(parent.peak, span.peak)
+
+        record = {
+            "name": span.name, "path": span.path, "depth": span.depth, "thread": span.thread,
+            "start_s": round(span.start - self.origin, 6), "wall_s": round(end - span.start, 6),
+            "cpu_s": round(cpu + children.ru_utime + children.ru_stime - span.children_cpu, 6),
+            "peak_rss": span.peak, "rss_delta": rss - span.rss,
+            "files_read": self.files[0] - span.files[0], "files_written": self.files[1] - span.files[1],
+            "bytes_read": io[0] - span.io[0], "bytes_written": io[1] - span.io[1],
+            "items": span.items,
+        }
+        with self.lock:
+            self.spans.append(record)
+
+    def count(self, items):
+        stack = self.stack()
+        if stack:
+            target = stack[-1].items
+            for key, value in items.items():
+                target[key] = target.get(key, 0) + value
+
+    def write(self, output=None):
+        output = output or self.output
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        spans = sorted(self.spans, key=lambda s: s["start_s"])
+        run = {"argv": sys.argv, "pid": os.getpid(), "started": self.started,
+               "per_span_peak_rss": self.per_span_peak, "spans": spans}
+        with open(output, "w") as f:
+            json.dump(run, f, indent=2)
+
+        pid = os.getpid()
+        events = [{"name": s["name"], "cat": s["path"].split("/")[0], "ph": "X", "pid": pid, "tid": s["thread"],
+                   "ts": round(s["start_s"] * 1e6), "dur": round(s["wall_s"] * 1e6),
+                   "args": {k: s[k] for k in ("cpu_s", "peak_rss", "rss_delta", "files_read", "files_written",
+                                              "bytes_read", "bytes_written")} | s["items"]}
+                  for s in spans]
+        trace_path = os.path.splitext(output)[0] + ".trace.json"
+        with open(trace_path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        print(f" Trace saved: {output}, {trace_path}")
+
+
+def enable(output=None):
+    """Starts recording spans; they are written to `output` when the process exits."""
+    global _recorder
+    if _recorder is None:
+        _recorder = Recorder(output or os.path.join(TRACE_DIR, "trace.json"))
+        atexit.register(lambda: _recorder is not None and _recorder.write())
+    elif output:
+        _recorder.output = output
+    return _recorder
+
+
+def enabled():
+    return _recorder is not None
+
+
+@contextmanager
+def _recorded(name, items):
+    span = _recorder.begin(name, items)
+    try:
+        yield span
+    finally:
+        _recorder.end(span)
+
+
+def span(name, **items):
+    """Context manager timing one stage or sub-phase; a no-op unless enabled."""
+    if _recorder is None:
+        return _DISABLED
+    return _recorded(name, items)
+
+
+def count(**items):
+    """Adds item counts (images=..., annotations=...) to the innermost open span."""
+    if _recorder is not None:
+        _recorder.count(items)
+
+
+if os.environ.get(ENV_VAR):
+    enable(os.environ[ENV_VAR])
+
+
+# Reports
+def load_run(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def aggregate(run):
+    """Totals per span path: calls, summed time / IO / items and the largest peak RSS."""
+    totals = {}
+    for s in run["spans"]:
+        t = totals.setdefault(s["path"], {"depth": s["depth"], "calls": 0, "wall_s": 0.0, "cpu_s": 0.0,
+                                          "peak_rss": 0, "files_read": 0, "files_written": 0, "bytes_read": 0,
+                                          "bytes_written": 0, "items": {}})
+        t["calls"] += 1
+        for key in ("wall_s", "cpu_s", "files_read", "files_written", "bytes_read", "bytes_written"):
+            t[key] += s[key]
+        t["peak_rss"] = max(t["peak_rss"], s["peak_rss"])
+        for key, value in s["items"].items():
+            if isinstance(value, (int, float)):
+                t["items"][key] = t["items"].get(key, 0) + value
+    return totals
+
+
+def _mb(num_bytes):
+    return f"{num_bytes / 2 ** 20:.1f}"
+
+
+def print_summary(run):
+    totals = aggregate(run)
+    print(f"\n {'span':40s}{'calls':>6s}{'wall s':>10s}{'cpu s':>10s}{'peak MB':>9s}{'files r/w':>13s}"
+          f"{'MB read':>9s}{'MB written':>11s}  items")
+    for path, t in totals.items():
+        label = "  " * t["depth"] + path.rsplit("/", 1)[-1]
+        files = f"{t['files_read']}/{t['files_written']}"
+        items = ", ".join(f"{k}={v}" for k, v in t["items"].items())
+        print(f" {label[:40]:40s}{t['calls']:>6d}{t['wall_s']:>10.2f}{t['cpu_s']:>10.2f}{_mb(t['peak_rss']):>9s}"
+              f"{files:>13s}{_mb(t['bytes_read']):>9s}{_mb(t['bytes_written']):>11s}  {items}")
+
+
+def compare_runs(before, after):
+    """Rows (path, before totals, after totals) for spans in either run, largest wall time change first."""
+    a, b = aggregate(before), aggregate(after)
+    paths = list(a) + [p for p in b if p not in a]
+    rows = [(p, a.get(p), b.get(p)) for p in paths]
+    return sorted(rows, key=lambda r: -abs((r[2] or {}).get("wall_s", 0) - (r[1] or {}).get("wall_s", 0)))
+
+
+def print_comparison(before, after, show_all=False):
+    def change(old, new):
+        if old is None or new is None:
+            return "new" if old is None else "gone"
+        return f"{(new / old - 1) * 100:+.0f}%" if old else "-"
+
+    print(f"\n {'span':40s}{'wall s':>17s}{'change':>8s}{'cpu s':>17s}{'peak MB':>17s}{'MB read':>17s}"
+          f"{'MB written':>17s}")
+    for path, old, new in compare_runs(before, after):
+        old_wall, new_wall = (old or {}).get("wall_s", 0.0), (new or {}).get("wall_s", 0.0)
+        small = abs(new_wall - old_wall) < max(MIN_WALL_CHANGE, MIN_RELATIVE_CHANGE * old_wall)
+        if small and old and new and not show_all:
+            continue
+
+        def pair(key, fmt):
+            return f"{fmt((old or {}).get(key, 0)):>8s}>{fmt((new or {}).get(key, 0)):>8s}"
+
+        num = lambda v: f"{v:.2f}"
+        print(f" {path[-40:]:40s}{pair('wall_s', num)}{change(old and old_wall, new and new_wall):>8s}"
+              f"{pair('cpu_s', num)}{pair('peak_rss', _mb)}{pair('bytes_read', _mb)}{pair('bytes_written', _mb)}")
+        items_old, items_new = (old or {}).get("items", {}), (new or {}).get("items", {})
+        differing = {k for k in set(items_old) | set(items_new) if items_old.get(k) != items_new.get(k)}
+        for key in sorted(differing):
+            print(f"   {'':40s}{key}: {items_old.get(key, '-')} > {items_new.get(key, '-')}")
+
+
+def run_script(script, args, output):
+    """Runs a script as __main__ with instrumentation on, inside one span named after it."""
+    enable(output)
+    sys.argv = [script] + list(args)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    with span(os.path.splitext(os.path.basename(script))[0]):
+        try:
+            runpy.run_path(script, run_name="__main__")
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                raise
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stage instrumentation: run, summarize and compare traces.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run a script with instrumentation enabled")
+    run.add_argument("--output", help="trace JSON (default: runs/trace/<script>.json)")
+    run.add_argument("script")
+    run.add_argument("args", nargs=argparse.REMAINDER)
+    summary = commands.add_parser("summary", help="print one run")
+    summary.add_argument("trace")
+    compare = commands.add_parser("compare", help="compare two runs by span")
+    compare.add_argument("before")
+    compare.add_argument("after")
+    compare.add_argument("--all", action="store_true", help="also show spans that did not change")
+    args = parser.parse_args(argv)
+
+    # Scripts import this module as "instrument"; share this instance when run as __main__
+    sys.modules.setdefault("instrument", sys.modules[__name__])
+    if args.command == "run":
+        name = os.path.splitext(os.path.basename(args.script))[0]
+        run_script(args.script, args.args, args.output or os.path.join(TRACE_DIR, f"{name}.json"))
+    elif args.command == "summary":
+        print_summary(load_run(args.trace))
+    else:
+        print_comparison(load_run(args.before), load_run(args.after), args.all)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+load_test.py
+
+Load generator for inference_server.py.
+
+Functionality:
+- Opens CONCURRENCY keep-alive connections that POST images from a folder
+  as fast as the server answers (closed loop), or at a fixed request rate
+  with --rate (open loop, which shows queueing and 503 backpressure).
+- Reports throughput, latency percentiles, status codes and the batch sizes
+  the server reported, and prints the server's /metrics at the end.
+
+Usage:
+    python scripts/load_test.py --images data/merged/images/test --requests 500 --concurrency 32
+    python scripts/load_test.py --rate 50 --duration 30
+"""
+
+import os
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter
+
+import numpy as np
+
+# CONFIG
+HOST = "127.0.0.1"
+PORT = 8000
+IMAGES = "data/merged/images/test"
+NUM_REQUESTS = 200
+CONCURRENCY = 16
+MAX_IMAGES = 64  # distinct images loaded into memory
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def load_bodies(img_dir, limit=MAX_IMAGES):
+    names = sorted(f for f in os.listdir(img_dir) if f.lower().endswith(IMAGE_EXTENSIONS))[:limit]
+    if not names:
+        raise FileNotFoundError(f"No images in {img_dir}")
+    bodies = []
+    for name in names:
+        with open(os.path.join(img_dir, name), "rb") as f:
+            bodies.append(f.read())
+    return bodies
+
+
+class Connection:
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=b""):
+        """Sends one request; returns (status, body). Reconnects when the server closed the connection."""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n\r\n"
+        self.writer.write(head.encode() + body)
+        await self.writer.drain()
+
+        lines = (await self.reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ", 2)[1])
+        headers = {k.strip().lower(): v.strip() for k, v in (line.split(":", 1) for line in lines[1:] if ":" in line)}
+        payload = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, payload
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def one_request(conn, body, results):
+    start = time.perf_counter()
+    try:
+        status, payload = await conn.request("POST", "/predict", body)
+    except (ConnectionError, asyncio.IncompleteReadError, OSError):
+        conn.close()
+        status, payload = 0, b""
+    latency = time.perf_counter() - start
+    batch = json.loads(payload).get("batch_size") if status == 200 else None
+    results.append((status, latency, batch))
+
+
+async def closed_loop(host, port, bodies, num_requests, concurrency):
+    results, counter = [], iter(range(num_requests))
+
+    async def worker():
+        conn = Connection(host, port)
+        for i in counter:
+            await one_request(conn, bodies[i % len(bodies)], results)
+        conn.close()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+async def open_loop(host, port, bodies, rate, duration, concurrency):
+    """Sends `rate` requests/s for `duration` seconds regardless of how fast answers come back."""
+    results, idle = [], asyncio.Queue()
+    for _ in range(concurrency):
+        idle.put_nowait(Connection(host, port))
+
+    async def send(i):
+        conn = await idle.get() if not idle.empty() else Connection(host, port)
+        await one_request(conn, bodies[i % len(bodies)], results)
+        idle.put_nowait(conn)
+
+    tasks, start = [], time.perf_counter()
+    for i in range(int(rate * duration)):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(i)))
+    await asyncio.gather(*tasks)
+    while not idle.empty():
+        idle.get_nowait().close()
+    return results
+
+
+def report(results, elapsed):
+    statuses = Counter(status for status, _, _ in results)
+    ok = np.array([latency for status, latency, _ in results if status == 200])
+    batches = Counter(batch for status, _, batch in results if status == 200)
+
+    print(f"\n Requests: {len(results)} in {elapsed:.1f}s ({statuses.get(200, 0) / max(elapsed, 1e-9):.1f} ok/s)")
+    print("  Status: " + ", ".join(f"{s or 'connection error'}: {n}" for s, n in sorted(statuses.items())))
+    if ok.size:
+        p50, p90, p95, p99 = np.percentile(ok, [50, 90, 95, 99]) * 1000
+        print(f"  Latency ms: mean {ok.mean() * 1000:.1f}, p50 {p50:.1f}, p90 {p90:.1f}, p95 {p95:.1f}, "
+              f"p99 {p99:.1f}, max {ok.max() * 1000:.1f}")
+        mean_batch = sum(b * n for b, n in batches.items()) / sum(batches.values())
+        print(f"  Server batch size: mean {mean_batch:.2f}, distribution {dict(sorted(batches.items()))}")
+
+
+async def main(args):
+    bodies = load_bodies(args.images)
+    start = time.perf_counter()
+    if args.rate:
+        results = await open_loop(args.host, args.port, bodies, args.rate, args.duration, args.concurrency)
+    else:
+        results = await closed_loop(args.host, args.port, bodies, args.requests, args.concurrency)
+    report(results, time.perf_counter() - start)
+
+    if args.metrics:
+        conn = Connection(args.host, args.port)
+        status, payload = await conn.request("GET", "/metrics")
+        conn.close()
+        print("\n" + payload.decode())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for inference_server.py.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--images", default=IMAGES)
+    parser.add_argument("--requests", type=int, default=NUM_REQUESTS, help="closed loop: total requests")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--rate", type=float, help="open loop: requests per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="open loop: seconds")
+    parser.add_argument("--metrics", action="store_true", help="print the server's /metrics afterwards")
+    asyncio.run(main(parser.parse_args()))
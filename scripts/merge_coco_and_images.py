@@ -5,91 +5,190 @@ Merges multiple datasets (images and COCO annotations) into one unified dataset.
 
 Functionality:
 - Updates image/annotation IDs to avoid collisions.
-- Copies and renames image files into merged folders.
-- Merges COCO JSONs into a single file split into train/val/test.
+- Records the source dataset of every image ("source" field).
+- Links (or copies, as a fallback) and renames image files into merged folders.
+- Stores byte-identical images shared between datasets once, under one image ID,
+  and reports the bytes that did not have to be written.
+- Cross-checks every image's width/height against its file header
+  (image_probe.py) and writes a size mismatch report.
+- Merges COCO JSONs into a single file split into train/val/test,
+  streaming records so memory does not grow with dataset size.
+- Commits the output in chunks with a progress journal; rerunning after
+  an interruption resumes with the same IDs and output (see checkpoint.py).
 
 Use this script before final conversion to YOLO format.
 """
 
 import os
-import json
-import shutil
+from itertools import islice
 from tqdm import tqdm
+import instrument
+import image_probe
+from checkpoint import CHUNK_SIZE, RESUME, ResumableCocoWriter
+from coco_io import iter_images, iter_annotations, load_categories
+from file_placement import ContentIndex, place_file, format_bytes
+from image_probe import SizeReport, probe_dir, load_cache
 
 # CONFIG
 DATASETS = [
-    {"json": "data/UAV_PDD2023/uavpdd2023_coco.json", "img_dir": "data/UAV_PDD2023/images"},
-    {"json": "data/HighRPD/highrpd_coco.json", "img_dir": "data/HighRPD/images"},
-    {"json": "data/RDD2022/rdd2022_japan_coco.json", "img_dir": "data/RDD2022/RDD2022_Japan/images"},
-    {"json": "data/RDD2022/rdd2022_india_coco.json", "img_dir": "data/RDD2022/RDD2022_India/images"},
-    {"json": "data/RDD2022/rdd2022_china_motorbike_coco.json", "img_dir": "data/RDD2022/RDD2022_China_MotorBike/images"},
-    {"json": "data/RDD2022/rdd2022_china_drone_coco.json", "img_dir": "data/RDD2022/RDD2022_China_Drone/images"},
+    {"name": "UAV_PDD2023", "json": "data/UAV_PDD2023/uavpdd2023_coco.json", "img_dir": "data/UAV_PDD2023/images"},
+    {"name": "HighRPD", "json": "data/HighRPD/highrpd_coco.json", "img_dir": "data/HighRPD/images"},
+    {"name": "RDD2022_Japan", "json": "data/RDD2022/rdd2022_japan_coco.json", "img_dir": "data/RDD2022/RDD2022_Japan/images"},
+    {"name": "RDD2022_India", "json": "data/RDD2022/rdd2022_india_coco.json", "img_dir": "data/RDD2022/RDD2022_India/images"},
+    {"name": "RDD2022_China_MotorBike", "json": "data/RDD2022/rdd2022_china_motorbike_coco.json", "img_dir": "data/RDD2022/RDD2022_China_MotorBike/images"},
+    {"name": "RDD2022_China_Drone", "json": "data/RDD2022/rdd2022_china_drone_coco.json", "img_dir": "data/RDD2022/RDD2022_China_Drone/images"},
 ]
 
 MERGED_IMG_DIR = "data/merged/images"
 MERGED_JSON_PATH = "data/merged/merged_coco.json"
-os.makedirs(MERGED_IMG_DIR, exist_ok=True)
-
-# Merge Logic
-merged = {"images": [], "annotations": [], "categories": []}
-seen_categories = {}
-img_id, ann_id = 0, 0
-filename_map = {}
-
-# Register all categories first
-for ds in DATASETS:
-    with open(ds["json"], "r") as f:
-        coco = json.load(f)
-        for cat in coco["categories"]:
-            if cat["id"] not in seen_categories:
-                seen_categories[cat["id"]] = cat
-merged["categories"] = list(seen_categories.values())
-
-# Merge images and annotations
-for ds in DATASETS:
-    with open(ds["json"], "r") as f:
-        coco = json.load(f)
-
-    image_dir = ds["img_dir"]
-
-    for image in tqdm(coco["images"], desc=f"Processing {os.path.basename(ds['json'])}"):
-        new_filename = f"{img_id}_{image['file_name']}"
-        src_path = os.path.join(image_dir, image["file_name"])
-        dst_path = os.path.join(MERGED_IMG_DIR, new_filename)
-
-        if not os.path.exists(src_path):
-            print(f" Missing: {src_path}")
-            continue
+LINK_MODE = "auto"  # copy | hardlink | reflink | symlink | auto (see file_placement.py)
+DEDUPLICATE = True  # store byte-identical images once, under one image ID
+CHECK_SIZES = True  # verify width/height against the image headers
+SIZE_REPORT_PATH = "data/merged/size_mismatches.json"
 
-        shutil.copy(src_path, dst_path)
-        filename_map[image["id"]] = img_id
 
-        merged["images"].append({
-            "id": img_id,
-            "file_name": new_filename,
-            "width": image["width"],
-            "height": image["height"]
+def register_categories(datasets):
+    """Collects categories from all datasets, first definition of an id wins."""
+    seen_categories = {}
+    for ds in datasets:
+        for cat in load_categories(ds["json"]):
+            if cat["id"] not in seen_categories:
+                seen_categories[cat["id"]] = cat
+    return list(seen_categories.values())
+
+
+def merge_datasets(datasets, merged_img_dir, merged_json_path, link_mode=LINK_MODE, deduplicate=DEDUPLICATE,
+                   check_sizes=CHECK_SIZES, size_report_path=SIZE_REPORT_PATH, resume=RESUME):
+    os.makedirs(merged_img_dir, exist_ok=True)
+    size_cache = load_cache() if check_sizes else None
+
+    # Register all categories first; output and progress are committed every
+    # CHUNK_SIZE records, so a rerun after a crash continues from there
+    key = ["merge", [(ds["json"], os.path.getsize(ds["json"]), os.path.getmtime(ds["json"]), ds["img_dir"],
+                      ds.get("name")) for ds in datasets],
+           os.path.abspath(merged_img_dir), link_mode, deduplicate, check_sizes, image_probe.FIX_SIZES]
+    writer = ResumableCocoWriter(merged_json_path, register_categories(datasets), key, resume)
+    state = writer.state
+    img_id, ann_id = writer.num_images, writer.num_annotations
+    filename_map = {}
+    content_index = ContentIndex(track_changes=True) if deduplicate else None
+    size_report = SizeReport() if check_sizes else None
+    for changes in writer.committed_changes():
+        filename_map.update(changes["filename_map"])
+        if content_index is not None:
+            content_index.replay(changes["content_index"])
+        if size_report is not None:
+            size_report.replay(changes["size_report"])
+    stats = state.get("stats", {"duplicates": 0, "bytes_linked": 0, "bytes_deduplicated": 0, "bytes_copied": 0})
+    position = state.get("position", [0, 0, 0])  # dataset, images done, annotations done
+    pending = 0  # records processed since the last commit
+    new_ids = []  # filename_map entries since the last commit
+
+    def commit(ds_index, images_done, anns_done):
+        # Only this chunk's additions are written, so commits do not grow with the merged size
+        writer.commit({"position": [ds_index, images_done, anns_done], "stats": stats}, {
+            "filename_map": new_ids,
+            "content_index": content_index.changes() if content_index is not None else None,
+            "size_report": size_report.changes() if size_report is not None else None,
         })
-        img_id += 1
+        new_ids.clear()
 
-    for ann in coco["annotations"]:
-        old_id = ann["image_id"]
-        if old_id not in filename_map:
+    # Merge images and annotations
+    for ds_index, ds in enumerate(datasets):
+        if ds_index < position[0]:
             continue
-        merged["annotations"].append({
-            "id": ann_id,
-            "image_id": filename_map[old_id],
-            "category_id": ann["category_id"],
-            "bbox": ann["bbox"],
-            "area": ann["area"],
-            "iscrowd": ann.get("iscrowd", 0)
-        })
-        ann_id += 1
-
-# Save Final COCO JSON
-with open(MERGED_JSON_PATH, "w") as f:
-    json.dump(merged, f, indent=4)
-
-print(f"\n Merged COCO saved to: {MERGED_JSON_PATH}")
-print(f"\n Total images: {len(merged['images'])}")
-print(f"\n Total annotations: {len(merged['annotations'])}")
\ No newline at end of file
+        images_start, anns_start = position[1:] if ds_index == position[0] else (0, 0)
+        image_dir = ds["img_dir"]
+        source = ds.get("name", os.path.basename(ds["json"]))
+        sizes = {}
+        if size_report is not None and not anns_start:
+            with instrument.span(f"probe sizes {source}"):
+                sizes = probe_dir(image_dir, [img["file_name"] for img in iter_images(ds["json"])], cache=size_cache)
+
+        images_done = images_start
+        images = islice(iter_images(ds["json"]), images_start, None)
+        for image in tqdm(images, desc=f"Processing {os.path.basename(ds['json'])}"):
+            if pending >= CHUNK_SIZE:
+                commit(ds_index, images_done, 0)
+                pending = 0
+            pending += 1
+            images_done += 1
+            new_filename = f"{img_id}_{image['file_name']}"
+            src_path = os.path.join(image_dir, image["file_name"])
+            dst_path = os.path.join(merged_img_dir, new_filename)
+
+            if not os.path.exists(src_path):
+                print(f" Missing: {src_path}")
+                continue
+
+            size = os.path.getsize(src_path)
+            if content_index is not None:
+                duplicate_of = content_index.find_or_add(src_path, img_id, size)
+                if duplicate_of is not None:
+                    filename_map[image["id"]] = duplicate_of
+                    new_ids.append((image["id"], duplicate_of))
+                    stats["duplicates"] += 1
+                    stats["bytes_deduplicated"] += size
+                    continue
+
+            method = place_file(src_path, dst_path, link_mode)
+            stats["bytes_copied" if method == "copy" else "bytes_linked"] += size
+            filename_map[image["id"]] = img_id
+            new_ids.append((image["id"], img_id))
+
+            width, height = image["width"], image["height"]
+            if size_report is not None:
+                width, height = size_report.check(image, sizes.get(image["file_name"]), source)
+
+            writer.add_image({
+                "id": img_id,
+                "file_name": new_filename,
+                "width": width,
+                "height": height,
+                "source": source
+            })
+            img_id += 1
+
+        anns_done = anns_start
+        for ann in islice(iter_annotations(ds["json"]), anns_start, None):
+            if pending >= CHUNK_SIZE:
+                commit(ds_index, images_done, anns_done)
+                pending = 0
+            pending += 1
+            anns_done += 1
+            old_id = ann["image_id"]
+            if old_id not in filename_map:
+                continue
+            writer.add_annotation({
+                "id": ann_id,
+                "image_id": filename_map[old_id],
+                "category_id": ann["category_id"],
+                "bbox": ann["bbox"],
+                "area": ann["area"],
+                "iscrowd": ann.get("iscrowd", 0)
+            })
+            ann_id += 1
+
+    # Save Final COCO JSON
+    writer.close()
+    stats["images"] = writer.num_images
+    stats["annotations"] = writer.num_annotations
+    instrument.count(images=stats["images"], annotations=stats["annotations"], duplicates=stats["duplicates"])
+    if size_report is not None:
+        size_report.write(size_report_path)
+        stats["size_report"] = size_report
+    return stats
+
+
+if __name__ == "__main__":
+    stats = merge_datasets(DATASETS, MERGED_IMG_DIR, MERGED_JSON_PATH)
+
+    print(f"\n Merged COCO saved to: {MERGED_JSON_PATH}")
+    print(f"\n Total images: {stats['images']}")
+    print(f"\n Total annotations: {stats['annotations']}")
+    print(f"\n Duplicate images merged: {stats['duplicates']}")
+    print(f"\n Bytes written: {format_bytes(stats['bytes_copied'])}, "
+          f"avoided: {format_bytes(stats['bytes_linked'] + stats['bytes_deduplicated'])} "
+          f"(linked {format_bytes(stats['bytes_linked'])}, deduplicated {format_bytes(stats['bytes_deduplicated'])})")
+    if "size_report" in stats:
+        print(f"\n Image sizes: {stats['size_report'].summary()} (report: {SIZE_REPORT_PATH})")
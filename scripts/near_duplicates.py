@@ -0,0 +1,235 @@
+"""
+near_duplicates.py
+
+Finds near-duplicate images (resized, re-encoded or lightly edited copies of
+the same scene) in the merged image folder.
+
+Functionality:
+- Computes a 64-bit perceptual hash (DCT pHash) per image in a thread pool
+  and keeps them in an index file, so only new or modified images are
+  hashed on the next run.
+- Finds all pairs within a Hamming distance using a multi-index lookup:
+  the hash is cut into 4 blocks of 16 bits, and two hashes within distance r
+  share at least one block within distance r // 4 (pigeonhole), so only those
+  candidate pairs are compared, with vectorized popcounts over uint64.
+- Groups the pairs into clusters and writes them as JSON. split_cleaned_code.py
+  keeps every cluster inside a single split (DUPLICATE_CLUSTERS).
+
+Usage:
+    python scripts/near_duplicates.py
+    python scripts/near_duplicates.py --threshold 8 --img-dir data/merged/images
+"""
+
+import os
+import json
+import argparse
+from itertools import combinations
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+# CONFIG
+IMG_DIR = "data/merged/images"
+INDEX_PATH = "data/merged/phash_index.npz"
+CLUSTERS_PATH = "data/merged/near_duplicates.json"
+THRESHOLD = 6  # max Hamming distance (of 64 bits) between near-duplicates
+WORKERS = os.cpu_count()
+BATCH_SIZE = 256
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+NUM_BLOCKS = 4
+BLOCK_BITS = 64 // NUM_BLOCKS
+QUERY_CHUNK = 1 << 20  # candidate lookups evaluated at once
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(x):
+    """Number of set bits of every uint64 in x."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x)
+    x = np.ascontiguousarray(x, dtype=np.uint64)
+    return _POPCOUNT_TABLE[x.view(np.uint8)].reshape(*x.shape, 8).sum(axis=-1)
+
+
+def phash(path):
+    """64-bit DCT perceptual hash of an image, or None if it cannot be decoded."""
+    # The reduced decode skips most of the IDCT work for large JPEGs
+    img = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if img is None:
+        return None
+    small = cv2.resize(img, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])  # DC term excluded from the median
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def _hash_batch(paths):
+    return [phash(p) for p in paths]
+
+
+class HashIndex:
+    """file_name -> (file size, mtime_ns, hash) for one image folder, stored as .npz columns."""
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.entries = {}
+        if path and os.path.exists(path):
+            data = np.load(path)
+            for name, size, mtime, value, ok in zip(data["file_names"], data["sizes"], data["mtimes"],
+                                                     data["hashes"], data["valid"]):
+                self.entries[str(name)] = (int(size), int(mtime), int(value) if ok else None)
+
+    def update(self, img_dir, workers=WORKERS):
+        """Hashes new or modified images in img_dir, drops entries for deleted ones."""
+        names = sorted(f for f in os.listdir(img_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+        stats = {name: os.stat(os.path.join(img_dir, name)) for name in names}
+
+        stale = []
+        for name in names:
+            entry = self.entries.get(name)
+            st = stats[name]
+            if not entry or entry[0] != st.st_size or entry[1] != st.st_mtime_ns:
+                stale.append(name)
+        self.entries = {name: self.entries[name] for name in names if name in self.entries}
+
+        batches = [stale[i:i + BATCH_SIZE] for i in range(0, len(stale), BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=workers) as executor, \
+                tqdm(total=len(stale), desc="Hashing images") as bar:
+            paths = ([os.path.join(img_dir, n) for n in batch] for batch in batches)
+            for batch, hashes in zip(batches, executor.map(_hash_batch, paths)):
+                for name, value in zip(batch, hashes):
+                    self.entries[name] = (stats[name].st_size, stats[name].st_mtime_ns, value)
+                bar.update(len(batch))
+        return len(stale)
+
+    def arrays(self):
+        """Returns (file_names, uint64 hashes) of the images that could be decoded."""
+        names = [name for name, entry in self.entries.items() if entry[2] is not None]
+        hashes = np.array([self.entries[name][2] for name in names], dtype=np.uint64)
+        return names, hashes
+
+    def save(self):
+        names = list(self.entries)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(tmp_path,
+                 file_names=np.array(names, dtype=str),
+                 sizes=np.array([self.entries[n][0] for n in names], dtype=np.int64),
+                 mtimes=np.array([self.entries[n][1] for n in names], dtype=np.int64),
+                 hashes=np.array([self.entries[n][2] or 0 for n in names], dtype=np.uint64),
+                 valid=np.array([self.entries[n][2] is not None for n in names], dtype=bool))
+        os.replace(tmp_path, self.path)
+
+
+def _flip_masks(bits, radius):
+    """All masks of `bits` width with at most `radius` bits set."""
+    masks = [0]
+    for r in range(1, radius + 1):
+        masks += [sum(1 << b for b in combo) for combo in combinations(range(bits), r)]
+    return np.array(masks, dtype=np.uint64)
+
+
+def near_duplicate_pairs(hashes, threshold=THRESHOLD):
+    """Returns (i, j, distance) arrays of all pairs i < j with Hamming distance <= threshold."""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    n = len(hashes)
+    masks = _flip_masks(BLOCK_BITS, threshold // NUM_BLOCKS)
+    block_mask = np.uint64((1 << BLOCK_BITS) - 1)
+    found = []
+
+    for block in range(NUM_BLOCKS):
+        keys = (hashes >> np.uint64(block * BLOCK_BITS)) & block_mask
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+
+        # Every (image, mask) query looks up the images whose block equals key ^ mask
+        step = max(1, QUERY_CHUNK // len(masks))
+        for start in range(0, n, step):
+            queries = keys[start:start + step, None] ^ masks[None, :]
+            lo = np.searchsorted(sorted_keys, queries, side="left").ravel()
+            hi = np.searchsorted(sorted_keys, queries, side="right").ravel()
+            counts = hi - lo
+            if not counts.any():
+                continue
+
+            left = np.repeat(np.repeat(np.arange(start, start + queries.shape[0]), len(masks)), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            right = order[np.repeat(lo, counts) + offsets]
+
+            keep = left < right
+            left, right = left[keep], right[keep]
+            dist = popcount(hashes[left] ^ hashes[right])
+            close = dist <= threshold
+            found.append(np.stack([left[close], right[close], dist[close].astype(np.int64)], axis=1))
+
+    if not found:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    pairs = np.unique(np.concatenate(found), axis=0)  # a pair can match in several blocks
+    return pairs[:, 0], pairs[:, 1], pairs[:, 2]
+
+
+def cluster_pairs(n, left, right):
+    """Connected components of the pair graph; returns a cluster label per item."""
+    parent = np.arange(n)
+
+    def find(i):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    for i, j in zip(left.tolist(), right.tolist()):
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+    return np.array([find(i) for i in range(n)])
+
+
+def find_clusters(names, hashes, threshold=THRESHOLD):
+    """Returns (clusters, pair count); clusters are lists of 2+ file names, largest first."""
+    left, right, _ = near_duplicate_pairs(hashes, threshold)
+    labels = cluster_pairs(len(names), left, right)
+    members = {}
+    for name, label in zip(names, labels.tolist()):
+        members.setdefault(label, []).append(name)
+    clusters = [m for m in members.values() if len(m) > 1]
+    clusters.sort(key=len, reverse=True)
+    return clusters, len(left)
+
+
+def build_clusters(img_dir=IMG_DIR, index_path=INDEX_PATH, clusters_path=CLUSTERS_PATH,
+                   threshold=THRESHOLD, workers=WORKERS):
+    index = HashIndex(index_path)
+    hashed = index.update(img_dir, workers)
+    index.save()
+
+    names, hashes = index.arrays()
+    clusters, num_pairs = find_clusters(names, hashes, threshold)
+
+    os.makedirs(os.path.dirname(os.path.abspath(clusters_path)), exist_ok=True)
+    with open(clusters_path, "w") as f:
+        json.dump({"threshold": threshold, "images": len(names), "pairs": num_pairs, "clusters": clusters},
+                  f, indent=2)
+
+    print(f" Hashed {hashed} new/modified images ({len(index.entries)} indexed, "
+          f"{len(index.entries) - len(names)} undecodable)")
+    print(f" Near-duplicate pairs (distance <= {threshold}): {num_pairs}")
+    print(f" Clusters: {len(clusters)} covering {sum(map(len, clusters))} images → {clusters_path}")
+    return clusters
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cluster near-duplicate images by perceptual hash.")
+    parser.add_argument("--img-dir", default=IMG_DIR)
+    parser.add_argument("--index", default=INDEX_PATH)
+    parser.add_argument("--output", default=CLUSTERS_PATH)
+    parser.add_argument("--threshold", type=int, default=THRESHOLD)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+
+    build_clusters(args.img_dir, args.index, args.output, args.threshold, args.workers)
@@ -0,0 +1,249 @@
+"""
+onnx_inference.py
+
+CPU inference engine for the trained road-defect detector on ONNX Runtime.
+
+Functionality:
+- export_onnx() exports best.pt once with ultralytics (fixed input size and
+  batch size, which lets ONNX Runtime plan memory once).
+- Images are decoded and letterboxed (same geometry as ultralytics' LetterBox)
+  in a thread pool that feeds fixed-size batches to an InferenceSession with
+  INTRA_OP_THREADS threads; the last batch is padded to the model batch size.
+- The raw (batch, 4 + classes, anchors) output is decoded, filtered and
+  passed through class-aware NMS in NumPy (box_ops.py), then boxes are
+  mapped back to the original image.
+- Writes labels/<stem>.txt like predict(save_txt=True, save_conf=True), an
+  optional predictions.json, and reports images/s with a per-phase split
+  (preprocess wait / inference / postprocess).
+
+OnnxBackend can also be used as the backend of sliced_inference.py.
+
+Usage:
+    python scripts/onnx_inference.py --export
+    python scripts/onnx_inference.py --model runs/detect/road_defects_yolov85/weights/best.onnx \\
+        --source data/merged/images/test --threads 8 --batch 8
+"""
+
+import os
+import ast
+import json
+import time
+import argparse
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from box_ops import nms
+from remap_coco_category_ids import new_categories
+from sliced_inference import list_images, read_frames, write_prediction
+
+# CONFIG
+WEIGHTS = "runs/detect/road_defects_yolov85/weights/best.pt"
+MODEL_PATH = os.path.splitext(WEIGHTS)[0] + ".onnx"
+SOURCE = "data/merged/images/test"
+OUTPUT_DIR = "runs/detect/onnx_predict"
+IMGSZ = 640
+BATCH_SIZE = 8  # fixed model batch; exported into the ONNX graph
+INTRA_OP_THREADS = os.cpu_count()
+WORKERS = os.cpu_count()  # decode + letterbox threads
+CONF = 0.25  # notebook predict() threshold
+IOU = 0.7  # ultralytics predict default
+MAX_DET = 300
+MAX_NMS = 30000  # candidates kept (by score) before NMS
+SAVE_JSON = True
+PAD_VALUE = 114
+
+
+def export_onnx(weights=WEIGHTS, imgsz=IMGSZ, batch=BATCH_SIZE, dynamic=False):
+    """Exports an ultralytics checkpoint to ONNX; returns the .onnx path."""
+    from ultralytics import YOLO
+
+    path = YOLO(weights).export(format="onnx", imgsz=imgsz, batch=batch, dynamic=dynamic, simplify=True)
+    print(f" Exported: {path}")
+    return str(path)
+
+
+def letterbox(img, imgsz=IMGSZ):
+    """Resizes and pads to imgsz x imgsz like ultralytics' LetterBox; returns (image, ratio, (pad_x, pad_y))."""
+    h, w = img.shape[:2]
+    r = min(imgsz / h, imgsz / w)
+    new_w, new_h = int(round(w * r)), int(round(h * r))
+    dw, dh = (imgsz - new_w) / 2, (imgsz - new_h) / 2
+    if (new_w, new_h) != (w, h):
+        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(PAD_VALUE,) * 3)
+    return img, r, (left, top)
+
+
+def preprocess(img, imgsz=IMGSZ):
+    """BGR image -> (CHW float32 RGB tensor in [0, 1], (ratio, pad, original (h, w)))."""
+    boxed, r, pad = letterbox(img, imgsz)
+    tensor = np.ascontiguousarray(boxed[:, :, ::-1].transpose(2, 0, 1), dtype=np.float32)
+    tensor *= 1 / 255
+    return tensor, (r, pad, img.shape[:2])
+
+
+def decode_output(pred, conf=CONF, iou=IOU, max_det=MAX_DET):
+    """One image's (4 + classes, anchors) output -> (xyxy boxes, scores, classes) in letterbox pixels."""
+    scores_all = pred[4:]
+    classes = scores_all.argmax(axis=0)
+    scores = scores_all[classes, np.arange(scores_all.shape[1])]
+    candidates = np.flatnonzero(scores > conf)
+    if candidates.size > MAX_NMS:
+        candidates = candidates[np.argsort(-scores[candidates])[:MAX_NMS]]
+
+    cx, cy, w, h = pred[:4, candidates].astype(np.float64)
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    scores, classes = scores[candidates].astype(np.float64), classes[candidates].astype(np.int64)
+    keep = nms(boxes, scores, classes, iou)[:max_det]
+    return boxes[keep], scores[keep], classes[keep]
+
+
+def scale_boxes(boxes, meta):
+    """Letterbox pixels -> original image pixels."""
+    r, (pad_x, pad_y), (h, w) = meta
+    boxes = (boxes - [pad_x, pad_y, pad_x, pad_y]) / r
+    return np.clip(boxes, 0, [w, h, w, h])
+
+
+def model_names(session):
+    """Class names from the ultralytics export metadata, falling back to the remapped categories."""
+    metadata = session.get_modelmeta().custom_metadata_map
+    if "names" in metadata:
+        return {int(k): v for k, v in ast.literal_eval(metadata["names"]).items()}
+    return {i: cat["name"] for i, cat in enumerate(new_categories)}
+
+
+class OnnxBackend:
+    """Batched YOLOv8 inference on an ONNX Runtime CPU session."""
+
+    def __init__(self, model_path=MODEL_PATH, threads=INTRA_OP_THREADS, conf=CONF, iou=IOU, max_det=MAX_DET):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        batch, _, height, _ = model_input.shape
+        self.batch_size = batch if isinstance(batch, int) else None  # None: dynamic batch axis
+        self.imgsz = height if isinstance(height, int) else IMGSZ
+        self.names = model_names(self.session)
+        self.conf, self.iou, self.max_det = conf, iou, max_det
+
+    def infer(self, tensors):
+        """Runs a list of preprocessed tensors; a static-batch model gets zero-padded batches."""
+        size = self.batch_size or len(tensors)
+        outputs = []
+        for start in range(0, len(tensors), size):
+            chunk = tensors[start:start + size]
+            batch = np.stack(chunk)
+            if len(chunk) < size:
+                batch = np.concatenate([batch, np.zeros((size - len(chunk), *batch.shape[1:]), dtype=batch.dtype)])
+            outputs.append(self.session.run(None, {self.input_name: batch})[0][:len(chunk)])
+        return np.concatenate(outputs)
+
+    def postprocess(self, raw, metas):
+        results = []
+        for pred, meta in zip(raw, metas):
+            boxes, scores, classes = decode_output(pred, self.conf, self.iou, self.max_det)
+            results.append((scale_boxes(boxes, meta), scores, classes))
+        return results
+
+    def __call__(self, images):
+        tensors, metas = zip(*(preprocess(img, self.imgsz) for img in images))
+        return self.postprocess(self.infer(list(tensors)), metas)
+
+
+def _load(path, imgsz):
+    img = cv2.imread(path)
+    return None if img is None else preprocess(img, imgsz)
+
+
+def prediction_records(boxes, scores, classes, names):
+    """Detections in the layout of ultralytics' Results.tojson()."""
+    return [{"name": names.get(c, str(c)), "class": c, "confidence": round(s, 5),
+             "box": dict(zip(("x1", "y1", "x2", "y2"), (round(v, 2) for v in box)))}
+            for box, s, c in zip(boxes.tolist(), scores.tolist(), classes.tolist())]
+
+
+def run_inference(source=SOURCE, output_dir=OUTPUT_DIR, model_path=MODEL_PATH, batch_size=BATCH_SIZE,
+                  threads=INTRA_OP_THREADS, workers=WORKERS, save_json=SAVE_JSON):
+    backend = OnnxBackend(model_path, threads)
+    batch_size = backend.batch_size or batch_size
+    paths = list_images(source)
+    label_dir = os.path.join(output_dir, "labels")
+    os.makedirs(label_dir, exist_ok=True)
+
+    timings = {"preprocess wait": 0.0, "inference": 0.0, "postprocess": 0.0}
+    predictions, unreadable = {}, []
+    start = last = time.perf_counter()
+
+    def flush(batch):
+        nonlocal last
+        t0 = time.perf_counter()
+        raw = backend.infer([tensor for _, tensor, _ in batch])
+        t1 = time.perf_counter()
+        results = backend.postprocess(raw, [meta for _, _, meta in batch])
+        for (path, _, meta), (boxes, scores, classes) in zip(batch, results):
+            write_prediction(label_dir, path, meta[2], boxes, scores, classes)
+            if save_json:
+                predictions[os.path.basename(path)] = prediction_records(boxes, scores, classes, backend.names)
+        t2 = time.perf_counter()
+        # Time between batches is spent waiting for the decode threads
+        timings["preprocess wait"] += t0 - last
+        timings["inference"] += t1 - t0
+        timings["postprocess"] += t2 - t1
+        last = t2
+
+    batch = []
+    frames = read_frames(paths, workers, lambda path: _load(path, backend.imgsz))
+    for path, loaded in tqdm(frames, total=len(paths), desc="ONNX inference"):
+        if loaded is None:
+            unreadable.append(path)
+            continue
+        batch.append((path, *loaded))
+        if len(batch) == batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    elapsed = time.perf_counter() - start
+    if save_json:
+        with open(os.path.join(output_dir, "predictions.json"), "w") as f:
+            json.dump(predictions, f)
+
+    done = len(paths) - len(unreadable)
+    print(f" {done} images in {elapsed:.1f}s ({done / max(elapsed, 1e-9):.1f} images/s, batch {batch_size}, "
+          f"{threads} intra-op threads)")
+    print("  " + ", ".join(f"{name}: {seconds:.1f}s" for name, seconds in timings.items()))
+    if unreadable:
+        print(f"  Unreadable images: {len(unreadable)}")
+    print(f" Labels saved to {label_dir}")
+    return done / max(elapsed, 1e-9)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batched CPU inference with ONNX Runtime.")
+    parser.add_argument("--export", action="store_true", help="export --weights to ONNX first")
+    parser.add_argument("--weights", default=WEIGHTS)
+    parser.add_argument("--model", default=MODEL_PATH, help="exported .onnx model")
+    parser.add_argument("--source", default=SOURCE, help="image file or folder")
+    parser.add_argument("--output", default=OUTPUT_DIR)
+    parser.add_argument("--imgsz", type=int, default=IMGSZ)
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE)
+    parser.add_argument("--threads", type=int, default=INTRA_OP_THREADS, help="ONNX Runtime intra-op threads")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="decode/letterbox threads")
+    parser.add_argument("--no-json", action="store_true", help="only write the txt labels")
+    args = parser.parse_args()
+
+    model_path = export_onnx(args.weights, args.imgsz, args.batch) if args.export else args.model
+    run_inference(args.source, args.output, model_path, args.batch, args.threads, args.workers, not args.no_json)
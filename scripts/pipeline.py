@@ -0,0 +1,443 @@
+"""
+pipeline.py
+
+Incremental, cached driver for the dataset preparation scripts.
+
+Functionality:
+- Models the existing stages (*_to_coco, merge, remove classes, split,
+  remap, convert to YOLO, validate labels, statistics) as a DAG with declared inputs
+  and outputs; USE_FUSED_EXPORT collapses remove classes through convert
+  to YOLO into fused_export.py, USE_TILING adds the tile_dataset.py stage,
+  USE_SHARDS the shard_dataset.py packaging stage.
+- Fingerprints every stage from its input contents, its config and the
+  source code of the scripts it runs, and skips stages whose fingerprint is
+  unchanged and whose outputs still exist.
+- Because outputs are fingerprinted by content, a stage that reruns but
+  writes identical files does not invalidate the stages after it.
+
+Usage:
+    python scripts/pipeline.py                  # run what is out of date
+    python scripts/pipeline.py --dry-run        # only show what would run
+    python scripts/pipeline.py --force merge    # rerun a stage (and whatever that changes)
+    python scripts/pipeline.py --only rdd2022_japan merge
+    python scripts/pipeline.py --trace runs/trace/pipeline.json
+
+Run from the repository root; stage paths are the ones configured in each script.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+
+import highrpd_to_coco
+import rdd2022_to_coco
+import uavpdd2023_to_coco
+import merge_coco_and_images
+import remove_irrelavant_classes
+import split_cleaned_code
+import remap_coco_category_ids
+import convert_coco_to_yolo
+import fused_export
+import near_duplicates
+import validate_yolo_labels
+import check_class_distribution
+import tile_dataset
+import shard_dataset
+import coco_io
+import checkpoint
+import voc_reader
+import file_placement
+import image_probe
+import instrument
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATE_PATH = "data/.pipeline_state.json"
+
+# "stat": directories are fingerprinted from (path, size, mtime) of their files
+# "content": directories are content-hashed too (cached per file by size/mtime)
+DIR_FINGERPRINT = "stat"
+
+# Replace remove_classes → split → remap → convert_to_yolo with the single
+# fused_export stage (same outputs, without the intermediate JSON files)
+USE_FUSED_EXPORT = False
+
+# Also cut the split images into overlapping training tiles (data/merged_tiles)
+USE_TILING = False
+
+# Also pack the split dataset into tar shards for training nodes (data/shards)
+USE_SHARDS = False
+
+
+class Stage:
+    def __init__(self, name, run, inputs, outputs, config=None, code=(), modifies_inputs=False):
+        self.name = name
+        self.run = run
+        self.inputs = [rel_path(p) for p in inputs]
+        self.outputs = [rel_path(p) for p in outputs]
+        self.config = config or {}
+        self.code = [rel_path(m.__file__) for m in code]
+        # In-place stages (label repair) are fingerprinted after they run
+        self.modifies_inputs = modifies_inputs
+
+
+def rel_path(path):
+    return os.path.relpath(os.path.abspath(path), ROOT_DIR)
+
+
+def build_stages():
+    stages = [
+        Stage("highrpd_to_coco",
+              lambda: highrpd_to_coco.yolo_to_coco(highrpd_to_coco.IMG_DIR, highrpd_to_coco.LBL_DIR,
+                                                   highrpd_to_coco.OUT_JSON),
+              inputs=[highrpd_to_coco.IMG_DIR, highrpd_to_coco.LBL_DIR],
+              outputs=[highrpd_to_coco.OUT_JSON],
+              config={"categories": highrpd_to_coco.categories, "fix_sizes": image_probe.FIX_SIZES},
+              code=[highrpd_to_coco, checkpoint, coco_io, image_probe]),
+        Stage("uavpdd2023_to_coco",
+              lambda: uavpdd2023_to_coco.convert(uavpdd2023_to_coco.XML_DIR, uavpdd2023_to_coco.OUT_JSON,
+                                                 uavpdd2023_to_coco.IMG_DIR),
+              inputs=[uavpdd2023_to_coco.XML_DIR, uavpdd2023_to_coco.IMG_DIR],
+              outputs=[uavpdd2023_to_coco.OUT_JSON],
+              config={"labels": uavpdd2023_to_coco.UNIFIED_LABELS, "categories": uavpdd2023_to_coco.categories,
+                      "fix_sizes": image_probe.FIX_SIZES},
+              code=[uavpdd2023_to_coco, voc_reader, checkpoint, coco_io, image_probe, instrument]),
+    ]
+
+    # One stage per RDD2022 country, so a change in one subset only reparses that subset
+    for country in rdd2022_to_coco.COUNTRIES:
+        xml_dir, img_dir, out_path = rdd2022_to_coco.country_paths(country)
+        stages.append(Stage(f"rdd2022_{country.lower()}",
+                            lambda country=country: rdd2022_to_coco.convert_countries([country]),
+                            inputs=[xml_dir, img_dir],
+                            outputs=[out_path],
+                            config={"labels": rdd2022_to_coco.DAMAGE_LABELS, "categories": rdd2022_to_coco.categories,
+                                    "fix_sizes": image_probe.FIX_SIZES},
+                            code=[rdd2022_to_coco, voc_reader, checkpoint, coco_io, image_probe, instrument]))
+
+    merge = merge_coco_and_images
+    stages.append(Stage("merge",
+                        lambda: merge.merge_datasets(merge.DATASETS, merge.MERGED_IMG_DIR, merge.MERGED_JSON_PATH),
+                        inputs=[p for ds in merge.DATASETS for p in (ds["json"], ds["img_dir"])],
+                        outputs=[merge.MERGED_JSON_PATH, merge.MERGED_IMG_DIR],
+                        config={"datasets": merge.DATASETS, "link_mode": merge.LINK_MODE,
+                                "deduplicate": merge.DEDUPLICATE, "check_sizes": merge.CHECK_SIZES,
+                                "fix_sizes": image_probe.FIX_SIZES, "size_report": merge.SIZE_REPORT_PATH},
+                        code=[merge, checkpoint, coco_io, file_placement, image_probe, instrument]))
+
+    if split_cleaned_code.DUPLICATE_CLUSTERS:
+        stages.append(Stage("near_duplicates",
+                            lambda: near_duplicates.build_clusters(merge.MERGED_IMG_DIR, near_duplicates.INDEX_PATH,
+                                                                   split_cleaned_code.DUPLICATE_CLUSTERS),
+                            inputs=[merge.MERGED_IMG_DIR],
+                            outputs=[split_cleaned_code.DUPLICATE_CLUSTERS],
+                            config={"threshold": near_duplicates.THRESHOLD},
+                            code=[near_duplicates]))
+
+    if USE_FUSED_EXPORT:
+        stages += [fused_stage(), validate_stage(), stats_stage()]
+        if USE_TILING:
+            stages.append(tile_stage())
+        if USE_SHARDS:
+            stages.append(shard_stage())
+        return stages
+
+    clean = remove_irrelavant_classes
+    stages.append(Stage("remove_classes",
+                        # Orphans stay on disk: the merged folder belongs to the merge stage
+                        lambda: clean.remove_classes(clean.merged_json_path, clean.image_dir, clean.output_path,
+                                                     clean.remove_ids, delete_orphans=False),
+                        inputs=[clean.merged_json_path],
+                        outputs=[clean.output_path],
+                        config={"remove_ids": sorted(clean.remove_ids)},
+                        code=[clean, coco_io]))
+
+    split = split_cleaned_code
+    split_outputs = [os.path.join(split.ANNOTATIONS_DIR, f"{s}_coco.json") for s in split.SPLITS]
+    if split.PLACEMENT == "manifest":
+        split_outputs += [os.path.join(split.OUTPUT_BASE, f"{s}.txt") for s in split.SPLITS]
+    else:
+        split_outputs += [os.path.join(split.OUTPUT_IMG_DIR, s) for s in split.SPLITS]
+    stages.append(Stage("split",
+                        lambda: split.split_dataset(split.INPUT_JSON, split.IMG_DIR, split.ANNOTATIONS_DIR,
+                                                    split.OUTPUT_IMG_DIR),
+                        inputs=[split.INPUT_JSON, split.IMG_DIR] + duplicate_inputs(),
+                        outputs=split_outputs,
+                        config={"seed": split.SEED, "val_ratio": split.VAL_RATIO, "test_ratio": split.TEST_RATIO,
+                                "strategy": split.SPLIT_STRATEGY, "placement": split.PLACEMENT,
+                                "group_key": split.GROUP_KEY, "link_mode": split.LINK_MODE,
+                                "duplicate_clusters": split.DUPLICATE_CLUSTERS},
+                        code=[split, coco_io, file_placement]))
+
+    remap = remap_coco_category_ids
+    stages.append(Stage("remap",
+                        lambda: [remap.remap_file(os.path.join(remap.input_dir, f"{s}_coco.json"),
+                                                  os.path.join(remap.output_dir, f"{s}_coco_reindexed.json"),
+                                                  remap.id_remap, remap.new_categories) for s in remap.splits],
+                        inputs=[os.path.join(remap.input_dir, f"{s}_coco.json") for s in remap.splits],
+                        outputs=[os.path.join(remap.output_dir, f"{s}_coco_reindexed.json") for s in remap.splits],
+                        config={"id_remap": remap.id_remap, "new_categories": remap.new_categories},
+                        code=[remap, coco_io]))
+
+    yolo = convert_coco_to_yolo
+    yolo_splits = {s: f"{s}_coco_reindexed.json" for s in remap.splits}
+    stages.append(Stage("convert_to_yolo",
+                        lambda: yolo.convert_splits(remap.output_dir, "data/merged/labels", yolo_splits),
+                        inputs=[os.path.join(remap.output_dir, f) for f in yolo_splits.values()],
+                        outputs=["data/merged/labels"],
+                        config={"layout": yolo.LABEL_LAYOUT},
+                        code=[yolo, instrument]))
+    stages += [validate_stage(), stats_stage()]
+    if USE_TILING:
+        stages.append(tile_stage())
+    if USE_SHARDS:
+        stages.append(shard_stage())
+    return stages
+
+
+def tile_stage():
+    tile = tile_dataset
+    annotations = [os.path.join(tile.ANNOTATIONS_DIR, f"{s}_coco_reindexed.json") for s in tile.SPLITS]
+    return Stage("tile_dataset",
+                 lambda: tile.tile_dataset(),
+                 inputs=annotations + [split_cleaned_code.OUTPUT_IMG_DIR],
+                 outputs=[tile.OUTPUT_ROOT],
+                 config={"tile_size": tile.TILE_SIZE, "overlap": tile.TILE_OVERLAP, "min_side": tile.TILE_MIN_SIDE,
+                         "min_visibility": tile.MIN_VISIBILITY, "min_box_side": tile.MIN_BOX_SIDE,
+                         "skip_empty": tile.SKIP_EMPTY_TILES, "jpeg_quality": tile.JPEG_QUALITY},
+                 code=[tile, coco_io, convert_coco_to_yolo, file_placement, instrument])
+
+
+def shard_stage():
+    shard = shard_dataset
+    split = split_cleaned_code
+    if split.PLACEMENT == "manifest":
+        images = [os.path.join(split.OUTPUT_BASE, f"{s}.txt") for s in shard.SPLITS] + [split.IMG_DIR]
+    else:
+        images = [os.path.join(split.OUTPUT_IMG_DIR, s) for s in shard.SPLITS]
+    return Stage("shard_dataset",
+                 lambda: shard.pack_dataset(),
+                 inputs=images + [validate_yolo_labels.LABELS_DIR],
+                 outputs=[shard.OUTPUT_ROOT],
+                 config={"shard_size": shard.SHARD_SIZE, "shuffle": shard.SHUFFLE, "seed": shard.SEED},
+                 code=[shard])
+
+
+def stats_stage():
+    stats = check_class_distribution
+    return Stage("dataset_stats",
+                 lambda: stats.write_stats(stats.SPLIT_INPUTS, stats.STATS_PATH),
+                 inputs=list(stats.SPLIT_INPUTS.values()),
+                 outputs=[stats.STATS_PATH],
+                 config={"imgsz": stats.IMGSZ, "small_sides": stats.SMALL_SIDES},
+                 code=[stats, coco_io])
+
+
+def validate_stage():
+    validate = validate_yolo_labels
+    return Stage("validate_labels",
+                 lambda: validate.validate_labels(validate.LABELS_DIR, validate.SUMMARY_PATH),
+                 inputs=[validate.LABELS_DIR],
+                 outputs=[validate.SUMMARY_PATH],
+                 config={"num_classes": validate.NUM_CLASSES, "mode": validate.MODE, "fix": validate.FIX,
+                         "min_size": validate.MIN_SIZE},
+                 code=[validate],
+                 modifies_inputs=validate.MODE == "repair")
+
+
+def duplicate_inputs():
+    clusters = split_cleaned_code.DUPLICATE_CLUSTERS
+    return [clusters] if clusters else []
+
+
+def fused_stage():
+    fused = fused_export
+    split = split_cleaned_code
+    outputs = [os.path.join(fused.ANNOTATIONS_DIR, f"{s}_coco_reindexed.json") for s in split.SPLITS]
+    if split.PLACEMENT == "manifest":
+        outputs += [os.path.join(fused.OUTPUT_BASE, f"{s}.txt") for s in split.SPLITS]
+    else:
+        outputs += [os.path.join(split.OUTPUT_IMG_DIR, s) for s in split.SPLITS]
+    outputs.append(fused.LABELS_DIR)
+    return Stage("fused_export",
+                 # Orphans stay on disk: the merged folder belongs to the merge stage
+                 lambda: fused.fused_export(delete_orphans=False),
+                 inputs=[fused.MERGED_JSON_PATH, fused.IMAGE_DIR] + duplicate_inputs(),
+                 outputs=outputs,
+                 config={"remove_ids": sorted(fused.REMOVE_IDS), "id_remap": fused.ID_REMAP,
+                         "new_categories": fused.NEW_CATEGORIES, "seed": fused.SEED,
+                         "val_ratio": fused.VAL_RATIO, "test_ratio": fused.TEST_RATIO,
+                         "strategy": split.SPLIT_STRATEGY, "placement": split.PLACEMENT,
+                         "group_key": split.GROUP_KEY, "link_mode": split.LINK_MODE,
+                         "duplicate_clusters": split.DUPLICATE_CLUSTERS,
+                         "layout": convert_coco_to_yolo.LABEL_LAYOUT},
+                 code=[fused, remove_irrelavant_classes, split, remap_coco_category_ids, convert_coco_to_yolo, coco_io,
+                       file_placement, instrument])
+
+
+# Fingerprinting
+def _digest_file(path, hash_cache):
+    st = os.stat(path)
+    cached = hash_cache.get(path)
+    if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+        return cached[2]
+    digest = file_placement.file_digest(path)
+    hash_cache[path] = [st.st_size, st.st_mtime_ns, digest]
+    return digest
+
+
+def fingerprint_path(path, hash_cache, dir_mode=DIR_FINGERPRINT, exclude=()):
+    """Fingerprints a file or directory; `exclude` prunes sub-paths (a stage's own outputs)."""
+    if os.path.isfile(path):
+        return _digest_file(path, hash_cache)
+    if not os.path.isdir(path):
+        return "missing"
+
+    h = hashlib.blake2b(digest_size=20)
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(d for d in dirnames if os.path.join(dirpath, d) not in exclude)
+        for fname in sorted(filenames):
+            fpath = os.path.join(dirpath, fname)
+            if dir_mode == "content":
+                entry = _digest_file(fpath, hash_cache)
+            else:
+                st = os.stat(fpath)
+                entry = f"{st.st_size}:{st.st_mtime_ns}"
+            h.update(f"{os.path.relpath(fpath, path)}\0{entry}\n".encode())
+    return h.hexdigest()
+
+
+def _json_default(obj):
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    return str(obj)
+
+
+def stage_fingerprint(stage, hash_cache):
+    payload = {
+        # split writes images/<split> inside its own input folder; those must not count as inputs
+        "inputs": {p: fingerprint_path(p, hash_cache, exclude=set(stage.outputs)) for p in stage.inputs},
+        "config": stage.config,
+        "code": {p: _digest_file(p, hash_cache) for p in stage.code},
+    }
+    blob = json.dumps(payload, sort_keys=True, default=_json_default)
+    return hashlib.blake2b(blob.encode(), digest_size=20).hexdigest()
+
+
+# DAG
+def _produces(stage, path):
+    return any(path == out or path.startswith(out + os.sep) for out in stage.outputs)
+
+
+def topological_order(stages):
+    """Orders stages so producers run before consumers (declaration order breaks ties)."""
+    deps = {s.name: {p.name for p in stages if p is not s and any(_produces(p, i) for i in s.inputs)}
+            for s in stages}
+    ordered, done = [], set()
+    while len(ordered) < len(stages):
+        ready = [s for s in stages if s.name not in done and deps[s.name] <= done]
+        if not ready:
+            raise RuntimeError(f"Cycle in pipeline stages: {sorted(set(deps) - done)}")
+        ordered.append(ready[0])
+        done.add(ready[0].name)
+    return ordered
+
+
+def load_state(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"stages": {}, "hash_cache": {}}
+
+
+def save_state(state, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def run_pipeline(stages, state_path=STATE_PATH, only=None, force=(), dry_run=False):
+    state = load_state(state_path)
+    hash_cache = state["hash_cache"]
+    report = []
+
+    for stage in topological_order(stages):
+        if only and stage.name not in only:
+            continue
+
+        missing = [p for p in stage.inputs if not os.path.exists(p)]
+        if missing:
+            report.append((stage.name, "missing input", 0.0))
+            print(f" [{stage.name}] missing inputs: {missing}")
+            continue
+
+        fingerprint = stage_fingerprint(stage, hash_cache)
+        record = state["stages"].get(stage.name, {})
+        outputs_exist = all(os.path.exists(p) for p in stage.outputs)
+        if stage.name not in force and record.get("fingerprint") == fingerprint and outputs_exist:
+            report.append((stage.name, "up to date", 0.0))
+            continue
+
+        if dry_run:
+            report.append((stage.name, "would run", 0.0))
+            continue
+
+        print(f"\n [{stage.name}] running")
+        start = time.perf_counter()
+        with instrument.span(stage.name):
+            stage.run()
+        elapsed = time.perf_counter() - start
+        if stage.modifies_inputs:
+            fingerprint = stage_fingerprint(stage, hash_cache)
+
+        state["stages"][stage.name] = {
+            "fingerprint": fingerprint,
+            "outputs": {p: fingerprint_path(p, hash_cache) for p in stage.outputs},
+            "finished": time.time(),
+            "seconds": elapsed,
+        }
+        save_state(state, state_path)
+        report.append((stage.name, "ran", elapsed))
+
+    if not dry_run:
+        save_state(state, state_path)
+
+    print("\n Pipeline summary:")
+    for name, status, elapsed in report:
+        print(f"  {name:28s} {status:14s} {elapsed:8.1f}s" if status == "ran" else f"  {name:28s} {status}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the dataset preparation stages that are out of date.")
+    parser.add_argument("--only", nargs="+", help="run only these stages")
+    parser.add_argument("--force", nargs="+", default=[], help="rerun these stages even if up to date")
+    parser.add_argument("--dry-run", action="store_true", help="show what would run")
+    parser.add_argument("--state", default=STATE_PATH, help="pipeline state file")
+    parser.add_argument("--list", action="store_true", help="list stages in run order")
+    parser.add_argument("--trace", help="record stage timings / memory / IO to this JSON (see instrument.py)")
+    args = parser.parse_args(argv)
+    if args.trace:
+        instrument.enable(os.path.abspath(args.trace))
+
+    os.chdir(ROOT_DIR)
+    stages = build_stages()
+    names = {s.name for s in stages}
+    unknown = (set(args.only or []) | set(args.force)) - names
+    if unknown:
+        parser.error(f"unknown stages: {sorted(unknown)} (known: {sorted(names)})")
+
+    if args.list:
+        for stage in topological_order(stages):
+            print(f"  {stage.name:28s} {', '.join(stage.inputs)} -> {', '.join(stage.outputs)}")
+        return
+
+    run_pipeline(stages, args.state, only=set(args.only or []), force=set(args.force), dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
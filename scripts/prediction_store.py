@@ -0,0 +1,456 @@
+"""
+prediction_store.py
+
+Columnar, memory-mapped store for detection results, so report queries do
+not rescan thousands of per-image prediction files.
+
+Functionality:
+- Ingests the YOLO txt predictions written by predict(save_txt=True,
+  save_conf=True) (or sliced_inference.py / onnx_inference.py) into one row
+  per detection: image, cls, conf, box (normalized [xc, yc, w, h], as in the
+  txt files), area (pixels, from the image headers when an image folder is
+  given) and source (dataset, from a merged COCO file's "source" fields).
+- Indexes: confidence sorted once (a threshold is a binary search), one
+  bitmap per class and per source, and a per-image grid over box centers
+  (rows are stored grouped by image and grid cell, so the boxes of an image
+  or of an image region are contiguous row ranges).
+- query() combines the filters (classes, sources, confidence and area
+  ranges, images, region), aggregate() groups the matches by image / class /
+  source, and the matches export to CSV, JSON or YOLO txt.
+
+Layout of a store directory:
+    meta.json                                    version, counts, grid size, class names, sources
+    names.bin name_offsets.npy                   UTF-8 image stems, CSR offsets
+    width.npy height.npy image_source.npy        one row per image (NaN size when unknown)
+    cell_offsets.npy                             int64, rows of image i, cell c are
+                                                 cell_offsets[i * G*G + c]:cell_offsets[i * G*G + c + 1]
+    image.npy cls.npy conf.npy box.npy area.npy source.npy   one row per detection
+    rank.npy                                     position of each row in the ingested files, for exports
+    conf_order.npy conf_sorted.npy               rows by ascending confidence
+    class_bitmap.npy source_bitmap.npy           packed row bitmaps, one per class / source
+
+Usage:
+    python scripts/prediction_store.py ingest runs/detect/predict/labels runs/detect/predict/predictions.store \
+        --images data/merged/images/test --sources data/merged/merged_coco_cleaned.json
+    python scripts/prediction_store.py query runs/detect/predict/predictions.store --class pothole \
+        --min-conf 0.5 --min-area 4000 --source RDD2022_Japan --group-by source class --csv potholes.csv
+    python scripts/prediction_store.py info runs/detect/predict/predictions.store
+"""
+
+import os
+import csv
+import json
+import argparse
+
+import numpy as np
+
+from box_ops import PREDICTION_FORMAT
+from image_probe import probe_dir
+from check_class_distribution import UNKNOWN_SOURCE, source_map_from_coco
+from evaluate_predictions import read_label_rows
+from remap_coco_category_ids import new_categories
+
+# CONFIG
+PREDICTIONS_DIR = "runs/detect/predict/labels"
+STORE_PATH = "runs/detect/predict/predictions.store"
+GRID_SIZE = 8  # grid cells per image side for the box-center index
+
+STORE_VERSION = 1
+IMAGE_COLUMNS = ("name_offsets", "width", "height", "image_source", "cell_offsets")
+ROW_COLUMNS = ("image", "cls", "conf", "box", "area", "source", "rank")
+INDEX_COLUMNS = ("conf_order", "conf_sorted", "class_bitmap", "source_bitmap")
+GROUP_COLUMNS = {"image": "image", "class": "cls", "source": "source"}
+
+
+def is_store(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, "meta.json"))
+
+
+def _expand_ranges(starts, ends):
+    """Concatenation of arange(s, e) for every (s, e) pair."""
+    lengths = ends - starts
+    keep = lengths > 0
+    starts, lengths = starts[keep], lengths[keep]
+    if not len(lengths):
+        return np.zeros(0, dtype=np.int64)
+    shift = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return shift + np.arange(lengths.sum())
+
+
+class PredictionStore:
+    """Read-only view over a store directory; columns are memory-mapped on first access."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported prediction store version: {self.meta.get('version')}")
+        self.names = self.meta["names"]
+        self.sources = self.meta["sources"]
+        self.grid = self.meta["grid"]
+        self._columns = {}
+
+    def __getattr__(self, name):
+        if name in IMAGE_COLUMNS or name in ROW_COLUMNS or name in INDEX_COLUMNS:
+            if name not in self._columns:
+                self._columns[name] = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+            return self._columns[name]
+        raise AttributeError(name)
+
+    @property
+    def num_images(self):
+        return self.meta["num_images"]
+
+    @property
+    def num_rows(self):
+        return self.meta["num_rows"]
+
+    @property
+    def stems(self):
+        if "stems" not in self._columns:
+            with open(os.path.join(self.path, "names.bin"), "rb") as f:
+                blob = f.read()
+            offsets = self.name_offsets.tolist()
+            self._columns["stems"] = [blob[offsets[i]:offsets[i + 1]].decode("utf-8")
+                                      for i in range(self.num_images)]
+        return self._columns["stems"]
+
+    @property
+    def stem_index(self):
+        if "stem_index" not in self._columns:
+            self._columns["stem_index"] = {stem: i for i, stem in enumerate(self.stems)}
+        return self._columns["stem_index"]
+
+    def _codes(self, values, labels, what):
+        """Positions in `labels` of names or integer codes."""
+        codes = []
+        for value in values:
+            if isinstance(value, str) and value in labels:
+                codes.append(labels.index(value))
+            elif str(value).isdigit() and int(value) < len(labels):
+                codes.append(int(value))
+            else:
+                raise KeyError(f"Unknown {what}: {value!r} (known: {', '.join(labels)})")
+        return codes
+
+    def _bitmap_mask(self, bitmap, codes):
+        packed = np.bitwise_or.reduce(np.asarray(bitmap[codes]), axis=0) if codes else np.zeros(bitmap.shape[1],
+                                                                                                 np.uint8)
+        return np.unpackbits(packed, count=self.num_rows).view(bool)
+
+    def _region_rows(self, images, region):
+        """Rows of the given sorted image indexes (all when None) with centers in the region, via the grid index."""
+        g = self.grid
+        images = np.arange(self.num_images) if images is None else np.asarray(images, dtype=np.int64)
+        if region is None:
+            return _expand_ranges(self.cell_offsets[images * g * g], self.cell_offsets[(images + 1) * g * g])
+
+        x0, y0, x1, y1 = region
+        gx0, gy0, gx1, gy1 = np.clip(np.floor(np.array([x0, y0, x1, y1]) * g).astype(np.int64), 0, g - 1)
+        # One row range per image and grid row: cells gx0..gx1 of a grid row are contiguous
+        cells = (np.arange(gy0, gy1 + 1) * g)[None, :] + images[:, None] * g * g
+        rows = _expand_ranges(self.cell_offsets[(cells + gx0).ravel()], self.cell_offsets[(cells + gx1 + 1).ravel()])
+        center = np.asarray(self.box[rows, :2])
+        inside = (center[:, 0] >= x0) & (center[:, 0] <= x1) & (center[:, 1] >= y0) & (center[:, 1] <= y1)
+        return np.sort(rows[inside])
+
+    def query(self, classes=None, sources=None, min_conf=None, max_conf=None, min_area=None, max_area=None,
+              images=None, region=None):
+        """Row indexes (ascending) of the detections matching every given filter.
+
+        classes / sources take names or codes, images takes stems, region is a
+        normalized (x1, y1, x2, y2) box the detection center must fall in. Area
+        filters are in pixels and never match detections of unknown image size.
+        """
+        rows = None
+        if images is not None or region is not None:
+            index = self.stem_index
+            image_index = None if images is None else sorted({index[stem] for stem in images if stem in index})
+            rows = self._region_rows(image_index, region)
+
+        if min_conf is not None or max_conf is not None:
+            lo = 0 if min_conf is None else np.searchsorted(self.conf_sorted, min_conf, side="left")
+            hi = self.num_rows if max_conf is None else np.searchsorted(self.conf_sorted, max_conf, side="right")
+            matches = self.conf_order[lo:hi]
+            if rows is None:
+                rows = np.sort(matches)
+            else:
+                mask = np.zeros(self.num_rows, dtype=bool)
+                mask[matches] = True
+                rows = rows[mask[rows]]
+
+        for bitmap, values, labels, what in ((self.class_bitmap, classes, self.names, "class"),
+                                             (self.source_bitmap, sources, self.sources, "source")):
+            if values is not None:
+                mask = self._bitmap_mask(bitmap, self._codes(values, labels, what))
+                rows = np.flatnonzero(mask) if rows is None else rows[mask[rows]]
+
+        if min_area is not None or max_area is not None:
+            area = np.asarray(self.area if rows is None else self.area[rows])
+            keep = np.isfinite(area)
+            if min_area is not None:
+                keep &= area >= min_area
+            if max_area is not None:
+                keep &= area <= max_area
+            rows = np.flatnonzero(keep) if rows is None else rows[keep]
+        return np.arange(self.num_rows) if rows is None else rows
+
+    def aggregate(self, rows=None, by=("source", "class")):
+        """Per group of `by` columns (image / class / source): detections, images, mean/max confidence, total area."""
+        rows = np.arange(self.num_rows) if rows is None else np.asarray(rows)
+        if not len(rows):
+            return []
+        # One int64 key per row (mixed radix over the group columns), then image within the group
+        radix = [{"image": self.num_images, "class": len(self.names), "source": len(self.sources)}[col] for col in by]
+        key = np.zeros(len(rows), dtype=np.int64)
+        for col, base in zip(by, radix):
+            key = key * base + np.asarray(getattr(self, GROUP_COLUMNS[col])[rows], dtype=np.int64)
+        key_image = key * max(self.num_images, 1) + np.asarray(self.image[rows], dtype=np.int64)
+        order = np.argsort(key_image, kind="stable")
+        key, key_image = key[order], key_image[order]
+        starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+
+        conf = np.asarray(self.conf[rows], dtype=np.float64)[order]
+        area = np.nan_to_num(np.asarray(self.area[rows], dtype=np.float64)[order])
+        count = np.diff(np.r_[starts, len(key)])
+        images = np.add.reduceat(np.r_[True, key_image[1:] != key_image[:-1]], starts)
+        stats = zip(count.tolist(), images.tolist(), (np.add.reduceat(conf, starts) / count).tolist(),
+                    np.maximum.reduceat(conf, starts).tolist(), np.add.reduceat(area, starts).tolist())
+
+        codes = []
+        group_keys = key[starts]
+        for base in reversed(radix):
+            codes.append((group_keys % base).tolist())
+            group_keys = group_keys // base
+        labels = [{"image": self.stems, "class": self.names, "source": self.sources}[col] for col in by]
+        result = []
+        for key_codes, (n, n_images, conf_mean, conf_max, area_total) in zip(zip(*reversed(codes)), stats):
+            entry = {col: names[code] for col, names, code in zip(by, labels, key_codes)}
+            entry.update(detections=n, images=n_images, conf_mean=round(conf_mean, 4), conf_max=round(conf_max, 4),
+                         area_total=round(area_total, 1))
+            result.append(entry)
+        return result
+
+    def in_file_order(self, rows):
+        """The rows in the order of the ingested prediction files."""
+        rows = np.asarray(rows)
+        return rows[np.argsort(self.rank[rows], kind="stable")]
+
+    def records(self, rows):
+        """One dict per row, in file order (for exports)."""
+        rows = self.in_file_order(rows)
+        images = np.asarray(self.image[rows]).tolist()
+        for i, c, conf, b, area, src in zip(images, np.asarray(self.cls[rows]).tolist(), _float_list(self.conf[rows]),
+                                            _float_list(self.box[rows]), np.asarray(self.area[rows]).tolist(),
+                                            np.asarray(self.source[rows]).tolist()):
+            yield {"image": self.stems[i], "class": self.names[c], "conf": conf, "xc": b[0], "yc": b[1],
+                   "w": b[2], "h": b[3], "area": None if np.isnan(area) else round(area, 1),
+                   "source": self.sources[src]}
+
+
+def _float_list(arr):
+    """Shortest decimal repr of each float32 value (0.1 -> 0.1, not 0.10000000149011612)."""
+    return np.asarray(arr).astype(str).astype(np.float64).tolist()
+
+
+def _save(path, name, arr):
+    np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(arr))
+
+
+def _bitmaps(codes, num_codes):
+    bits = np.zeros((num_codes, len(codes)), dtype=bool)
+    bits[codes, np.arange(len(codes))] = True
+    return np.packbits(bits, axis=1)
+
+
+def write_store(path, stems, width, height, image_source, sources, image, cls, conf, box, names, grid=GRID_SIZE):
+    """Writes a store from per-image and per-detection columns; rows are reordered by (image, grid cell)."""
+    os.makedirs(path, exist_ok=True)
+    num_images = len(stems)
+    if len(names) > 256 or len(sources) > 256:
+        raise ValueError("Class and source counts must fit in uint8 for the prediction store")
+
+    image = np.asarray(image, dtype=np.int64)
+    box = np.asarray(box, dtype=np.float32).reshape(-1, 4)
+    cls = np.asarray(cls, dtype=np.int64)
+    if cls.size and (cls.min() < 0 or cls.max() >= len(names)):
+        raise ValueError(f"Prediction classes must be 0..{len(names) - 1}")
+
+    cell = np.clip(np.floor(box[:, :2].astype(np.float64) * grid).astype(np.int64), 0, grid - 1)
+    key = image * grid * grid + cell[:, 1] * grid + cell[:, 0]
+    order = np.argsort(key, kind="stable")
+    image, cls, box = image[order], cls[order], box[order]
+    conf = np.asarray(conf, dtype=np.float32)[order]
+    width, height = np.asarray(width, dtype=np.float32), np.asarray(height, dtype=np.float32)
+    area = (box[:, 2].astype(np.float64) * box[:, 3] * width[image] * height[image]).astype(np.float32)
+    image_source = np.asarray(image_source, dtype=np.int64)
+    source = image_source[image]
+
+    encoded = [stem.encode("utf-8") for stem in stems]
+    name_offsets = np.zeros(num_images + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=name_offsets[1:])
+    with open(os.path.join(path, "names.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+
+    _save(path, "name_offsets", name_offsets)
+    _save(path, "width", width)
+    _save(path, "height", height)
+    _save(path, "image_source", image_source.astype(np.uint8))
+    _save(path, "cell_offsets", np.searchsorted(key[order], np.arange(num_images * grid * grid + 1)).astype(np.int64))
+
+    _save(path, "image", image.astype(np.int32))
+    _save(path, "cls", cls.astype(np.uint8))
+    _save(path, "conf", conf)
+    _save(path, "box", box)
+    _save(path, "area", area)
+    _save(path, "source", source.astype(np.uint8))
+    _save(path, "rank", order.astype(np.int64))
+
+    conf_order = np.argsort(conf, kind="stable")
+    _save(path, "conf_order", conf_order.astype(np.int64))
+    _save(path, "conf_sorted", conf[conf_order])
+    _save(path, "class_bitmap", _bitmaps(cls, len(names)))
+    _save(path, "source_bitmap", _bitmaps(source, len(sources)))
+
+    meta = {
+        "version": STORE_VERSION,
+        "num_images": num_images,
+        "num_rows": int(len(cls)),
+        "grid": grid,
+        "names": list(names),
+        "sources": list(sources),
+    }
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=4)
+    return PredictionStore(path)
+
+
+def from_predictions(pred_dir, store_path, img_dir=None, source_map=None, categories=new_categories,
+                     grid=GRID_SIZE):
+    """Ingests a folder of <stem>.txt prediction files.
+
+    Images of img_dir without detections are kept (they count for per-image
+    reports), and their headers give the pixel sizes for the area column;
+    source_map ({file stem: source}) attributes images to datasets.
+    """
+    files = sorted(f for f in os.listdir(pred_dir) if f.endswith(".txt"))
+    stems = {os.path.splitext(f)[0] for f in files}
+    images = {}
+    if img_dir:
+        images = {os.path.splitext(f)[0]: f for f in sorted(os.listdir(img_dir))
+                  if os.path.isfile(os.path.join(img_dir, f))}
+        stems |= set(images)
+    stems = sorted(stems)
+
+    width, height = np.full(len(stems), np.nan), np.full(len(stems), np.nan)
+    if images:
+        sizes = probe_dir(img_dir, [images[s] for s in stems if s in images])
+        for i, stem in enumerate(stems):
+            size = sizes.get(images.get(stem))
+            if size:
+                width[i], height[i] = size
+
+    sources = {}
+    image_source = [sources.setdefault((source_map or {}).get(stem, UNKNOWN_SOURCE), len(sources))
+                    for stem in stems]
+    rows, image = read_label_rows(pred_dir, [f"{stem}.txt" for stem in stems], 6)
+    return write_store(store_path, stems, width, height, image_source, list(sources), image,
+                       rows[:, 0].astype(np.int64), rows[:, 5], rows[:, 1:5], [cat["name"] for cat in categories],
+                       grid)
+
+
+def to_csv(store, rows, path):
+    fields = ["image", "source", "class", "conf", "xc", "yc", "w", "h", "area"]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(store.records(rows))
+
+
+def to_json(store, rows, path):
+    with open(path, "w") as f:
+        json.dump(list(store.records(rows)), f, indent=2)
+
+
+def to_yolo(store, rows, output_dir):
+    """Writes the rows back as predict(save_txt=True, save_conf=True) files, one per image with matches."""
+    os.makedirs(output_dir, exist_ok=True)
+    rows = store.in_file_order(rows)
+    images = np.asarray(store.image[rows])
+    bounds = np.flatnonzero(np.diff(images)) + 1
+    for chunk in np.split(np.arange(len(rows)), bounds) if len(rows) else []:
+        selected = rows[chunk]
+        lines = [PREDICTION_FORMAT % (c, *b, s) for c, b, s in zip(
+            np.asarray(store.cls[selected]).tolist(), _float_list(store.box[selected]), _float_list(store.conf[selected]))]
+        with open(os.path.join(output_dir, store.stems[images[chunk[0]]] + ".txt"), "w") as f:
+            f.write("".join(line + "\n" for line in lines))
+
+
+def print_groups(groups, by):
+    print(f"\n {'  '.join(f'{col:<24}' for col in by)} {'detections':>10} {'images':>7} {'conf mean':>9} "
+          f"{'conf max':>8} {'area total':>12}")
+    for g in groups:
+        print(f" {'  '.join(f'{str(g[col]):<24}' for col in by)} {g['detections']:>10} {g['images']:>7} "
+              f"{g['conf_mean']:>9.3f} {g['conf_max']:>8.3f} {g['area_total']:>12.0f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Columnar store of saved predictions: ingest, query, aggregate, export.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("ingest")
+    p.add_argument("pred_dir", nargs="?", default=PREDICTIONS_DIR)
+    p.add_argument("store_path", nargs="?", default=STORE_PATH)
+    p.add_argument("--images", help="image folder, for pixel sizes (area) and images without detections")
+    p.add_argument("--sources", help="COCO JSON with image \"source\" fields")
+    p.add_argument("--grid", type=int, default=GRID_SIZE)
+
+    p = sub.add_parser("query")
+    p.add_argument("store_path", nargs="?", default=STORE_PATH)
+    p.add_argument("--class", dest="classes", nargs="+", help="class names or indexes")
+    p.add_argument("--source", dest="sources", nargs="+")
+    p.add_argument("--image", dest="images", nargs="+", help="image stems")
+    p.add_argument("--min-conf", type=float)
+    p.add_argument("--max-conf", type=float)
+    p.add_argument("--min-area", type=float, help="pixels")
+    p.add_argument("--max-area", type=float, help="pixels")
+    p.add_argument("--region", type=float, nargs=4, metavar=("X1", "Y1", "X2", "Y2"),
+                   help="normalized box the detection centers must fall in")
+    p.add_argument("--group-by", nargs="+", default=["source", "class"], choices=list(GROUP_COLUMNS))
+    p.add_argument("--csv", help="export matching detections as CSV")
+    p.add_argument("--json", help="export matching detections as JSON")
+    p.add_argument("--yolo", help="export matching detections as YOLO txt files into this folder")
+    p.add_argument("--summary", help="save the aggregation as JSON")
+
+    p = sub.add_parser("info")
+    p.add_argument("store_path", nargs="?", default=STORE_PATH)
+
+    args = parser.parse_args(argv)
+    if args.command == "ingest":
+        source_map = source_map_from_coco(args.sources) if args.sources else None
+        store = from_predictions(args.pred_dir, args.store_path, args.images, source_map, grid=args.grid)
+        print(f" Store written: {args.store_path} ({store.num_images} images, {store.num_rows} detections)")
+    elif args.command == "query":
+        store = PredictionStore(args.store_path)
+        rows = store.query(args.classes, args.sources, args.min_conf, args.max_conf, args.min_area, args.max_area,
+                           args.images, args.region)
+        groups = store.aggregate(rows, args.group_by)
+        print(f" {len(rows)} of {store.num_rows} detections match")
+        if groups:
+            print_groups(groups, args.group_by)
+        for path, export in ((args.csv, to_csv), (args.json, to_json), (args.yolo, to_yolo)):
+            if path:
+                export(store, rows, path)
+                print(f" Exported: {path}")
+        if args.summary:
+            with open(args.summary, "w") as f:
+                json.dump(groups, f, indent=2)
+            print(f" Summary saved: {args.summary}")
+    else:
+        store = PredictionStore(args.store_path)
+        print(json.dumps(store.meta, indent=2))
+
+
+if __name__ == "__main__":
+    main()
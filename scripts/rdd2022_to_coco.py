@@ -6,21 +6,30 @@ Converts RDD2022 dataset annotations from Pascal VOC XML format to COCO JSON for
 Functionality:
 - Parses XML files for bounding boxes and class names.
 - Normalizes fields and aggregates into COCO-style JSON.
-- Supports multiple countries and regions in RDD2022.
+- Supports multiple countries and regions in RDD2022, converted in a single run
+  with XML parsing spread over a process pool (see voc_reader.py).
+- Verifies the XML image sizes against the image headers and writes a
+  *_size_mismatches.json report per subset.
+- Commits the output in chunks and resumes an interrupted run where it
+  stopped (see checkpoint.py).
 
 Run this to standardize RDD2022 for use in object detection pipelines.
 """
 
 import os
-import json
-import xml.etree.ElementTree as ET
-from tqdm import tqdm
+from voc_reader import convert_voc_dir, make_executor
+from image_probe import load_cache
 
-COUNTRY = "China_Drone"
+COUNTRIES = ["Japan", "India", "China_MotorBike", "China_Drone"]
+WORKERS = os.cpu_count()
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-XML_DIR = os.path.join(BASE_DIR, f"../data/RDD2022/RDD2022_{COUNTRY}/annotations/xmls")
-IMG_DIR = os.path.join(BASE_DIR, f"../data/RDD2022/RDD2022_{COUNTRY}/images")
-OUT_PATH = os.path.join(BASE_DIR, f"../data/RDD2022/rdd2022_{COUNTRY.lower()}_coco.json")
+
+def country_paths(country):
+    """Returns (xml_dir, img_dir, out_path) for an RDD2022 country subset."""
+    xml_dir = os.path.join(BASE_DIR, f"../data/RDD2022/RDD2022_{country}/annotations/xmls")
+    img_dir = os.path.join(BASE_DIR, f"../data/RDD2022/RDD2022_{country}/images")
+    out_path = os.path.join(BASE_DIR, f"../data/RDD2022/rdd2022_{country.lower()}_coco.json")
+    return xml_dir, img_dir, out_path
 
 DAMAGE_LABELS = {
     "D00": 0,
@@ -64,62 +73,22 @@ categories = [
 }
 ]
 
-def convert_voc_to_coco(xml_dir, output_json, img_dir):
-    coco = {
-        "images": [],
-        "annotations": [],
-        "categories": categories
-    }
-    ann_id = 0
-    image_id = 0
-
-    for xml_file in tqdm(sorted(os.listdir(xml_dir))):
-        if not xml_file.endswith(".xml"):
-            continue
-
-        tree = ET.parse(os.path.join(xml_dir, xml_file))
-        root = tree.getroot()
-
-        filename = root.find("filename").text
-        width = int(root.find("size/width").text)
-        height = int(root.find("size/height").text)
-
-        coco["images"].append({
-            "id": image_id,
-            "file_name": filename,
-            "width": width,
-            "height": height
-        })
-
-        for obj in root.findall("object"):
-            label = obj.find("name").text
-            if label not in DAMAGE_LABELS:
-                continue
-
-            category_id = DAMAGE_LABELS[label]
-            bndbox = obj.find("bndbox")
-            xmin = float(bndbox.find("xmin").text)
-            ymin = float(bndbox.find("ymin").text)
-            xmax = float(bndbox.find("xmax").text)
-            ymax = float(bndbox.find("ymax").text)
-
-            bbox_width = xmax - xmin
-            bbox_height = ymax - ymin
-            coco["annotations"].append({
-                "id": ann_id,
-                "image_id": image_id,
-                "category_id": category_id,
-                "bbox": [xmin, ymin, bbox_width, bbox_height],
-                "area": bbox_width * bbox_height,
-                "iscrowd": 0
-            })
-            ann_id += 1
-
-        image_id += 1
-
-    with open(output_json, "w") as f:
-        json.dump(coco, f, indent=4)
+def convert_voc_to_coco(xml_dir, output_json, img_dir, executor=None, cache=None):
+    convert_voc_dir(xml_dir, DAMAGE_LABELS, categories, output_json, img_dir, executor, cache,
+                    desc=os.path.basename(output_json))
     print(f"COCO JSON saved to: {output_json}")
 
+def convert_countries(countries, workers=WORKERS):
+    """Converts several RDD2022 subsets in one run, sharing one worker pool."""
+    executor = make_executor(workers)
+    cache = load_cache()
+    try:
+        for country in countries:
+            xml_dir, img_dir, out_path = country_paths(country)
+            convert_voc_to_coco(xml_dir, out_path, img_dir, executor=executor, cache=cache)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
 if __name__ == "__main__":
-    convert_voc_to_coco(XML_DIR, OUT_PATH, IMG_DIR)
+    convert_countries(COUNTRIES)
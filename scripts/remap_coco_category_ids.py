@@ -5,13 +5,13 @@ Reassigns category IDs in a COCO JSON annotation file to match a new class list.
 
 Functionality:
 - Maps existing category names to new integer IDs.
-- Outputs a rewritten COCO annotation JSON.
+- Outputs a rewritten COCO annotation JSON, streamed record by record.
 
 Use this after merging datasets to ensure consistent class indexing.
 """
 
 import os
-import json
+from coco_io import CocoWriter, iter_images, iter_annotations
 
 # Class ID remapping
 id_remap = {
@@ -37,31 +37,30 @@ new_categories = [
 splits = ["train", "val", "test"]
 input_dir = "data/merged/annotations"
 output_dir = "data/merged/annotations"
-os.makedirs(output_dir, exist_ok=True)
 
-for split in splits:
-    input_path = os.path.join(input_dir, f"{split}_coco.json")
-    output_path = os.path.join(output_dir, f"{split}_coco_reindexed.json")
 
-    with open(input_path, "r") as f:
-        coco = json.load(f)
-
-    # Remap annotations
-    new_annotations = []
-    for ann in coco["annotations"]:
+def remap_annotations(annotations, id_remap):
+    """Yields annotations whose category is in id_remap, with the new category_id."""
+    for ann in annotations:
         old_id = ann["category_id"]
         if old_id in id_remap:
             ann["category_id"] = id_remap[old_id]
-            new_annotations.append(ann)
+            yield ann
+
+
+def remap_file(input_path, output_path, id_remap, new_categories):
+    with CocoWriter(output_path, new_categories, indent=2, interleaved=False) as writer:
+        writer.add_images(iter_images(input_path))
+        writer.add_annotations(remap_annotations(iter_annotations(input_path), id_remap))
+    return writer.num_annotations
+
 
-    # Assemble new COCO
-    new_coco = {
-        "images": coco["images"],
-        "annotations": new_annotations,
-        "categories": new_categories
-    }
+if __name__ == "__main__":
+    os.makedirs(output_dir, exist_ok=True)
 
-    with open(output_path, "w") as f:
-        json.dump(new_coco, f, indent=2)
+    for split in splits:
+        input_path = os.path.join(input_dir, f"{split}_coco.json")
+        output_path = os.path.join(output_dir, f"{split}_coco_reindexed.json")
 
-    print(f" Saved: {output_path} ({len(new_annotations)} annotations)")
+        num_annotations = remap_file(input_path, output_path, id_remap, new_categories)
+        print(f" Saved: {output_path} ({num_annotations} annotations)")
@@ -0,0 +1,333 @@
+"""
+resize_cache.py
+
+Builds an offline copy of the split dataset with every image resized once to
+the training resolution, so the dataloader no longer decodes and downsamples
+full-size images (e.g. 2592x1944 UAV-PDD2023 JPEGs) in every epoch.
+
+Functionality:
+- Resizes images in a thread pool (OpenCV releases the GIL) so the longest
+  side is IMGSZ (never upscaling), or letterboxes them to IMGSZ x IMGSZ with
+  the YOLO pad value; YOLO labels are linked unchanged (resize) or rewritten
+  for the padding (letterbox).
+- FORMAT="jpeg" writes re-encoded JPEGs in the same images/<split> +
+  labels/<split> layout, so data.yaml only needs a different root.
+- FORMAT="array" writes one raw uint8 file per split (images_<split>.u8) plus
+  an offset index; ArrayImageCache memory-maps it, and use_array_cache()
+  makes the ultralytics dataloader read pixels from it. images/<split> then
+  holds links to the original files, which ultralytics still checks.
+- Times the decode of the original images and of the cached ones and
+  reports the decode time saved per epoch.
+
+Usage:
+    python scripts/resize_cache.py
+    python scripts/resize_cache.py --imgsz 640 --mode letterbox --format array
+"""
+
+import os
+import json
+import math
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from convert_coco_to_yolo import LINE_FORMAT
+from file_placement import place_file, format_bytes
+from remap_coco_category_ids import new_categories
+
+# CONFIG
+IMGSZ = 640  # notebook IMG_SIZE
+MODE = "resize"  # resize: longest side to IMGSZ | letterbox: pad to IMGSZ x IMGSZ
+FORMAT = "jpeg"  # jpeg | array
+JPEG_QUALITY = 95
+PAD_VALUE = 114  # ultralytics letterbox color
+EPOCHS = 20  # notebook EPOCHS, used for the time-saved estimate
+SOURCE_ROOT = "data/merged"
+OUTPUT_ROOT = f"data/merged_{IMGSZ}"
+SPLITS = ["train", "val", "test"]
+WORKERS = os.cpu_count()
+LINK_MODE = "auto"
+TIMING_SAMPLE = 10  # time the cached decode on every Nth image
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def split_images(source_root, split):
+    """Image paths of a split, from images/<split> or a <split>.txt manifest."""
+    img_dir = os.path.join(source_root, "images", split)
+    if os.path.isdir(img_dir):
+        return [os.path.join(img_dir, f) for f in sorted(os.listdir(img_dir)) if f.lower().endswith(IMAGE_EXTENSIONS)]
+
+    manifest = os.path.join(source_root, f"{split}.txt")
+    if not os.path.exists(manifest):
+        return []
+    with open(manifest) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    return [line if os.path.isabs(line) else os.path.normpath(os.path.join(source_root, line)) for line in lines]
+
+
+def source_label(source_root, split, image_path):
+    """labels/<split>/<stem>.txt, or labels/<stem>.txt for the flat manifest layout."""
+    stem = os.path.splitext(os.path.basename(image_path))[0] + ".txt"
+    split_path = os.path.join(source_root, "labels", split, stem)
+    return split_path if os.path.exists(split_path) else os.path.join(source_root, "labels", stem)
+
+
+def resize_image(img, imgsz=IMGSZ, mode=MODE):
+    """Returns (image, (scale, pad_x, pad_y))."""
+    h, w = img.shape[:2]
+    r = min(imgsz / max(h, w), 1.0)
+    if r < 1.0:
+        img = cv2.resize(img, (round(w * r), round(h * r)), interpolation=cv2.INTER_AREA)
+    if mode != "letterbox":
+        return img, (r, 0, 0)
+
+    nh, nw = img.shape[:2]
+    pad_x, pad_y = (imgsz - nw) // 2, (imgsz - nh) // 2
+    img = cv2.copyMakeBorder(img, pad_y, imgsz - nh - pad_y, pad_x, imgsz - nw - pad_x,
+                             cv2.BORDER_CONSTANT, value=(PAD_VALUE,) * 3)
+    return img, (r, pad_x, pad_y)
+
+
+def letterbox_labels(label_path, out_path, size, new_size, pad, imgsz=IMGSZ):
+    """Rewrites normalized YOLO boxes for an image placed at `pad` inside an imgsz square."""
+    rows = []
+    if os.path.exists(label_path):
+        with open(label_path) as f:
+            rows = [line.split() for line in f if line.strip()]
+    (nw, nh), (pad_x, pad_y) = new_size, pad
+    with open(out_path, "w") as f:
+        for cls, xc, yc, w, h in ((r[0], *map(float, r[1:5])) for r in rows if len(r) == 5):
+            f.write(LINE_FORMAT % (int(float(cls)), (xc * nw + pad_x) / imgsz, (yc * nh + pad_y) / imgsz,
+                                   w * nw / imgsz, h * nh / imgsz) + "\n")
+
+
+def process_image(src_path, label_path, out_img, out_label, imgsz, mode, fmt, time_cached):
+    """Resizes one image; returns its record (and the pixels for FORMAT="array")."""
+    start = time.perf_counter()
+    img = cv2.imread(src_path)
+    decode_src = time.perf_counter() - start
+    if img is None:
+        return {"file": src_path, "error": "unreadable"}, None
+
+    h0, w0 = img.shape[:2]
+    out, (r, pad_x, pad_y) = resize_image(img, imgsz, mode)
+    record = {"file": os.path.basename(src_path), "shape": list(out.shape[:2]), "original": [h0, w0],
+              "decode_src": decode_src, "bytes_src": os.path.getsize(src_path)}
+
+    if fmt == "jpeg" and r == 1.0 and mode == "resize" and src_path.lower().endswith((".jpg", ".jpeg")):
+        # Already small enough: keep the original bytes
+        place_file(src_path, out_img, LINK_MODE)
+        record["bytes_out"] = record["bytes_src"]
+        if time_cached:
+            record["decode_out"] = decode_src
+    elif fmt == "jpeg":
+        ok, encoded = cv2.imencode(".jpg", out, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        with open(out_img, "wb") as f:
+            f.write(encoded.tobytes())
+        record["bytes_out"] = len(encoded)
+        if time_cached:
+            start = time.perf_counter()
+            cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+            record["decode_out"] = time.perf_counter() - start
+    else:
+        place_file(src_path, out_img, LINK_MODE)  # ultralytics still verifies the image files
+        record["bytes_out"] = out.nbytes
+        if time_cached:
+            start = time.perf_counter()
+            out.copy()  # a memory-mapped read is a copy out of the page cache
+            record["decode_out"] = time.perf_counter() - start
+
+    if mode == "letterbox":
+        letterbox_labels(label_path, out_label, (w0, h0), (round(w0 * r), round(h0 * r)), (pad_x, pad_y), imgsz)
+    elif os.path.exists(label_path):
+        place_file(label_path, out_label, LINK_MODE)
+    return record, (out if fmt == "array" else None)
+
+
+def build_split(source_root, output_root, split, imgsz=IMGSZ, mode=MODE, fmt=FORMAT, workers=WORKERS):
+    images = split_images(source_root, split)
+    img_dir = os.path.join(output_root, "images", split)
+    label_dir = os.path.join(output_root, "labels", split)
+    os.makedirs(img_dir, exist_ok=True)
+    os.makedirs(label_dir, exist_ok=True)
+
+    def job(i, src):
+        name = os.path.basename(src)
+        out_name = os.path.splitext(name)[0] + ".jpg" if fmt == "jpeg" else name
+        return process_image(src, source_label(source_root, split, src), os.path.join(img_dir, out_name),
+                             os.path.join(label_dir, os.path.splitext(name)[0] + ".txt"),
+                             imgsz, mode, fmt, i % TIMING_SAMPLE == 0)
+
+    records, offsets, shapes = [], [0], []
+    array_file = open(os.path.join(output_root, f"images_{split}.u8"), "wb") if fmt == "array" else None
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor, tqdm(total=len(images), desc=f"Resizing {split}") as bar:
+            # Bounded in-flight work keeps memory flat in array mode
+            pending = deque()
+
+            def drain(limit):
+                while len(pending) > limit:
+                    record, pixels = pending.popleft().result()
+                    records.append(record)
+                    if pixels is not None:
+                        array_file.write(np.ascontiguousarray(pixels).tobytes())
+                        offsets.append(offsets[-1] + pixels.nbytes)
+                        shapes.append(pixels.shape)
+                    bar.update(1)
+
+            for i, src in enumerate(images):
+                pending.append(executor.submit(job, i, src))
+                drain(2 * workers)
+            drain(0)
+    finally:
+        if array_file is not None:
+            array_file.close()
+
+    if fmt == "array":
+        kept = [r for r in records if "error" not in r]
+        np.savez(os.path.join(output_root, f"images_{split}.index.npz"),
+                 names=np.array([r["file"] for r in kept], dtype=str),
+                 offsets=np.array(offsets[:-1], dtype=np.int64),
+                 shapes=np.array(shapes, dtype=np.int64).reshape(-1, 3),
+                 originals=np.array([r["original"] for r in kept], dtype=np.int64).reshape(-1, 2))
+    return records
+
+
+def write_data_yaml(output_root, splits=SPLITS, categories=new_categories):
+    """Same layout as the notebook's data.yaml, rooted at the cache folder."""
+    root = os.path.abspath(output_root)
+    lines = [f"{split}: {root}/images/{split}" for split in splits]
+    lines += ["", "names:"] + [f"  {i}: {cat['name']}" for i, cat in enumerate(categories)]
+    with open(os.path.join(output_root, "data.yaml"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def build_cache(source_root=SOURCE_ROOT, output_root=OUTPUT_ROOT, imgsz=IMGSZ, mode=MODE, fmt=FORMAT,
+                splits=SPLITS, workers=WORKERS, epochs=EPOCHS):
+    report = {"imgsz": imgsz, "mode": mode, "format": fmt, "splits": {}}
+    total_src = total_out = 0.0
+    for split in splits:
+        records = build_split(source_root, output_root, split, imgsz, mode, fmt, workers)
+        ok = [r for r in records if "error" not in r]
+        timed = [r["decode_out"] for r in ok if "decode_out" in r]
+        decode_src = sum(r["decode_src"] for r in ok)
+        decode_out = (sum(timed) / len(timed)) * len(ok) if timed else 0.0
+        report["splits"][split] = {
+            "images": len(ok),
+            "unreadable": [r["file"] for r in records if "error" in r],
+            "bytes_src": sum(r["bytes_src"] for r in ok),
+            "bytes_out": sum(r["bytes_out"] for r in ok),
+            "decode_src_seconds": decode_src,
+            "decode_cached_seconds_est": decode_out,
+        }
+        total_src += decode_src
+        total_out += decode_out
+
+    saved = total_src - total_out
+    report["decode_saved_per_epoch_seconds"] = saved
+    report["decode_saved_seconds"] = {"epochs": epochs, "total": saved * epochs}
+    write_data_yaml(output_root, splits)
+    with open(os.path.join(output_root, "cache_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+    print("\n Resize cache complete:")
+    for split, s in report["splits"].items():
+        print(f"  {split:5s}: {s['images']} images, {format_bytes(s['bytes_src'])} → {format_bytes(s['bytes_out'])}")
+    print(f" Decode time per pass: {total_src:.1f}s originals vs ~{total_out:.1f}s cached "
+          f"(saves ~{saved:.1f}s per epoch, ~{saved * epochs / 60:.1f} min over {epochs} epochs)")
+    print(f" data.yaml: {os.path.join(output_root, 'data.yaml')}")
+    return report
+
+
+class ArrayImageCache:
+    """Memory-mapped reader for one split written with FORMAT="array"."""
+
+    def __init__(self, output_root, split):
+        index = np.load(os.path.join(output_root, f"images_{split}.index.npz"))
+        self.names = [str(n) for n in index["names"]]
+        self.offsets = index["offsets"]
+        self.shapes = index["shapes"]
+        # (h0, w0) of the source images; caches built before this was stored only know the cached shape
+        self.originals = index["originals"] if "originals" in index else self.shapes[:, :2]
+        self.position = {name: i for i, name in enumerate(self.names)}
+        path = os.path.join(output_root, f"images_{split}.u8")
+        self.data = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else np.empty(0, np.uint8)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        shape = tuple(self.shapes[i])
+        start = self.offsets[i]
+        return self.data[start:start + int(np.prod(shape))].reshape(shape)
+
+    def get(self, name):
+        """Returns (pixels, original (h0, w0)), or (None, None) for an image not in the cache."""
+        i = self.position.get(name)
+        return (None, None) if i is None else (self[i], tuple(int(v) for v in self.originals[i]))
+
+
+def use_array_cache(output_root=OUTPUT_ROOT, splits=SPLITS):
+    """Makes ultralytics' BaseDataset.load_image read pixels from the array cache.
+
+    Call before model.train(data=<output_root>/data.yaml). Images not found in
+    the cache fall back to the normal decode. Cached pixels get the same
+    treatment as a decoded image in ultralytics' own load_image: resized to the
+    dataset's imgsz (so a cache built at another --imgsz still works) and kept
+    in the mosaic/mixup buffer when augmenting.
+    """
+    from ultralytics.data.base import BaseDataset
+
+    caches = {split: ArrayImageCache(output_root, split) for split in splits
+              if os.path.exists(os.path.join(output_root, f"images_{split}.index.npz"))}
+    original = BaseDataset.load_image
+
+    def load_image(self, i, rect_mode=True):
+        if self.ims[i] is not None:
+            return self.ims[i], self.im_hw0[i], self.im_hw[i]
+        path = self.im_files[i]
+        cache = caches.get(os.path.basename(os.path.dirname(path)))
+        img, (h0, w0) = cache.get(os.path.basename(path)) if cache is not None else (None, (None, None))
+        if img is None:
+            return original(self, i, rect_mode)
+
+        img = np.array(img)
+        h, w = img.shape[:2]
+        if rect_mode:
+            r = self.imgsz / max(h, w)
+            if r != 1:
+                size = (min(math.ceil(w * r), self.imgsz), min(math.ceil(h * r), self.imgsz))
+                img = cv2.resize(img, size, interpolation=cv2.INTER_LINEAR)
+        elif not (h == w == self.imgsz):
+            img = cv2.resize(img, (self.imgsz, self.imgsz), interpolation=cv2.INTER_LINEAR)
+
+        # Same buffer bookkeeping as BaseDataset.load_image; mosaic/mixup draw partner images from it
+        if self.augment:
+            self.ims[i], self.im_hw0[i], self.im_hw[i] = img, (h0, w0), img.shape[:2]
+            self.buffer.append(i)
+            if len(self.buffer) >= self.max_buffer_length:
+                j = self.buffer.pop(0)
+                self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+        return img, (h0, w0), img.shape[:2]
+
+    BaseDataset.load_image = load_image
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-resize the split dataset to the training resolution.")
+    parser.add_argument("--source", default=SOURCE_ROOT)
+    parser.add_argument("--output", default=None, help="default: data/merged_<imgsz>")
+    parser.add_argument("--imgsz", type=int, default=IMGSZ)
+    parser.add_argument("--mode", choices=["resize", "letterbox"], default=MODE)
+    parser.add_argument("--format", choices=["jpeg", "array"], default=FORMAT)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+
+    build_cache(args.source, args.output or f"data/merged_{args.imgsz}", args.imgsz, args.mode, args.format,
+                workers=args.workers)
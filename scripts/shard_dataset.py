@@ -0,0 +1,359 @@
+"""
+shard_dataset.py
+
+Packs the split dataset into large tar shards for training nodes that read
+from network storage, and reads them back with large sequential reads.
+
+Functionality:
+- pack: writes every split (images/<split> or <split>.txt manifest, plus the
+  YOLO labels) into <split>/<split>-NNNNN.tar shards of about SHARD_SIZE
+  bytes. Each record is an image member followed by its "<stem>.txt" label
+  (empty for background images), in a seeded shuffled order, with fixed tar
+  metadata so repacking the same data gives identical shards.
+  Every shard gets a <shard>.idx.json index (member offsets and sizes) for
+  random access; shards.json lists the shards of every split.
+- fetch: copies the shards from network storage to local disk in order, one
+  large sequential copy per shard, renaming each into place only when it is
+  complete.
+- ShardReader: streams (key, image bytes, label text) records shard by shard
+  from a background thread with a bounded prefetch queue, waiting for shards
+  that are still being fetched, so training can start with the first shard.
+  ShardIndex reads single records by key.
+- extract: writes the records back to images/<split> + labels/<split> and a
+  data.yaml, as the notebook's copytree did, from sequential shard reads.
+
+Usage:
+    python scripts/shard_dataset.py pack
+    python scripts/shard_dataset.py fetch /mnt/storage/shards data/shards &
+    python scripts/shard_dataset.py extract data/shards /tmp/merged
+"""
+
+import os
+import io
+import json
+import time
+import queue
+import random
+import shutil
+import tarfile
+import argparse
+import threading
+
+from tqdm import tqdm
+
+from resize_cache import split_images, source_label, write_data_yaml
+from remap_coco_category_ids import new_categories
+
+# CONFIG
+SOURCE_ROOT = "data/merged"
+OUTPUT_ROOT = "data/shards"
+SPLITS = ["train", "val", "test"]
+SHARD_SIZE = 256 * 2 ** 20  # bytes per shard (a shard closes after the record that crosses it)
+SHUFFLE = True  # shuffle records across shards at pack time
+SEED = 42
+PREFETCH_RECORDS = 256  # records the reader thread decodes ahead
+READ_BUFFER = 8 * 2 ** 20  # bytes per sequential read
+POLL_INTERVAL = 1.0  # seconds between checks for shards that are still being fetched
+WAIT_TIMEOUT = None  # seconds to wait for a missing shard (None: forever)
+
+MANIFEST = "shards.json"
+INDEX_SUFFIX = ".idx.json"
+LABEL_SUFFIX = ".txt"
+
+
+def split_samples(source_root, split):
+    """(key, image path, label path or None) for every image of a split."""
+    samples = []
+    for path in split_images(source_root, split):
+        label = source_label(source_root, split, path)
+        samples.append((os.path.splitext(os.path.basename(path))[0], path, label if os.path.exists(label) else None))
+    return samples
+
+
+def _member(name, size):
+    """Tar header with fixed metadata, so identical data gives identical shards."""
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = 0
+    info.mode = 0o644
+    info.uname = info.gname = ""
+    return info
+
+
+def _add(tar, name, data):
+    """Adds one member; returns the offset of its data in the shard."""
+    info = _member(name, len(data))
+    offset = tar.offset + len(info.tobuf(tar.format, tar.encoding, tar.errors))
+    tar.addfile(info, io.BytesIO(data))
+    return offset
+
+
+class ShardWriter:
+    """Writes records into <prefix>-NNNNN.tar shards with their indexes."""
+
+    def __init__(self, out_dir, prefix, shard_size=SHARD_SIZE):
+        self.out_dir = out_dir
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.shards = []
+        self.tar = None
+        os.makedirs(out_dir, exist_ok=True)
+
+    def _open(self):
+        self.name = f"{self.prefix}-{len(self.shards):05d}.tar"
+        self.path = os.path.join(self.out_dir, self.name)
+        self.tar = tarfile.open(self.path + ".part", "w", format=tarfile.GNU_FORMAT)
+        self.records = []
+
+    def _close(self):
+        self.tar.close()
+        size = os.path.getsize(self.path + ".part")
+        with open(self.path + INDEX_SUFFIX, "w") as f:
+            json.dump({"shard": self.name, "bytes": size, "records": self.records}, f)
+        os.replace(self.path + ".part", self.path)
+        self.shards.append({"name": self.name, "records": len(self.records), "bytes": size})
+        self.tar = None
+
+    def write(self, key, image_name, image, label):
+        if self.tar is None:
+            self._open()
+        image_offset = _add(self.tar, image_name, image)
+        label_offset = _add(self.tar, key + LABEL_SUFFIX, label)
+        self.records.append([key, image_name, image_offset, len(image), label_offset, len(label)])
+        if self.tar.offset >= self.shard_size:
+            self._close()
+
+    def close(self):
+        if self.tar is not None:
+            self._close()
+        return self.shards
+
+
+def pack_split(source_root, output_root, split, shard_size=SHARD_SIZE, shuffle=SHUFFLE, seed=SEED):
+    samples = split_samples(source_root, split)
+    if shuffle:
+        random.Random(seed).shuffle(samples)
+    out_dir = os.path.join(output_root, split)
+    for name in os.listdir(out_dir) if os.path.isdir(out_dir) else []:
+        if name.startswith(f"{split}-"):
+            os.remove(os.path.join(out_dir, name))  # shard count may shrink
+
+    writer = ShardWriter(out_dir, split, shard_size)
+    for key, image_path, label_path in tqdm(samples, desc=f"Packing {split}"):
+        with open(image_path, "rb") as f:
+            image = f.read()
+        label = b""
+        if label_path:
+            with open(label_path, "rb") as f:
+                label = f.read()
+        writer.write(key, os.path.basename(image_path), image, label)
+    return [{**shard, "name": f"{split}/{shard['name']}"} for shard in writer.close()]
+
+
+def pack_dataset(source_root=SOURCE_ROOT, output_root=OUTPUT_ROOT, splits=SPLITS, shard_size=SHARD_SIZE,
+                 shuffle=SHUFFLE, seed=SEED, categories=new_categories):
+    manifest = {"splits": {}, "names": [cat["name"] for cat in categories]}
+    for split in splits:
+        manifest["splits"][split] = pack_split(source_root, output_root, split, shard_size, shuffle, seed)
+        shards = manifest["splits"][split]
+        print(f" {split}: {sum(s['records'] for s in shards)} records in {len(shards)} shards "
+              f"({sum(s['bytes'] for s in shards) / 2 ** 20:.0f} MB)")
+    with open(os.path.join(output_root, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f" Shards saved: {output_root}")
+    return manifest
+
+
+def _copy(src, dst, buffer_size=READ_BUFFER):
+    with open(src, "rb") as fin, open(dst + ".part", "wb") as fout:
+        shutil.copyfileobj(fin, fout, buffer_size)
+    os.replace(dst + ".part", dst)
+
+
+def fetch_shards(src_root, dst_root, splits=None):
+    """Copies the manifest, then every index and shard in order; each file appears only when complete."""
+    os.makedirs(dst_root, exist_ok=True)
+    manifest = load_manifest(src_root)
+    shards = [s for split, entries in manifest["splits"].items() if not splits or split in splits for s in entries]
+    _copy(os.path.join(src_root, MANIFEST), os.path.join(dst_root, MANIFEST))
+    for shard in tqdm(shards, desc="Fetching shards"):
+        os.makedirs(os.path.dirname(os.path.join(dst_root, shard["name"])), exist_ok=True)
+        for name in (shard["name"] + INDEX_SUFFIX, shard["name"]):
+            dst = os.path.join(dst_root, name)
+            if not (os.path.exists(dst) and os.path.getsize(dst) == os.path.getsize(os.path.join(src_root, name))):
+                _copy(os.path.join(src_root, name), dst)
+
+
+def wait_for(path, timeout=WAIT_TIMEOUT, poll=POLL_INTERVAL):
+    """Blocks until path exists (a shard still being fetched); raises FileNotFoundError after timeout."""
+    start = time.monotonic()
+    while not os.path.exists(path):
+        if timeout is not None and time.monotonic() - start > timeout:
+            raise FileNotFoundError(f"Timed out waiting for {path}")
+        time.sleep(poll)
+
+
+def load_manifest(shard_root, wait=False):
+    path = os.path.join(shard_root, MANIFEST)
+    if wait:
+        wait_for(path)
+    with open(path) as f:
+        return json.load(f)
+
+
+class ShardIndex:
+    """Random access to the records of one shard through its index."""
+
+    def __init__(self, shard_path):
+        self.path = shard_path
+        with open(shard_path + INDEX_SUFFIX) as f:
+            self.records = {r[0]: r for r in json.load(f)["records"]}
+        self._fd = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def keys(self):
+        return list(self.records)
+
+    def read(self, key):
+        """Returns (image file name, image bytes, label text)."""
+        _, image_name, image_offset, image_size, label_offset, label_size = self.records[key]
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDONLY)
+        return (image_name, os.pread(self._fd, image_size, image_offset),
+                os.pread(self._fd, label_size, label_offset).decode())
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def iter_shard(path, buffer_size=READ_BUFFER):
+    """Yields (key, image file name, image bytes, label text) from one shard in a single sequential pass."""
+    with open(path, "rb", buffering=buffer_size) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        with tarfile.open(fileobj=f, mode="r|") as tar:
+            image = None
+            for member in tar:
+                data = tar.extractfile(member).read()
+                if member.name.endswith(LABEL_SUFFIX) and image is not None:
+                    yield member.name[:-len(LABEL_SUFFIX)], image[0], image[1], data.decode()
+                    image = None
+                else:
+                    image = (member.name, data)
+
+
+class ShardReader:
+    """Streams the records of one split from a background thread.
+
+    Shards are read in manifest order (or a seeded shuffled order), waiting
+    for shards that have not arrived yet; rank / world_size give each
+    training process its own subset of shards.
+    """
+
+    def __init__(self, shard_root, split, prefetch=PREFETCH_RECORDS, shuffle_shards=False, seed=SEED,
+                 rank=0, world_size=1, timeout=WAIT_TIMEOUT):
+        self.shard_root = shard_root
+        shards = load_manifest(shard_root, wait=True)["splits"][split]
+        if shuffle_shards:
+            random.Random(seed).shuffle(shards)
+        self.shards = shards[rank::world_size]
+        self.prefetch = prefetch
+        self.timeout = timeout
+
+    def __len__(self):
+        return sum(shard["records"] for shard in self.shards)
+
+    @staticmethod
+    def _put(out, item, stop):
+        """Queue put that gives up once the consumer has stopped iterating."""
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, out, stop):
+        try:
+            for shard in self.shards:
+                path = os.path.join(self.shard_root, shard["name"])
+                wait_for(path, self.timeout)
+                for record in iter_shard(path):
+                    if not self._put(out, record, stop):
+                        return
+        except Exception as e:
+            self._put(out, e, stop)
+            return
+        self._put(out, None, stop)
+
+    def __iter__(self):
+        out, stop = queue.Queue(maxsize=self.prefetch), threading.Event()
+        threading.Thread(target=self._produce, args=(out, stop), daemon=True).start()
+        try:
+            while True:
+                record = out.get()
+                if record is None:
+                    return
+                if isinstance(record, Exception):
+                    raise record
+                yield record
+        finally:
+            stop.set()
+
+
+def extract_split(shard_root, split, output_root, prefetch=PREFETCH_RECORDS):
+    """Writes one split back to images/<split> + labels/<split>; returns the record count."""
+    img_dir = os.path.join(output_root, "images", split)
+    label_dir = os.path.join(output_root, "labels", split)
+    os.makedirs(img_dir, exist_ok=True)
+    os.makedirs(label_dir, exist_ok=True)
+    reader = ShardReader(shard_root, split, prefetch)
+    count = 0
+    for key, image_name, image, label in tqdm(reader, total=len(reader), desc=f"Extracting {split}"):
+        with open(os.path.join(img_dir, image_name), "wb") as f:
+            f.write(image)
+        with open(os.path.join(label_dir, key + LABEL_SUFFIX), "w") as f:
+            f.write(label)
+        count += 1
+    return count
+
+
+def extract_dataset(shard_root=OUTPUT_ROOT, output_root=SOURCE_ROOT, splits=None):
+    manifest = load_manifest(shard_root, wait=True)
+    splits = splits or list(manifest["splits"])
+    for split in splits:
+        print(f" {split}: {extract_split(shard_root, split, output_root)} records")
+    write_data_yaml(output_root, splits, [{"name": name} for name in manifest["names"]])
+    print(f" Extracted: {output_root}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tar shards of the split dataset: pack, fetch, extract.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack = commands.add_parser("pack", help="write the split dataset into shards")
+    pack.add_argument("--source", default=SOURCE_ROOT)
+    pack.add_argument("--output", default=OUTPUT_ROOT)
+    pack.add_argument("--splits", nargs="+", default=SPLITS)
+    pack.add_argument("--shard-mb", type=float, default=SHARD_SIZE / 2 ** 20)
+    pack.add_argument("--no-shuffle", action="store_true")
+    fetch = commands.add_parser("fetch", help="copy shards to local disk, in order")
+    fetch.add_argument("src")
+    fetch.add_argument("dst")
+    fetch.add_argument("--splits", nargs="+")
+    extract = commands.add_parser("extract", help="write shards back to images/ + labels/")
+    extract.add_argument("shards", nargs="?", default=OUTPUT_ROOT)
+    extract.add_argument("output", nargs="?", default=SOURCE_ROOT)
+    extract.add_argument("--splits", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        pack_dataset(args.source, args.output, args.splits, int(args.shard_mb * 2 ** 20), not args.no_shuffle)
+    elif args.command == "fetch":
+        fetch_shards(args.src, args.dst, args.splits)
+    else:
+        extract_dataset(args.shards, args.output, args.splits)
@@ -0,0 +1,269 @@
+"""
+sliced_inference.py
+
+Runs the trained detector on full-resolution frames by slicing them into
+overlapping tiles, so fine cracks are seen at native resolution instead of
+after a whole-frame downscale to 640.
+
+Functionality:
+- Cuts every frame into TILE_SIZE tiles with TILE_OVERLAP (same grid as
+  tile_dataset.py) plus, with FULL_FRAME, one whole-frame view for large
+  defects that span several tiles.
+- Tiles from consecutive frames are queued together and sent to the model
+  in batches of BATCH_SIZE, so a batch is always full regardless of how many
+  tiles a single frame has. Frames are decoded in a thread pool meanwhile.
+- Boxes are shifted back to frame coordinates and duplicates across tiles
+  are merged per class (box_ops.py) by intersection-over-smaller: "nms"
+  keeps the best-scoring box, "fusion" averages them by score, "union"
+  first joins boxes cut by a tile seam with the matching boxes of the other
+  tiles (never a full-frame box) into one box, then applies NMS.
+- Writes the same labels/<stem>.txt files as predict(save_txt=True,
+  save_conf=True), reports frames that cannot be read and reports frames/s
+  and tiles/s.
+
+TILE_SIZE, TILE_OVERLAP and BATCH_SIZE trade latency for throughput and
+recall: smaller tiles and more overlap find smaller defects at more tiles
+per frame, larger batches raise throughput at the cost of per-frame latency.
+
+Usage:
+    python scripts/sliced_inference.py
+    python scripts/sliced_inference.py --source data/merged/images/test --tile 640 --overlap 0.2 --batch 16
+"""
+
+import os
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from box_ops import merge_detections, union_boxes, prediction_lines
+from tile_dataset import tile_grid
+
+# CONFIG
+WEIGHTS = "runs/detect/road_defects_yolov85/weights/best.pt"
+SOURCE = "data/merged/images/test"
+OUTPUT_DIR = "runs/detect/sliced_predict"
+TILE_SIZE = 640
+TILE_OVERLAP = 0.2
+BATCH_SIZE = 16  # tiles per forward pass, across frames
+FULL_FRAME = True  # also run the whole (downscaled) frame
+CONF = 0.25  # notebook predict() threshold
+IOU = 0.7  # NMS inside each tile (ultralytics default)
+MERGE = "nms"  # nms | fusion | union (joins boxes cut by a tile seam, then NMS)
+MERGE_METRIC = "ios"  # iou | ios (intersection over the smaller box)
+MERGE_THRESHOLD = 0.5
+SEAM_MARGIN = 2  # pixels from a tile border within which a box counts as cut by it
+WORKERS = os.cpu_count()
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+class UltralyticsBackend:
+    """Batched predictions from a YOLOv8 checkpoint.
+
+    Called with a list of BGR arrays; returns a list of (xyxy boxes, scores,
+    class ids) NumPy arrays in each array's pixel coordinates.
+    """
+
+    def __init__(self, weights=WEIGHTS, imgsz=TILE_SIZE, conf=CONF, iou=IOU, device=None):
+        from ultralytics import YOLO
+
+        self.model = YOLO(weights)
+        self.names = self.model.names
+        self.kwargs = {"imgsz": imgsz, "conf": conf, "iou": iou, "verbose": False}
+        if device is not None:
+            self.kwargs["device"] = device
+
+    def __call__(self, images):
+        results = self.model.predict(images, **self.kwargs)
+        return [(r.boxes.xyxy.cpu().numpy().astype(np.float64), r.boxes.conf.cpu().numpy().astype(np.float64),
+                 r.boxes.cls.cpu().numpy().astype(np.int64)) for r in results]
+
+
+def list_images(source):
+    if os.path.isfile(source):
+        return [source]
+    return [os.path.join(source, f) for f in sorted(os.listdir(source)) if f.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def read_frames(paths, workers=WORKERS, load=cv2.imread):
+    """Yields (path, load(path)) in order, decoding ahead in a thread pool.
+
+    load defaults to cv2.imread (BGR image, or None if it cannot be read).
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append((path, executor.submit(load, path)))
+            if len(pending) > 2 * workers:
+                path_done, future = pending.popleft()
+                yield path_done, future.result()
+        while pending:
+            path_done, future = pending.popleft()
+            yield path_done, future.result()
+
+
+class _Frame:
+    def __init__(self, key, image, views):
+        self.key = key
+        self.shape = image.shape[:2]
+        self.remaining = views
+        self.parts = []
+
+
+class SlicedPredictor:
+    """Sliced inference over a stream of frames with cross-frame tile batching."""
+
+    def __init__(self, backend, tile=TILE_SIZE, overlap=TILE_OVERLAP, batch_size=BATCH_SIZE, full_frame=FULL_FRAME,
+                 merge=MERGE, merge_metric=MERGE_METRIC, merge_threshold=MERGE_THRESHOLD):
+        self.backend = backend
+        self.tile = tile
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.full_frame = full_frame
+        self.merge = merge
+        self.merge_metric = merge_metric
+        self.merge_threshold = merge_threshold
+        self.tiles_run = 0
+        self.unreadable = []
+
+    def views(self, image):
+        """(x0, y0, crop) views of a frame: its tiles, plus the whole frame with FULL_FRAME."""
+        height, width = image.shape[:2]
+        tiles = tile_grid(width, height, self.tile, self.overlap)
+        views = [(x0, y0, image[y0:y1, x0:x1]) for x0, y0, x1, y1 in tiles.tolist()]
+        if self.full_frame and len(views) > 1:
+            views.append((0, 0, image))
+        return views
+
+    def _run(self, queue, frames):
+        batch = [queue.popleft() for _ in range(min(self.batch_size, len(queue)))]
+        outputs = self.backend([crop for _, _, _, crop in batch])
+        for (frame, x0, y0, crop), (boxes, scores, classes) in zip(batch, outputs):
+            # The tile's frame rectangle, None for the full-frame view
+            h, w = crop.shape[:2]
+            tile = (x0, y0, x0 + w, y0 + h) if (h, w) != frame.shape else None
+            frame.parts.append((boxes + [x0, y0, x0, y0], scores, classes, tile))
+            frame.remaining -= 1
+        self.tiles_run += len(batch)
+
+        # Frames are finished in input order
+        while frames and frames[0].remaining == 0:
+            yield self._finish(frames.popleft())
+
+    def _finish(self, frame):
+        boxes = np.concatenate([p[0] for p in frame.parts]) if frame.parts else np.empty((0, 4))
+        scores = np.concatenate([p[1] for p in frame.parts]) if frame.parts else np.empty(0)
+        classes = np.concatenate([p[2] for p in frame.parts]) if frame.parts else np.empty(0, dtype=np.int64)
+        boxes = boxes.reshape(-1, 4)
+        if len(frame.parts) > 1:
+            mode = self.merge
+            if mode == "union":
+                boxes, scores, classes = self._join_seams(frame, boxes, scores, classes)
+                mode = "nms"
+            boxes, scores, classes = merge_detections(boxes, scores, classes, mode, self.merge_threshold,
+                                                      self.merge_metric)
+        return frame.key, frame.shape, boxes.reshape(-1, 4), scores, classes
+
+    def _join_seams(self, frame, boxes, scores, classes):
+        """Joins boxes cut by a tile seam with the overlapping cut boxes of other tiles.
+
+        Only boxes touching a tile border inside the frame take part, and only
+        across tiles, so a full-frame box or a box inside one tile is never
+        enlarged; the caller deduplicates the result with NMS.
+        """
+        height, width = frame.shape
+        view = np.concatenate([np.full(len(p[1]), k) for k, p in enumerate(frame.parts)]).astype(np.int64)
+        is_tile = np.array([p[3] is not None for p in frame.parts])[view]
+        tiles = np.array([p[3] or (0, 0, width, height) for p in frame.parts], dtype=np.float64)[view]
+        x1, y1, x2, y2 = boxes.T
+        tx1, ty1, tx2, ty2 = tiles.T
+        m = SEAM_MARGIN
+        cut = is_tile & (((x1 <= tx1 + m) & (tx1 > 0)) | ((y1 <= ty1 + m) & (ty1 > 0)) |
+                         ((x2 >= tx2 - m) & (tx2 < width)) | ((y2 >= ty2 - m) & (ty2 < height)))
+        if not cut.any():
+            return boxes, scores, classes
+        joined = union_boxes(boxes[cut], scores[cut], classes[cut], self.merge_threshold, self.merge_metric,
+                             groups=view[cut])
+        return (np.concatenate([joined[0], boxes[~cut]]), np.concatenate([joined[1], scores[~cut]]),
+                np.concatenate([joined[2], classes[~cut]]))
+
+    def predict_stream(self, frames):
+        """Consumes (key, BGR image) pairs and yields (key, (h, w), boxes, scores, classes) per frame.
+
+        Boxes are [x1, y1, x2, y2] in frame pixels. Frames that are None are
+        reported, recorded in self.unreadable and skipped.
+        """
+        queue, pending = deque(), deque()
+        for key, image in frames:
+            if image is None:
+                print(f" Unreadable: {key}")
+                self.unreadable.append(key)
+                continue
+            views = self.views(image)
+            frame = _Frame(key, image, len(views))
+            pending.append(frame)
+            queue.extend((frame, x0, y0, crop) for x0, y0, crop in views)
+            while len(queue) >= self.batch_size:
+                yield from self._run(queue, pending)
+        while queue:
+            yield from self._run(queue, pending)
+
+    def predict(self, images):
+        """Predicts a list of BGR frames; returns a list of (boxes, scores, classes)."""
+        return [result[2:] for result in self.predict_stream(enumerate(images))]
+
+
+def write_prediction(label_dir, path, shape, boxes, scores, classes):
+    """Writes labels/<stem>.txt; like ultralytics, frames without detections get no file."""
+    if not len(boxes):
+        return
+    height, width = shape
+    lines = prediction_lines(boxes, scores, classes, width, height)
+    with open(os.path.join(label_dir, os.path.splitext(os.path.basename(path))[0] + ".txt"), "w") as f:
+        f.write("".join(line + "\n" for line in lines))
+
+
+def sliced_predict(source=SOURCE, output_dir=OUTPUT_DIR, weights=WEIGHTS, tile=TILE_SIZE, overlap=TILE_OVERLAP,
+                   batch_size=BATCH_SIZE, full_frame=FULL_FRAME, merge=MERGE, workers=WORKERS, backend=None):
+    paths = list_images(source)
+    backend = backend or UltralyticsBackend(weights, imgsz=tile)
+    predictor = SlicedPredictor(backend, tile, overlap, batch_size, full_frame, merge)
+    label_dir = os.path.join(output_dir, "labels")
+    os.makedirs(label_dir, exist_ok=True)
+
+    frames = detections = 0
+    start = time.perf_counter()
+    for path, shape, boxes, scores, classes in tqdm(predictor.predict_stream(read_frames(paths, workers)),
+                                                    total=len(paths), desc="Sliced inference"):
+        write_prediction(label_dir, path, shape, boxes, scores, classes)
+        frames += 1
+        detections += len(boxes)
+    elapsed = time.perf_counter() - start
+
+    unreadable = f" ({len(predictor.unreadable)} unreadable)" if predictor.unreadable else ""
+    print(f" {frames} frames{unreadable}, {predictor.tiles_run} tiles, {detections} detections in {elapsed:.1f}s "
+          f"({frames / max(elapsed, 1e-9):.2f} frames/s, {predictor.tiles_run / max(elapsed, 1e-9):.1f} tiles/s)")
+    print(f" Labels saved to {label_dir}")
+    return frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sliced (tiled) inference on full-resolution frames.")
+    parser.add_argument("--weights", default=WEIGHTS)
+    parser.add_argument("--source", default=SOURCE, help="image file or folder")
+    parser.add_argument("--output", default=OUTPUT_DIR)
+    parser.add_argument("--tile", type=int, default=TILE_SIZE)
+    parser.add_argument("--overlap", type=float, default=TILE_OVERLAP)
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="tiles per forward pass")
+    parser.add_argument("--no-full-frame", action="store_true", help="only run the tiles")
+    parser.add_argument("--merge", choices=["nms", "fusion", "union"], default=MERGE)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+
+    sliced_predict(args.source, args.output, args.weights, args.tile, args.overlap, args.batch,
+                   not args.no_full_frame, args.merge, args.workers)
@@ -4,9 +4,13 @@ split_cleaned_code.py
 Splits a cleaned, merged dataset into train, val, and test subsets.
 
 Functionality:
-- Applies stratified or random splitting logic.
-- Outputs separate COCO JSON files for each split.
-- Optionally copies images to new directories.
+- Applies random or multi-label iterative stratified splitting, optionally
+  keeping groups of images (e.g. one source dataset, or the near-duplicate
+  clusters found by near_duplicates.py) inside a single split.
+- Outputs separate COCO JSON files for each split, streaming the annotations.
+- Places images into per-split directories, hardlinking or reflinking
+  them where possible instead of copying, or writes <split>.txt manifests
+  that YOLO reads directly without touching the images at all.
 
 Crucial step before training for organizing data correctly.
 """
@@ -14,82 +18,293 @@ Crucial step before training for organizing data correctly.
 import os
 import json
 import random
-import shutil
+from array import array
+
+import numpy as np
 from tqdm import tqdm
+from file_placement import place_file
+from coco_io import CocoWriter, iter_images, iter_annotations, load_categories
 
 # CONFIG
 SEED = 42
 VAL_RATIO = 0.1
 TEST_RATIO = 0.1
+LINK_MODE = "auto"  # copy | hardlink | reflink | symlink | auto (see file_placement.py)
+SPLIT_STRATEGY = "random"  # random | stratified (multi-label iterative stratification)
+PLACEMENT = "copy"  # copy: place images into images/<split>; manifest: write <split>.txt image lists
+GROUP_KEY = None  # image field whose values must not be shared across splits, e.g. "source"
+DUPLICATE_CLUSTERS = None  # near_duplicates.py output, e.g. "data/merged/near_duplicates.json"
 
 INPUT_JSON = "data/merged/merged_coco_cleaned.json"
 IMG_DIR = "data/merged/images"
 OUTPUT_BASE = "data/merged"
 OUTPUT_IMG_DIR = os.path.join(OUTPUT_BASE, "images")
 ANNOTATIONS_DIR = os.path.join(OUTPUT_BASE, "annotations")
-os.makedirs(ANNOTATIONS_DIR, exist_ok=True)
-
-# SETUP SPLIT DIRS
-for split in ["train", "val", "test"]:
-    os.makedirs(os.path.join(OUTPUT_IMG_DIR, split), exist_ok=True)
-
-# LOAD COCO
-with open(INPUT_JSON) as f:
-    coco = json.load(f)
-
-# SPLIT IMAGES
-images = coco["images"]
-random.seed(SEED)
-random.shuffle(images)
-
-n = len(images)
-n_val = int(n * VAL_RATIO)
-n_test = int(n * TEST_RATIO)
-n_train = n - n_val - n_test
-
-splits = {
-    "train": images[:n_train],
-    "val": images[n_train:n_train + n_val],
-    "test": images[n_train + n_val:]
-}
-
-# MAP image_id -> split
-image_id_to_split = {}
-for split, imgs in splits.items():
-    for img in imgs:
-        image_id_to_split[img["id"]] = split
-
-# SPLIT ANNOTATIONS
-split_annotations = {"train": [], "val": [], "test": []}
-for ann in coco["annotations"]:
-    img_id = ann["image_id"]
-    split = image_id_to_split.get(img_id)
-    if split:
-        split_annotations[split].append(ann)
-
-# GENERATE SPLIT JSONs + COPY IMAGES
-for split in ["train", "val", "test"]:
-    imgs = splits[split]
-    anns = split_annotations[split]
-
-    out_json = {
-        "images": imgs,
-        "annotations": anns,
-        "categories": coco["categories"]
+SPLITS = ["train", "val", "test"]
+
+
+def random_split(images, seed=SEED, val_ratio=VAL_RATIO, test_ratio=TEST_RATIO):
+    """Shuffles images with a fixed seed and cuts them into train/val/test."""
+    random.seed(seed)
+    random.shuffle(images)
+
+    n = len(images)
+    n_val = int(n * val_ratio)
+    n_test = int(n * test_ratio)
+    n_train = n - n_val - n_test
+
+    return {
+        "train": images[:n_train],
+        "val": images[n_train:n_train + n_val],
+        "test": images[n_train + n_val:]
     }
 
-    with open(os.path.join(ANNOTATIONS_DIR, f"{split}_coco.json"), "w") as f:
-        json.dump(out_json, f, indent=4)
 
-    for img in tqdm(imgs, desc=f"Copying {split} images"):
-        src_path = os.path.join(IMG_DIR, img["file_name"])
-        dst_path = os.path.join(OUTPUT_IMG_DIR, split, img["file_name"])
-        shutil.copy(src_path, dst_path)
+def class_matrix(annotations, images, categories):
+    """Per-image annotation counts per category, shape (n_images, n_categories)."""
+    row_of = {img["id"]: i for i, img in enumerate(images)}
+    col_of = {cat["id"]: j for j, cat in enumerate(categories)}
+
+    cells = array("q")
+    for ann in annotations:
+        row = row_of.get(ann["image_id"])
+        col = col_of.get(ann["category_id"])
+        if row is not None and col is not None:
+            cells.append(row * len(categories) + col)
+
+    counts = np.bincount(np.frombuffer(cells, dtype=np.int64), minlength=len(images) * len(categories))
+    return counts.reshape(len(images), len(categories))
+
+
+def random_group_split(images, groups, seed=SEED, val_ratio=VAL_RATIO, test_ratio=TEST_RATIO):
+    """random_split() over whole groups: shuffles the groups and fills train, val, test in turn."""
+    num_groups = groups.max() + 1 if len(groups) else 0
+    order = list(range(num_groups))
+    random.seed(seed)
+    random.shuffle(order)
+
+    n = len(images)
+    n_val = int(n * val_ratio)
+    n_test = int(n * test_ratio)
+    n_train = n - n_val - n_test
+
+    # A group goes to the first split whose quota is not yet filled when it comes up
+    sizes = np.bincount(groups, minlength=num_groups)[order]
+    filled = np.cumsum(sizes) - sizes
+    split_of_group = np.empty(num_groups, dtype=np.int64)
+    split_of_group[order] = np.searchsorted([n_train, n_train + n_val], filled, side="right")
+
+    rank = np.empty(num_groups, dtype=np.int64)
+    rank[order] = np.arange(num_groups)
+    assignment = split_of_group[groups]
+    by_rank = np.argsort(rank[groups], kind="stable")
+    return {split: [images[i] for i in by_rank if assignment[i] == s] for s, split in enumerate(SPLITS)}
+
+
+def group_index(images, group_key):
+    """Returns a group number per image; images lacking the key form their own group.
+
+    group_key is an image field, a callable, or a list of those; with a list,
+    images sharing a value of any of the keys end up in the same group.
+    """
+    keys = group_key if isinstance(group_key, (list, tuple)) else [group_key]
+    parent = np.arange(len(images))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for key_fn in keys:
+        if key_fn is None:
+            continue
+        first = {}
+        for i, img in enumerate(images):
+            key = key_fn(img) if callable(key_fn) else img.get(key_fn)
+            if key is not None:
+                root, other = find(i), find(first.setdefault(key, i))
+                parent[max(root, other)] = min(root, other)
+
+    # Number groups in order of first appearance
+    codes = {}
+    return np.array([codes.setdefault(find(i), len(codes)) for i in range(len(images))], dtype=np.int64)
+
+
+def duplicate_group_key(clusters_path):
+    """Group key mapping each file name to its near-duplicate cluster (see near_duplicates.py)."""
+    with open(clusters_path, "r") as f:
+        clusters = json.load(f)["clusters"]
+    cluster_of = {name: c for c, names in enumerate(clusters) for name in names}
+    return lambda img: cluster_of.get(img["file_name"])
+
+
+def with_duplicate_clusters(group_key, clusters_path):
+    """Adds the near-duplicate clusters to group_key, so each cluster stays in one split."""
+    if not clusters_path:
+        return group_key
+    keys = list(group_key) if isinstance(group_key, (list, tuple)) else [group_key]
+    return [k for k in keys if k is not None] + [duplicate_group_key(clusters_path)]
+
+
+def iterative_stratification(Y, ratios, sizes=None, seed=SEED):
+    """Multi-label iterative stratification (Sechidis et al., 2011).
+
+    Rows of Y are the units to assign (images or groups of images) and
+    columns the per-class annotation counts. Repeatedly takes the class with
+    the fewest unassigned units and hands each of those units to the split
+    that still needs the most of that class (ties: most remaining capacity,
+    then random). Returns the split index of every row.
+    """
+    rng = np.random.default_rng(seed)
+    Y = np.asarray(Y, dtype=np.float64)
+    n = Y.shape[0]
+    ratios = np.asarray(ratios, dtype=np.float64)
+    sizes = np.ones(n) if sizes is None else np.asarray(sizes, dtype=np.float64)
+
+    need = ratios[:, None] * Y.sum(axis=0)
+    need_size = ratios * sizes.sum()
+    present = Y > 0
+    remaining = present.sum(axis=0)
+    assignment = np.full(n, -1, dtype=np.int64)
+    order = rng.permutation(n)
+
+    def pick(scores):
+        best = np.flatnonzero(scores == scores.max())
+        if len(best) > 1:
+            capacity = need_size[best]
+            best = best[capacity == capacity.max()]
+        return best[0] if len(best) == 1 else rng.choice(best)
+
+    while True:
+        active = np.flatnonzero(remaining > 0)
+        if not active.size:
+            break
+        label = active[np.argmin(remaining[active])]
+
+        candidates = order[present[order, label] & (assignment[order] < 0)]
+        for unit in candidates:
+            split = pick(need[:, label])
+            assignment[unit] = split
+            need[split] -= Y[unit]
+            need_size[split] -= sizes[unit]
+        remaining -= present[candidates].sum(axis=0)
+
+    # Units without any annotation only balance the split sizes
+    for unit in order[assignment[order] < 0]:
+        split = pick(need_size)
+        assignment[unit] = split
+        need_size[split] -= sizes[unit]
+
+    return assignment
+
+
+def stratified_split(annotations, images, categories, seed=SEED, val_ratio=VAL_RATIO,
+                     test_ratio=TEST_RATIO, group_key=GROUP_KEY):
+    """Class-stratified train/val/test split; images sharing a group key stay together."""
+    Y = class_matrix(annotations, images, categories)
+    groups = group_index(images, group_key)
+
+    num_groups = groups.max() + 1 if len(groups) else 0
+    Y_groups = np.zeros((num_groups, Y.shape[1]), dtype=np.int64)
+    np.add.at(Y_groups, groups, Y)
+    sizes = np.bincount(groups, minlength=num_groups)
+
+    ratios = [1 - val_ratio - test_ratio, val_ratio, test_ratio]
+    assignment = iterative_stratification(Y_groups, ratios, sizes, seed)[groups]
+    return {split: [img for img, a in zip(images, assignment) if a == i] for i, split in enumerate(SPLITS)}
+
+
+def make_splits(strategy, images, annotations, categories, seed=SEED, val_ratio=VAL_RATIO,
+                test_ratio=TEST_RATIO, group_key=GROUP_KEY):
+    """Dispatches on SPLIT_STRATEGY; `annotations` is only read by the stratified strategy."""
+    if strategy == "random":
+        if group_key is None:
+            return random_split(images, seed, val_ratio, test_ratio)
+        return random_group_split(images, group_index(images, group_key), seed, val_ratio, test_ratio)
+    if strategy == "stratified":
+        return stratified_split(annotations, images, categories, seed, val_ratio, test_ratio, group_key)
+    raise ValueError(f"Unknown SPLIT_STRATEGY: {strategy!r}")
+
+
+def write_split_jsons(input_json, splits, annotations_dir, categories):
+    """Writes {split}_coco.json files, routing annotations in a single streaming pass."""
+    # MAP image_id -> split
+    image_id_to_split = {}
+    for split, imgs in splits.items():
+        for img in imgs:
+            image_id_to_split[img["id"]] = split
+
+    writers = {}
+    for split, imgs in splits.items():
+        writers[split] = CocoWriter(os.path.join(annotations_dir, f"{split}_coco.json"),
+                                    categories, interleaved=False)
+        writers[split].add_images(imgs)
+
+    # SPLIT ANNOTATIONS
+    for ann in iter_annotations(input_json):
+        split = image_id_to_split.get(ann["image_id"])
+        if split:
+            writers[split].add_annotation(ann)
+
+    for writer in writers.values():
+        writer.close()
+    return {split: writer.num_annotations for split, writer in writers.items()}
+
+
+def copy_split_images(splits, img_dir, output_img_dir, link_mode=LINK_MODE):
+    for split, imgs in splits.items():
+        os.makedirs(os.path.join(output_img_dir, split), exist_ok=True)
+        for img in tqdm(imgs, desc=f"Placing {split} images"):
+            src_path = os.path.join(img_dir, img["file_name"])
+            dst_path = os.path.join(output_img_dir, split, img["file_name"])
+            place_file(src_path, dst_path, link_mode)
+
+
+def write_manifests(splits, img_dir, output_base):
+    """Writes <split>.txt image lists that YOLO accepts in place of image folders.
+
+    Paths start with "./" so YOLO resolves them relative to the list file.
+    Labels are then looked up under <output_base>/labels/ (flat, no split
+    subfolders), see LABEL_LAYOUT in convert_coco_to_yolo.py.
+    """
+    rel_dir = os.path.relpath(img_dir, output_base)
+    prefix = os.path.abspath(img_dir) if rel_dir.startswith("..") else "./" + rel_dir
+
+    for split, imgs in splits.items():
+        with open(os.path.join(output_base, f"{split}.txt"), "w") as f:
+            f.writelines(f"{prefix}/{img['file_name']}\n" for img in imgs)
+
+
+def split_dataset(input_json, img_dir, annotations_dir, output_img_dir, output_base=OUTPUT_BASE,
+                  strategy=SPLIT_STRATEGY, placement=PLACEMENT, group_key=GROUP_KEY,
+                  seed=SEED, val_ratio=VAL_RATIO, test_ratio=TEST_RATIO, link_mode=LINK_MODE,
+                  duplicate_clusters=DUPLICATE_CLUSTERS):
+    os.makedirs(annotations_dir, exist_ok=True)
+
+    # LOAD IMAGES (annotations are streamed)
+    images = list(iter_images(input_json))
+    categories = load_categories(input_json)
+    group_key = with_duplicate_clusters(group_key, duplicate_clusters)
+    splits = make_splits(strategy, images, iter_annotations(input_json), categories,
+                         seed, val_ratio, test_ratio, group_key)
+
+    # GENERATE SPLIT JSONs + PLACE IMAGES OR WRITE MANIFESTS
+    ann_counts = write_split_jsons(input_json, splits, annotations_dir, categories)
+    if placement == "manifest":
+        write_manifests(splits, img_dir, output_base)
+    else:
+        copy_split_images(splits, img_dir, output_img_dir, link_mode)
+
+    for split in SPLITS:
+        print(f" {split}: {len(splits[split])} images, {ann_counts[split]} annotations → {split}_coco.json")
+
+    # === Summary ===
+    print("\n Split complete:")
+    print(f"  Train: {len(splits['train'])} images")
+    print(f"  Val  : {len(splits['val'])} images")
+    print(f"  Test : {len(splits['test'])} images")
 
-    print(f" {split}: {len(imgs)} images, {len(anns)} annotations → {split}_coco.json")
 
-# === Summary ===
-print("\n Split complete:")
-print(f"  Train: {n_train} images")
-print(f"  Val  : {n_val} images")
-print(f"  Test : {n_test} images")
\ No newline at end of file
+if __name__ == "__main__":
+    split_dataset(INPUT_JSON, IMG_DIR, ANNOTATIONS_DIR, OUTPUT_IMG_DIR)
@@ -0,0 +1,218 @@
+"""
+synthetic_data.py
+
+Generates synthetic source datasets in the raw layouts the converters read,
+at any scale, for benchmarking the scripts/ pipeline without the real data.
+
+Functionality:
+- RDD2022-style VOC XML (four countries, D00/D10/D20/D40 plus unmapped
+  labels), UAV-PDD2023-style VOC XML, HighRPD-style YOLO txt labels and a
+  standalone COCO JSON, with annotation counts split across the sources.
+- Images are tiny JPEG stubs whose SOF header carries the recorded
+  width/height (so image_probe.py sees consistent sizes) and whose trailing
+  bytes make every file unique (so merge deduplication finds nothing).
+  MISMATCH_RATE of the VOC files record a wrong size, as the real data does.
+- Deterministic for a given seed; writes manifest.json with the paths the
+  benchmark (benchmark_pipeline.py) feeds to every stage.
+
+Usage:
+    python scripts/synthetic_data.py --annotations 100000 --output data/synthetic/100k
+"""
+
+import os
+import json
+import argparse
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from coco_io import CocoWriter
+
+# CONFIG
+OUTPUT_ROOT = "data/synthetic"
+NUM_ANNOTATIONS = 10000
+SEED = 0
+BOXES_PER_IMAGE = 3.0  # mean; at least one box per image
+MISMATCH_RATE = 0.01  # VOC files recording a wrong image size
+UNMAPPED_RATE = 0.05  # RDD2022 objects with labels the converter skips (D43, D44, ...)
+
+RDD_COUNTRIES = ["Japan", "India", "China_MotorBike", "China_Drone"]
+# source: (share of annotations, image size)
+SOURCES = {
+    "RDD2022_Japan": (0.2, (600, 600)),
+    "RDD2022_India": (0.1, (720, 720)),
+    "RDD2022_China_MotorBike": (0.1, (512, 512)),
+    "RDD2022_China_Drone": (0.1, (512, 512)),
+    "UAV_PDD2023": (0.2, (2592, 1944)),
+    "HighRPD": (0.2, (640, 640)),
+    "COCO": (0.1, (1024, 768)),
+}
+RDD_LABELS = ["D00", "D10", "D20", "D40"]
+RDD_UNMAPPED = ["D43", "D44", "D50"]
+UAV_LABELS = ["Longitudinal crack", "Transverse crack", "Oblique crack", "Alligator crack", "Repair", "Pothole"]
+HIGHRPD_CLASSES = 2
+COCO_CATEGORIES = [{"id": i, "name": name} for i, name in enumerate(
+    ["longitudinal_crack", "transverse_crack", "oblique_crack", "alligator_crack", "patch", "pothole",
+     "line_crack", "block_crack"])]
+
+VOC_TEMPLATE = ("<annotation>\n\t<folder>images</folder>\n\t<filename>{file_name}</filename>\n"
+                "\t<size>\n\t\t<width>{width}</width>\n\t\t<height>{height}</height>\n\t\t<depth>3</depth>\n"
+                "\t</size>\n{objects}</annotation>\n")
+VOC_OBJECT = ("\t<object>\n\t\t<name>{name}</name>\n\t\t<pose>Unspecified</pose>\n\t\t<truncated>0</truncated>\n"
+              "\t\t<difficult>0</difficult>\n\t\t<bndbox>\n\t\t\t<xmin>{x1}</xmin>\n\t\t\t<ymin>{y1}</ymin>\n"
+              "\t\t\t<xmax>{x2}</xmax>\n\t\t\t<ymax>{y2}</ymax>\n\t\t</bndbox>\n\t</object>\n")
+
+_JPEG_TEMPLATE = None
+
+
+def jpeg_stub(width, height, index):
+    """A small JPEG whose frame header says width x height; `index` makes the bytes unique."""
+    global _JPEG_TEMPLATE
+    if _JPEG_TEMPLATE is None:
+        _JPEG_TEMPLATE = bytearray(cv2.imencode(".jpg", np.zeros((8, 8, 3), dtype=np.uint8))[1].tobytes())
+    data = bytearray(_JPEG_TEMPLATE)
+    sof = data.find(b"\xff\xc0")
+    data[sof + 5:sof + 9] = height.to_bytes(2, "big") + width.to_bytes(2, "big")
+    return bytes(data) + index.to_bytes(8, "big")  # after EOI, ignored by decoders
+
+
+def image_counts(num_annotations, rng):
+    """Boxes per image for every source, adding up to the source's share of num_annotations."""
+    counts = {}
+    for source, (share, _) in SOURCES.items():
+        target = int(round(num_annotations * share))
+        boxes = []
+        while target > 0:
+            n = min(target, 1 + int(rng.poisson(BOXES_PER_IMAGE - 1)))
+            boxes.append(n)
+            target -= n
+        counts[source] = np.array(boxes, dtype=np.int64)
+    return counts
+
+
+def random_boxes(rng, n, width, height):
+    """n integer [x1, y1, x2, y2] boxes inside the image."""
+    w = np.maximum(4, rng.uniform(0.02, 0.4, n) * width).astype(np.int64)
+    h = np.maximum(4, rng.uniform(0.02, 0.4, n) * height).astype(np.int64)
+    x1 = (rng.random(n) * (width - w)).astype(np.int64)
+    y1 = (rng.random(n) * (height - h)).astype(np.int64)
+    return np.stack([x1, y1, x1 + w, y1 + h], axis=1)
+
+
+def write_file(path, data, mode="w"):
+    with open(path, mode) as f:
+        f.write(data)
+
+
+def write_voc_source(img_dir, xml_dir, prefix, boxes_per_image, size, labels, unmapped, rng, counter):
+    os.makedirs(img_dir, exist_ok=True)
+    os.makedirs(xml_dir, exist_ok=True)
+    width, height = size
+    for i, n in enumerate(tqdm(boxes_per_image, desc=prefix)):
+        file_name = f"{prefix}_{i:07d}.jpg"
+        write_file(os.path.join(img_dir, file_name), jpeg_stub(width, height, counter + i), "wb")
+
+        names = rng.choice(labels, n)
+        if unmapped:
+            swap = rng.random(n) < UNMAPPED_RATE
+            names[swap] = rng.choice(unmapped, int(swap.sum()))
+        objects = "".join(VOC_OBJECT.format(name=name, x1=x1, y1=y1, x2=x2, y2=y2)
+                          for name, (x1, y1, x2, y2) in zip(names, random_boxes(rng, n, width, height).tolist()))
+        recorded = (width + 1, height) if rng.random() < MISMATCH_RATE else (width, height)
+        write_file(os.path.join(xml_dir, f"{prefix}_{i:07d}.xml"),
+                   VOC_TEMPLATE.format(file_name=file_name, width=recorded[0], height=recorded[1], objects=objects))
+    return counter + len(boxes_per_image)
+
+
+def write_yolo_source(img_dir, label_dir, prefix, boxes_per_image, size, rng, counter):
+    os.makedirs(img_dir, exist_ok=True)
+    os.makedirs(label_dir, exist_ok=True)
+    width, height = size
+    for i, n in enumerate(tqdm(boxes_per_image, desc=prefix)):
+        file_name = f"{prefix}_{i:07d}"
+        write_file(os.path.join(img_dir, file_name + ".jpg"), jpeg_stub(width, height, counter + i), "wb")
+        x1, y1, x2, y2 = random_boxes(rng, n, width, height).T
+        rows = np.stack([rng.integers(0, HIGHRPD_CLASSES, n), (x1 + x2) / 2 / width, (y1 + y2) / 2 / height,
+                         (x2 - x1) / width, (y2 - y1) / height], axis=1)
+        write_file(os.path.join(label_dir, file_name + ".txt"),
+                   "".join("%d %.6f %.6f %.6f %.6f\n" % (int(r[0]), *r[1:]) for r in rows))
+    return counter + len(boxes_per_image)
+
+
+def write_coco_source(img_dir, json_path, boxes_per_image, size, rng, counter):
+    os.makedirs(img_dir, exist_ok=True)
+    width, height = size
+    with CocoWriter(json_path, COCO_CATEGORIES) as writer:
+        for i, n in enumerate(tqdm(boxes_per_image, desc="COCO")):
+            file_name = f"coco_{i:07d}.jpg"
+            write_file(os.path.join(img_dir, file_name), jpeg_stub(width, height, counter + i), "wb")
+            writer.add_image({"id": i, "file_name": file_name, "width": width, "height": height})
+            categories = rng.integers(0, len(COCO_CATEGORIES), n)
+            for cat, (x1, y1, x2, y2) in zip(categories.tolist(), random_boxes(rng, n, width, height).tolist()):
+                writer.add_annotation({"id": writer.num_annotations, "image_id": i, "category_id": cat,
+                                       "bbox": [x1, y1, x2 - x1, y2 - y1], "area": (x2 - x1) * (y2 - y1),
+                                       "iscrowd": 0})
+    return counter + len(boxes_per_image)
+
+
+def generate(output_root=OUTPUT_ROOT, num_annotations=NUM_ANNOTATIONS, seed=SEED):
+    """Writes all synthetic sources under output_root; returns the manifest."""
+    rng = np.random.default_rng(seed)
+    counts = image_counts(num_annotations, rng)
+    root = os.path.abspath(output_root)
+    manifest = {"root": root, "annotations": num_annotations, "seed": seed,
+                "images": int(sum(len(c) for c in counts.values())), "voc": [], "yolo": [], "coco": [],
+                "merge_datasets": []}
+    counter = 0
+
+    for country in RDD_COUNTRIES:
+        source = f"RDD2022_{country}"
+        base = os.path.join(root, "RDD2022", source)
+        img_dir, xml_dir = os.path.join(base, "images"), os.path.join(base, "annotations", "xmls")
+        counter = write_voc_source(img_dir, xml_dir, source.lower(), counts[source], SOURCES[source][1], RDD_LABELS,
+                                   RDD_UNMAPPED, rng, counter)
+        out_json = os.path.join(root, "RDD2022", f"rdd2022_{country.lower()}_coco.json")
+        manifest["voc"].append({"name": source, "converter": "rdd2022", "xml_dir": xml_dir, "img_dir": img_dir,
+                                "json": out_json})
+
+    base = os.path.join(root, "UAV_PDD2023")
+    img_dir, xml_dir = os.path.join(base, "JPEGImages"), os.path.join(base, "Annotations")
+    counter = write_voc_source(img_dir, xml_dir, "uavpdd", counts["UAV_PDD2023"], SOURCES["UAV_PDD2023"][1],
+                               UAV_LABELS, [], rng, counter)
+    manifest["voc"].append({"name": "UAV_PDD2023", "converter": "uavpdd2023", "xml_dir": xml_dir,
+                            "img_dir": img_dir, "json": os.path.join(base, "uavpdd2023_coco.json")})
+
+    base = os.path.join(root, "HighRPD")
+    img_dir, label_dir = os.path.join(base, "images"), os.path.join(base, "labels")
+    counter = write_yolo_source(img_dir, label_dir, "highrpd", counts["HighRPD"], SOURCES["HighRPD"][1], rng,
+                                counter)
+    manifest["yolo"].append({"name": "HighRPD", "img_dir": img_dir, "label_dir": label_dir,
+                             "json": os.path.join(base, "highrpd_coco.json")})
+
+    base = os.path.join(root, "COCO")
+    img_dir, json_path = os.path.join(base, "images"), os.path.join(base, "synthetic_coco.json")
+    write_coco_source(img_dir, json_path, counts["COCO"], SOURCES["COCO"][1], rng, counter)
+    manifest["coco"].append({"name": "COCO", "img_dir": img_dir, "json": json_path})
+
+    manifest["merge_datasets"] = [{"name": ds["name"], "json": ds["json"], "img_dir": ds["img_dir"]}
+                                  for ds in manifest["voc"] + manifest["yolo"] + manifest["coco"]]
+    with open(os.path.join(root, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f" Synthetic data: {manifest['images']} images, {num_annotations} annotations → {root}")
+    return manifest
+
+
+def load_manifest(output_root):
+    with open(os.path.join(output_root, "manifest.json")) as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic VOC / YOLO / COCO source datasets.")
+    parser.add_argument("--annotations", type=int, default=NUM_ANNOTATIONS, help="total annotations (1k - 1M)")
+    parser.add_argument("--output", default=OUTPUT_ROOT)
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+
+    generate(args.output, args.annotations, args.seed)
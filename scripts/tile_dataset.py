@@ -0,0 +1,251 @@
+"""
+tile_dataset.py
+
+Cuts high-resolution images (e.g. 2592x1944 UAV-PDD2023 frames) into
+overlapping fixed-size training tiles, so small cracks keep their pixels
+without raising imgsz for the whole dataset.
+
+Functionality:
+- Reads the per-split reindexed COCO files; images whose longest side is
+  above TILE_MIN_SIDE are tiled on a regular grid with TILE_OVERLAP, the
+  last row/column aligned to the image border. Smaller images pass through
+  unchanged as a single "tile".
+- Clips every box to each tile with vectorized intersections, drops slivers
+  whose visible fraction is below MIN_VISIBILITY (or that end up smaller
+  than MIN_BOX_SIDE pixels), and optionally skips tiles without boxes.
+- Crops and writes tiles in a process pool, then writes a per-split COCO
+  file (tile images carry source_image_id / tile_x / tile_y), YOLO labels
+  through convert_coco_to_yolo's engine, a tile -> source map and data.yaml.
+
+Usage:
+    python scripts/tile_dataset.py
+    python scripts/tile_dataset.py --tile 640 --overlap 0.2 --keep-empty
+"""
+
+import os
+import json
+import argparse
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from coco_io import CocoWriter, iter_images, iter_annotations, load_categories
+from convert_coco_to_yolo import convert_arrays
+from file_placement import place_file
+from resize_cache import write_data_yaml
+
+# CONFIG
+TILE_SIZE = 640
+TILE_OVERLAP = 0.2  # fraction of TILE_SIZE shared by neighbouring tiles
+TILE_MIN_SIDE = 1280  # only images with a longer side than this are tiled
+MIN_VISIBILITY = 0.3  # drop clipped boxes keeping less than this fraction of their area
+MIN_BOX_SIDE = 2  # pixels
+SKIP_EMPTY_TILES = True
+JPEG_QUALITY = 95
+ANNOTATIONS_DIR = "data/merged/annotations"
+SOURCE_IMG_DIRS = ["data/merged/images/{split}", "data/merged/images"]  # first match wins
+OUTPUT_ROOT = "data/merged_tiles"
+SPLITS = ["train", "val", "test"]
+WORKERS = os.cpu_count()
+LINK_MODE = "auto"
+
+
+def tile_starts(length, tile, overlap):
+    """Start offsets along one axis; the last tile ends exactly at `length`."""
+    if length <= tile:
+        return np.array([0])
+    step = max(1, int(round(tile * (1 - overlap))))
+    count = int(np.ceil((length - tile) / step)) + 1
+    return np.unique(np.minimum(np.arange(count) * step, length - tile))
+
+
+def tile_grid(width, height, tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Tiles as an (n, 4) array of [x0, y0, x1, y1] pixel windows."""
+    xs, ys = tile_starts(width, tile, overlap), tile_starts(height, tile, overlap)
+    x0, y0 = np.meshgrid(xs, ys)
+    x0, y0 = x0.ravel(), y0.ravel()
+    return np.stack([x0, y0, np.minimum(x0 + tile, width), np.minimum(y0 + tile, height)], axis=1)
+
+
+def clip_to_tiles(bboxes, tiles, min_visibility=MIN_VISIBILITY, min_side=MIN_BOX_SIDE):
+    """Clips COCO [x, y, w, h] boxes to every tile at once.
+
+    Returns (tile index, box index, clipped boxes in tile coordinates) of the
+    boxes that stay visible enough in each tile.
+    """
+    x1, y1 = bboxes[:, 0], bboxes[:, 1]
+    x2, y2 = x1 + bboxes[:, 2], y1 + bboxes[:, 3]
+    ix1 = np.maximum(tiles[:, None, 0], x1[None])
+    iy1 = np.maximum(tiles[:, None, 1], y1[None])
+    ix2 = np.minimum(tiles[:, None, 2], x2[None])
+    iy2 = np.minimum(tiles[:, None, 3], y2[None])
+    iw, ih = ix2 - ix1, iy2 - iy1
+
+    area = bboxes[:, 2] * bboxes[:, 3]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        visibility = np.where(area > 0, iw * ih / area, 0)
+    keep = (iw >= min_side) & (ih >= min_side) & (visibility >= min_visibility)
+
+    t, b = np.nonzero(keep)
+    clipped = np.stack([ix1[t, b] - tiles[t, 0], iy1[t, b] - tiles[t, 1], iw[t, b], ih[t, b]], axis=1)
+    return t, b, clipped
+
+
+def tile_image(image, bboxes, category_ids, src_path, out_dir, tile=TILE_SIZE, overlap=TILE_OVERLAP,
+               min_side_to_tile=TILE_MIN_SIDE, skip_empty=SKIP_EMPTY_TILES):
+    """Tiles one image; returns a list of (tile image record, boxes, category ids), or None if unreadable."""
+    width, height = image["width"], image["height"]
+    stem, ext = os.path.splitext(image["file_name"])
+
+    if max(width, height) <= min_side_to_tile:
+        place_file(src_path, os.path.join(out_dir, image["file_name"]), LINK_MODE)
+        record = {"file_name": image["file_name"], "width": width, "height": height, "tile_x": 0, "tile_y": 0}
+        return [(record, bboxes, category_ids)]
+
+    tiles = tile_grid(width, height, tile, overlap)
+    t, b, clipped = clip_to_tiles(bboxes, tiles)
+    img = cv2.imread(src_path)
+    if img is None:
+        return None
+
+    results = []
+    for i, (x0, y0, x1, y1) in enumerate(tiles.tolist()):
+        in_tile = t == i
+        if skip_empty and not in_tile.any():
+            continue
+        name = f"{stem}_{x0}_{y0}.jpg"
+        cv2.imwrite(os.path.join(out_dir, name), img[y0:y1, x0:x1], [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        record = {"file_name": name, "width": x1 - x0, "height": y1 - y0, "tile_x": x0, "tile_y": y0}
+        results.append((record, clipped[in_tile], category_ids[b[in_tile]]))
+    return results
+
+
+def _tile_batch(jobs, out_dir, tile, overlap, min_side_to_tile, skip_empty):
+    return [(image["id"], tile_image(image, bboxes, cats, src, out_dir, tile, overlap, min_side_to_tile, skip_empty))
+            for image, bboxes, cats, src in jobs]
+
+
+def find_source(file_name, split, img_dirs=SOURCE_IMG_DIRS):
+    for pattern in img_dirs:
+        path = os.path.join(pattern.format(split=split), file_name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def tile_split(coco_path, split, output_root=OUTPUT_ROOT, tile=TILE_SIZE, overlap=TILE_OVERLAP,
+               min_side_to_tile=TILE_MIN_SIDE, skip_empty=SKIP_EMPTY_TILES, workers=WORKERS, batch_size=16):
+    images = list(iter_images(coco_path))
+    categories = load_categories(coco_path)
+
+    # Group the split's boxes per image
+    ann_image_ids, bboxes, category_ids = array("q"), array("d"), array("q")
+    for ann in iter_annotations(coco_path):
+        ann_image_ids.append(ann["image_id"])
+        bboxes.extend(ann["bbox"])
+        category_ids.append(ann["category_id"])
+    ann_image_ids = np.frombuffer(ann_image_ids, dtype=np.int64)
+    bboxes = np.frombuffer(bboxes, dtype=np.float64).reshape(-1, 4)
+    category_ids = np.frombuffer(category_ids, dtype=np.int64)
+    order = np.argsort(ann_image_ids, kind="stable")
+    sorted_ids = ann_image_ids[order]
+
+    img_dir = os.path.join(output_root, "images", split)
+    os.makedirs(img_dir, exist_ok=True)
+
+    jobs, missing, unreadable = [], 0, 0
+    for image in images:
+        src = find_source(image["file_name"], split)
+        if src is None:
+            missing += 1
+            continue
+        lo, hi = np.searchsorted(sorted_ids, [image["id"], image["id"] + 1])
+        jobs.append((image, bboxes[order[lo:hi]], category_ids[order[lo:hi]], src))
+
+    by_id = {img["id"]: img for img in images}
+    src_of = {image["id"]: src for image, _, _, src in jobs}
+    writer = CocoWriter(os.path.join(output_root, "annotations", f"{split}_tiles_coco.json"), categories,
+                        indent=2)
+    tile_map = []
+    yolo_cols = ([], [], [], [], array("q"), array("d"), array("q"))
+    category_index = {cat["id"]: idx for idx, cat in enumerate(categories)}
+
+    batches = [jobs[i:i + batch_size] for i in range(0, len(jobs), batch_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor, tqdm(total=len(jobs), desc=f"Tiling {split}") as bar:
+        futures = [executor.submit(_tile_batch, batch, img_dir, tile, overlap, min_side_to_tile, skip_empty)
+                   for batch in batches]
+        for future in futures:
+            for source_id, tiles in future.result():
+                source = by_id[source_id]
+                if tiles is None:
+                    print(f" Unreadable: {src_of[source_id]}")
+                    unreadable += 1
+                    bar.update(1)
+                    continue
+                for record, tile_boxes, tile_cats in tiles:
+                    tile_id = writer.num_images
+                    writer.add_image({"id": tile_id, **record, "source_image_id": source_id,
+                                      "source_file_name": source["file_name"],
+                                      **({"source": source["source"]} if "source" in source else {})})
+                    tile_map.append([record["file_name"], source["file_name"], source_id,
+                                     record["tile_x"], record["tile_y"]])
+                    for box, cat in zip(tile_boxes.tolist(), tile_cats.tolist()):
+                        writer.add_annotation({"id": writer.num_annotations, "image_id": tile_id,
+                                               "category_id": cat, "bbox": box, "area": box[2] * box[3],
+                                               "iscrowd": 0})
+                        yolo_cols[4].append(tile_id)
+                        yolo_cols[5].extend(box)
+                        yolo_cols[6].append(category_index[cat])
+                    yolo_cols[0].append(tile_id)
+                    yolo_cols[1].append(record["file_name"])
+                    yolo_cols[2].append(record["width"])
+                    yolo_cols[3].append(record["height"])
+                bar.update(1)
+    writer.close()
+
+    ids, names, widths, heights, box_ids, boxes, classes = yolo_cols
+    convert_arrays(ids, names, np.array(widths, dtype=np.float64), np.array(heights, dtype=np.float64),
+                   box_ids, np.frombuffer(boxes, dtype=np.float64), np.frombuffer(classes, dtype=np.int64),
+                   os.path.join(output_root, "labels", split), desc=f"Writing {split} tile labels")
+
+    with open(os.path.join(output_root, f"{split}_tile_map.json"), "w") as f:
+        json.dump({"columns": ["tile", "source", "source_image_id", "x", "y"], "tiles": tile_map}, f)
+
+    problems = [f"{missing} images not found"] * bool(missing) + [f"{unreadable} unreadable"] * bool(unreadable)
+    print(f" {split}: {len(jobs)} images → {writer.num_images} tiles, {writer.num_annotations} boxes"
+          + (f" ({', '.join(problems)})" if problems else ""))
+    return writer.num_images
+
+
+def load_tile_map(output_root, split):
+    """Returns {tile file name: (source file name, source_image_id, x, y)}."""
+    with open(os.path.join(output_root, f"{split}_tile_map.json")) as f:
+        return {row[0]: tuple(row[1:]) for row in json.load(f)["tiles"]}
+
+
+def tile_dataset(annotations_dir=ANNOTATIONS_DIR, output_root=OUTPUT_ROOT, splits=SPLITS, tile=TILE_SIZE,
+                 overlap=TILE_OVERLAP, min_side_to_tile=TILE_MIN_SIDE, skip_empty=SKIP_EMPTY_TILES,
+                 workers=WORKERS):
+    for split in splits:
+        tile_split(os.path.join(annotations_dir, f"{split}_coco_reindexed.json"), split, output_root, tile,
+                   overlap, min_side_to_tile, skip_empty, workers)
+    write_data_yaml(output_root, splits)
+    print(f" Tiled dataset written to {output_root}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tile high-resolution images into overlapping training tiles.")
+    parser.add_argument("--annotations", default=ANNOTATIONS_DIR)
+    parser.add_argument("--output", default=OUTPUT_ROOT)
+    parser.add_argument("--tile", type=int, default=TILE_SIZE)
+    parser.add_argument("--overlap", type=float, default=TILE_OVERLAP)
+    parser.add_argument("--min-side", type=int, default=TILE_MIN_SIDE, help="only tile images larger than this")
+    parser.add_argument("--keep-empty", action="store_true", help="also write tiles without boxes")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+
+    tile_dataset(args.annotations, args.output, tile=args.tile, overlap=args.overlap,
+                 min_side_to_tile=args.min_side, skip_empty=not args.keep_empty, workers=args.workers)
@@ -0,0 +1,245 @@
+"""
+validate_yolo_labels.py
+
+Validates (and optionally repairs) YOLO label .txt files after convert_coco_to_yolo.py.
+
+Functionality:
+- Loads label files in batches across a process pool and checks all rows of
+  a batch at once with NumPy: malformed rows, class ids outside the class
+  list, non-positive sizes, boxes outside the normalized [0, 1] range and
+  duplicate rows within a file.
+- "report" mode only counts problems; "repair" mode rewrites the affected
+  files, clipping out-of-range boxes (or dropping them, FIX="drop") and
+  dropping only the other offending rows. Valid boxes are always kept and
+  no label file is deleted.
+- Writes a JSON summary with per-issue and per-folder counts plus examples.
+
+Replaces the notebook's is_label_valid(), which deleted every label file
+containing a single bad row.
+
+Usage:
+    python scripts/validate_yolo_labels.py                        # report only
+    python scripts/validate_yolo_labels.py --mode repair --fix clip
+"""
+
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from tqdm import tqdm
+
+from convert_coco_to_yolo import LINE_FORMAT
+from remap_coco_category_ids import new_categories
+
+# CONFIG
+LABELS_DIR = "data/merged/labels"
+SUMMARY_PATH = "data/merged/labels_validation.json"
+NUM_CLASSES = len(new_categories)
+MODE = "report"  # report | repair
+FIX = "clip"  # clip: clip out-of-bounds boxes into the image; drop: drop them like other bad rows
+MIN_SIZE = 1e-6  # normalized width/height below which a (clipped) box is dropped
+BOUNDS_TOLERANCE = 1e-6  # LINE_FORMAT rounding can put a box touching the border just past it
+WORKERS = os.cpu_count()
+BATCH_SIZE = 512
+MAX_EXAMPLES = 100
+
+ISSUES = ["malformed", "class_out_of_range", "non_positive_size", "out_of_bounds", "duplicate"]
+
+
+def list_label_files(labels_dir):
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(labels_dir):
+        dirnames.sort()
+        paths += [os.path.join(dirpath, f) for f in sorted(filenames) if f.endswith(".txt")]
+    return paths
+
+
+def load_batch(paths):
+    """Reads label files into one array of rows.
+
+    Returns (lines per file, rows (n, 5) float64, file index per row, malformed
+    mask per row). Malformed rows (not 5 numbers) get NaN values.
+    """
+    lines, tokens, counts, file_index = [], [], [], []
+    for i, path in enumerate(paths):
+        with open(path, "r") as f:
+            file_lines = [line for line in f.read().splitlines() if line.strip()]
+        lines.append(file_lines)
+        for line in file_lines:
+            parts = line.split()
+            tokens += parts if len(parts) == 5 else ["nan"] * 5
+            counts.append(len(parts))
+            file_index.append(i)
+
+    malformed = np.array(counts, dtype=np.int64) != 5
+    try:
+        rows = np.array(tokens, dtype=np.float64).reshape(-1, 5)
+    except ValueError:
+        # Non-numeric tokens: fall back to converting row by row
+        rows = np.empty((len(counts), 5))
+        for r in range(len(counts)):
+            try:
+                rows[r] = np.array(tokens[5 * r:5 * r + 5], dtype=np.float64)
+            except ValueError:
+                rows[r] = np.nan
+                malformed[r] = True
+    malformed |= ~np.isfinite(rows).all(axis=1)
+    return lines, rows, np.array(file_index, dtype=np.int64), malformed
+
+
+def check_rows(rows, file_index, malformed, num_classes=NUM_CLASSES):
+    """Returns a dict of boolean masks, one per issue in ISSUES."""
+    cls, xc, yc, w, h = rows.T
+    valid = ~malformed
+    with np.errstate(invalid="ignore"):
+        x1, y1, x2, y2 = xc - w / 2, yc - h / 2, xc + w / 2, yc + h / 2
+        bad_class = valid & ((cls != np.round(cls)) | (cls < 0) | (cls >= num_classes))
+        non_positive = valid & ~bad_class & ((w <= 0) | (h <= 0))
+        tol = BOUNDS_TOLERANCE
+        out_of_bounds = valid & ~bad_class & ~non_positive & ((x1 < -tol) | (y1 < -tol) | (x2 > 1 + tol) | (y2 > 1 + tol))
+
+    # Exact duplicates of an earlier row in the same file
+    duplicate = np.zeros(len(rows), dtype=bool)
+    candidates = np.flatnonzero(valid & ~bad_class & ~non_positive)
+    if candidates.size:
+        keys = np.column_stack([file_index[candidates], rows[candidates]])
+        _, first = np.unique(keys, axis=0, return_index=True)
+        duplicate[candidates] = True
+        duplicate[candidates[first]] = False
+
+    return {"malformed": malformed, "class_out_of_range": bad_class, "non_positive_size": non_positive,
+            "out_of_bounds": out_of_bounds, "duplicate": duplicate}
+
+
+def clip_rows(rows):
+    """Clips boxes to the image and returns (clipped rows, too-small mask)."""
+    cls, xc, yc, w, h = rows.T
+    x1, y1 = np.clip(xc - w / 2, 0, 1), np.clip(yc - h / 2, 0, 1)
+    x2, y2 = np.clip(xc + w / 2, 0, 1), np.clip(yc + h / 2, 0, 1)
+    clipped = np.column_stack([cls, (x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1])
+    return clipped, (clipped[:, 3] < MIN_SIZE) | (clipped[:, 4] < MIN_SIZE)
+
+
+def validate_batch(paths, labels_dir, num_classes=NUM_CLASSES, mode=MODE, fix=FIX):
+    """Checks (and in repair mode rewrites) one batch of label files; returns its summary."""
+    lines, rows, file_index, malformed = load_batch(paths)
+    issues = check_rows(rows, file_index, malformed, num_classes)
+
+    summary = {
+        "files": len(paths),
+        "empty_files": sum(not file_lines for file_lines in lines),
+        "rows": len(rows),
+        "issues": {name: int(mask.sum()) for name, mask in issues.items()},
+        "by_folder": {},
+        "files_with_issues": 0,
+        "rows_dropped": 0,
+        "rows_clipped": 0,
+        "files_rewritten": 0,
+        "examples": [],
+    }
+
+    any_issue = np.zeros(len(rows), dtype=bool)
+    for mask in issues.values():
+        any_issue |= mask
+    bad_files = np.unique(file_index[any_issue])
+    summary["files_with_issues"] = len(bad_files)
+
+    for name, mask in issues.items():
+        for r in np.flatnonzero(mask)[:MAX_EXAMPLES]:
+            summary["examples"].append({"file": os.path.relpath(paths[file_index[r]], labels_dir),
+                                        "row": int(r - np.searchsorted(file_index, file_index[r])),
+                                        "issue": name})
+        for f in file_index[mask]:
+            folder = os.path.dirname(os.path.relpath(paths[f], labels_dir)) or "."
+            counts = summary["by_folder"].setdefault(folder, dict.fromkeys(ISSUES, 0))
+            counts[name] += 1
+
+    if mode != "repair" or not len(bad_files):
+        return summary
+
+    # Repair: drop offending rows, clip out-of-bounds ones if FIX == "clip"
+    drop = any_issue.copy()
+    replacement = {}
+    if fix == "clip":
+        clip_mask = issues["out_of_bounds"] & ~issues["duplicate"]
+        clipped, too_small = clip_rows(rows[clip_mask])
+        for r, row, small in zip(np.flatnonzero(clip_mask), clipped, too_small):
+            if not small:
+                drop[r] = False
+                replacement[r] = LINE_FORMAT % (int(row[0]), *row[1:])
+        summary["rows_clipped"] = len(replacement)
+    summary["rows_dropped"] = int(drop.sum())
+
+    starts = np.searchsorted(file_index, np.arange(len(paths)))
+    for f in bad_files:
+        kept = []
+        for offset, line in enumerate(lines[f]):
+            r = starts[f] + offset
+            if not drop[r]:
+                kept.append(replacement.get(r, line))
+        with open(paths[f], "w") as out:
+            out.write("".join(line + "\n" for line in kept))
+    summary["files_rewritten"] = len(bad_files)
+    return summary
+
+
+def merge_summaries(total, part):
+    for key in ("files", "empty_files", "rows", "files_with_issues", "rows_dropped", "rows_clipped",
+                "files_rewritten"):
+        total[key] += part[key]
+    for name, count in part["issues"].items():
+        total["issues"][name] += count
+    for folder, counts in part["by_folder"].items():
+        folder_counts = total["by_folder"].setdefault(folder, dict.fromkeys(ISSUES, 0))
+        for name, count in counts.items():
+            folder_counts[name] += count
+    total["examples"] += part["examples"][:MAX_EXAMPLES - len(total["examples"])]
+
+
+def validate_labels(labels_dir=LABELS_DIR, summary_path=SUMMARY_PATH, num_classes=NUM_CLASSES, mode=MODE,
+                    fix=FIX, workers=WORKERS):
+    paths = list_label_files(labels_dir)
+    batches = [paths[i:i + BATCH_SIZE] for i in range(0, len(paths), BATCH_SIZE)]
+    total = {"labels_dir": labels_dir, "mode": mode, "fix": fix if mode == "repair" else None,
+             "num_classes": num_classes, "files": 0, "empty_files": 0, "rows": 0,
+             "issues": dict.fromkeys(ISSUES, 0), "by_folder": {}, "files_with_issues": 0, "rows_dropped": 0,
+             "rows_clipped": 0, "files_rewritten": 0, "examples": []}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor, \
+            tqdm(total=len(paths), desc="Validating labels") as bar:
+        futures = [executor.submit(validate_batch, batch, labels_dir, num_classes, mode, fix) for batch in batches]
+        for future in futures:
+            part = future.result()
+            merge_summaries(total, part)
+            bar.update(part["files"])
+
+    if summary_path:
+        os.makedirs(os.path.dirname(os.path.abspath(summary_path)), exist_ok=True)
+        with open(summary_path, "w") as f:
+            json.dump(total, f, indent=2)
+
+    print(f"\n Label validation ({mode}): {total['files']} files, {total['rows']} rows, "
+          f"{total['files_with_issues']} files with issues")
+    for name in ISSUES:
+        print(f"  {name:20s}: {total['issues'][name]}")
+    if mode == "repair":
+        print(f"  Rows clipped: {total['rows_clipped']}, dropped: {total['rows_dropped']}, "
+              f"files rewritten: {total['files_rewritten']}")
+    if summary_path:
+        print(f" Summary saved: {summary_path}")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate or repair YOLO label files.")
+    parser.add_argument("--labels", default=LABELS_DIR, help="labels folder (searched recursively)")
+    parser.add_argument("--summary", default=SUMMARY_PATH, help="JSON summary output")
+    parser.add_argument("--num-classes", type=int, default=NUM_CLASSES)
+    parser.add_argument("--mode", choices=["report", "repair"], default=MODE)
+    parser.add_argument("--fix", choices=["clip", "drop"], default=FIX)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+
+    validate_labels(args.labels, args.summary, args.num_classes, args.mode, args.fix, args.workers)
@@ -0,0 +1,337 @@
+"""
+video_inference.py
+
+Streaming defect detection on dashcam / drone video that reports every
+physical defect once instead of once per frame.
+
+Functionality:
+- A decode thread reads the video into a bounded queue, so decoding overlaps
+  with inference and memory stays flat on hours of footage.
+- Adaptive frame skipping in the decode thread: with a speed profile (CSV
+  of seconds, km/h) or a fixed SPEED_KMH, frames are sampled every
+  DISTANCE_STEP metres of road; otherwise frames that barely differ from the
+  last processed one (mean absolute difference of a small grayscale copy
+  below MOTION_THRESHOLD) are dropped. Skipped frames are only grabbed, not
+  decoded, when no motion check is needed.
+- Frames are run through the model in batches (ultralytics or the ONNX
+  Runtime backend of onnx_inference.py).
+- An IoU tracker links detections of the same class across processed frames;
+  a track that is confirmed (MIN_HITS) and then lost for MAX_AGE frames is
+  emitted once as a defect record with its best (highest confidence) frame,
+  written to defects.jsonl with a snapshot image.
+
+Usage:
+    python scripts/video_inference.py --video road.mp4
+    python scripts/video_inference.py --video road.mp4 --onnx best.onnx --speed-log speed.csv
+"""
+
+import os
+import csv
+import json
+import time
+import queue
+import argparse
+import threading
+
+import cv2
+import numpy as np
+
+from box_ops import overlap_matrix
+from remap_coco_category_ids import new_categories
+
+# CONFIG
+WEIGHTS = "runs/detect/road_defects_yolov85/weights/best.pt"
+OUTPUT_DIR = "runs/detect/video"
+IMGSZ = 640
+BATCH_SIZE = 8
+QUEUE_SIZE = 32  # decoded frames buffered ahead of inference
+CONF = 0.25
+# Frame skipping
+SPEED_KMH = None  # fixed vehicle speed; None: use motion (or --speed-log)
+DISTANCE_STEP = 2.0  # metres of road between processed frames when the speed is known
+MOTION_THRESHOLD = 2.0  # mean absolute gray-level difference below which a frame is skipped
+MOTION_SIZE = 64  # side of the grayscale copy used for the motion check
+MAX_SKIP = 15  # never skip more than this many frames in a row
+# Tracking
+TRACK_IOU = 0.2  # low: boxes move between processed frames
+MIN_HITS = 2  # detections needed before a track counts as a defect
+MAX_AGE = 5  # processed frames a track survives without a match
+
+SENTINEL = None
+
+
+class SpeedProfile:
+    """Vehicle speed over time from a CSV of (seconds, km/h) rows, linearly interpolated."""
+
+    def __init__(self, path):
+        rows = []
+        with open(path, newline="") as f:
+            for row in csv.reader(f):
+                try:
+                    rows.append((float(row[0]), float(row[1])))
+                except (ValueError, IndexError):  # header or blank line
+                    continue
+        if not rows:
+            raise ValueError(f"No (seconds, km/h) rows in {path}")
+        self.times, self.speeds = np.array(sorted(rows)).T
+
+    def __call__(self, t):
+        return float(np.interp(t, self.times, self.speeds))
+
+
+class FrameSkipper:
+    """Decides which frames to process, from speed when known, otherwise from motion."""
+
+    def __init__(self, fps, speed=SPEED_KMH, distance_step=DISTANCE_STEP, motion_threshold=MOTION_THRESHOLD,
+                 max_skip=MAX_SKIP):
+        self.fps = fps
+        self.speed = speed  # None, a number or a SpeedProfile
+        self.distance_step = distance_step
+        self.motion_threshold = motion_threshold
+        self.max_skip = max_skip
+        self.last_small = None
+        self.distance = 0.0
+        self.skipped = 0
+
+    @property
+    def needs_pixels(self):
+        return self.speed is None
+
+    def keep(self, index, frame=None):
+        """True if frame `index` should be processed; `frame` is needed only for the motion check."""
+        if self.speed is not None:
+            speed = self.speed(index / self.fps) if callable(self.speed) else self.speed
+            self.distance += speed / 3.6 / self.fps
+            keep = index == 0 or self.distance >= self.distance_step or self.skipped >= self.max_skip
+            if keep:
+                self.distance, self.skipped = 0.0, 0
+            else:
+                self.skipped += 1
+            return keep
+
+        small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (MOTION_SIZE, MOTION_SIZE),
+                           interpolation=cv2.INTER_AREA).astype(np.int16)
+        if self.last_small is None or self.skipped >= self.max_skip or \
+                np.abs(small - self.last_small).mean() >= self.motion_threshold:
+            self.last_small, self.skipped = small, 0
+            return True
+        self.skipped += 1
+        return False
+
+
+def decode_worker(cap, frames, skipper, stats, stop):
+    """Reads frames into the bounded queue; skipped frames are grabbed without decoding if possible.
+
+    A decode error is put on the queue for process_video to re-raise; SENTINEL always follows.
+    """
+    index = 0
+    try:
+        while not stop.is_set():
+            if skipper.needs_pixels:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                keep = skipper.keep(index, frame)
+            else:
+                if not cap.grab():
+                    break
+                keep = skipper.keep(index)
+                frame = None
+                if keep:
+                    ok, frame = cap.retrieve()
+                    keep = ok
+            if keep:
+                frames.put((index, frame))
+            else:
+                stats["skipped"] += 1
+            index += 1
+    except Exception as e:
+        frames.put(e)
+    finally:
+        stats["frames"] = index
+        frames.put(SENTINEL)
+
+
+class Track:
+    def __init__(self, track_id, box, score, cls, frame_index, frame):
+        self.id = track_id
+        self.cls = cls
+        self.box = box
+        self.hits = 1
+        self.misses = 0
+        self.first_frame = self.last_frame = frame_index
+        self.best = (score, frame_index, box, frame)
+
+    def update(self, box, score, frame_index, frame):
+        self.box = box
+        self.hits += 1
+        self.misses = 0
+        self.last_frame = frame_index
+        if score > self.best[0]:
+            self.best = (score, frame_index, box, frame)
+
+
+class IoUTracker:
+    """Greedy per-class IoU matching between active tracks and new detections."""
+
+    def __init__(self, iou=TRACK_IOU, min_hits=MIN_HITS, max_age=MAX_AGE):
+        self.iou = iou
+        self.min_hits = min_hits
+        self.max_age = max_age
+        self.tracks = []
+        self.next_id = 0
+
+    def update(self, boxes, scores, classes, frame_index, frame):
+        """Adds one processed frame's detections; returns the tracks that just ended as defects."""
+        matched_tracks, matched_dets = set(), set()
+        num_old = len(self.tracks)
+        if self.tracks and len(boxes):
+            track_boxes = np.array([t.box for t in self.tracks])
+            track_classes = np.array([t.cls for t in self.tracks])
+            iou = overlap_matrix(track_boxes, boxes)
+            iou[track_classes[:, None] != classes[None, :]] = 0
+            # Best pairs first
+            for flat in np.argsort(-iou, axis=None):
+                t, d = divmod(int(flat), len(boxes))
+                if iou[t, d] < self.iou:
+                    break
+                if t in matched_tracks or d in matched_dets:
+                    continue
+                self.tracks[t].update(boxes[d], float(scores[d]), frame_index, frame)
+                matched_tracks.add(t)
+                matched_dets.add(d)
+
+        for d in range(len(boxes)):
+            if d not in matched_dets:
+                self.tracks.append(Track(self.next_id, boxes[d], float(scores[d]), int(classes[d]), frame_index,
+                                         frame))
+                self.next_id += 1
+
+        ended, active = [], []
+        for i, track in enumerate(self.tracks):
+            if i < num_old and i not in matched_tracks:
+                track.misses += 1
+            if track.misses > self.max_age:
+                if track.hits >= self.min_hits:
+                    ended.append(track)
+            else:
+                active.append(track)
+        self.tracks = active
+        return ended
+
+    def flush(self):
+        """Ends all remaining tracks (end of video)."""
+        ended = [t for t in self.tracks if t.hits >= self.min_hits]
+        self.tracks = []
+        return ended
+
+
+def defect_record(track, fps, names, snapshot_dir):
+    score, frame_index, box, frame = track.best
+    record = {"id": track.id, "class": track.cls, "name": names.get(track.cls, str(track.cls)),
+              "confidence": round(score, 5), "best_frame": frame_index, "time_sec": round(frame_index / fps, 3),
+              "first_frame": track.first_frame, "last_frame": track.last_frame, "hits": track.hits,
+              "box": [round(v, 2) for v in np.asarray(box).tolist()]}
+    if snapshot_dir:
+        x1, y1, x2, y2 = np.asarray(box).astype(int).tolist()
+        snapshot = frame.copy()
+        cv2.rectangle(snapshot, (x1, y1), (x2, y2), (0, 0, 255), 3)
+        path = os.path.join(snapshot_dir, f"defect_{track.id:06d}_{record['name']}.jpg")
+        cv2.imwrite(path, snapshot)
+        record["snapshot"] = path
+    return record
+
+
+def process_video(video, backend, output_dir=OUTPUT_DIR, batch_size=BATCH_SIZE, speed=SPEED_KMH,
+                  save_snapshots=True):
+    cap = cv2.VideoCapture(video)
+    if not cap.isOpened():
+        raise FileNotFoundError(f"Cannot open video: {video}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    names = getattr(backend, "names", None) or {i: cat["name"] for i, cat in enumerate(new_categories)}
+
+    os.makedirs(output_dir, exist_ok=True)
+    snapshot_dir = os.path.join(output_dir, "snapshots") if save_snapshots else None
+    if snapshot_dir:
+        os.makedirs(snapshot_dir, exist_ok=True)
+
+    frames = queue.Queue(maxsize=QUEUE_SIZE)
+    stats = {"frames": 0, "skipped": 0, "processed": 0, "defects": 0}
+    stop = threading.Event()
+    decoder = threading.Thread(target=decode_worker, args=(cap, frames, FrameSkipper(fps, speed), stats, stop),
+                               daemon=True)
+    tracker = IoUTracker()
+    out_path = os.path.join(output_dir, "defects.jsonl")
+    start = time.perf_counter()
+    decoder.start()
+
+    def emit(tracks, out):
+        for track in tracks:
+            out.write(json.dumps(defect_record(track, fps, names, snapshot_dir)) + "\n")
+            stats["defects"] += 1
+
+    try:
+        with open(out_path, "w") as out:
+            done = False
+            while not done:
+                # Block for the first frame, then take whatever is already decoded up to batch_size
+                batch = []
+                item = frames.get()
+                while item is not SENTINEL:
+                    if isinstance(item, Exception):
+                        raise item
+                    batch.append(item)
+                    if len(batch) == batch_size:
+                        break
+                    try:
+                        item = frames.get(timeout=0.001 if batch else None)
+                    except queue.Empty:
+                        break
+                done = item is SENTINEL
+                if not batch:
+                    continue
+
+                results = backend([frame for _, frame in batch])
+                for (index, frame), (boxes, scores, classes) in zip(batch, results):
+                    emit(tracker.update(boxes, scores, classes, index, frame), out)
+                stats["processed"] += len(batch)
+            emit(tracker.flush(), out)
+    finally:
+        stop.set()
+        while decoder.is_alive():  # unblock a decoder waiting on a full queue
+            try:
+                frames.get_nowait()
+            except queue.Empty:
+                decoder.join(0.01)
+        cap.release()
+
+    elapsed = time.perf_counter() - start
+    video_seconds = stats["frames"] / fps
+    print(f" {stats['frames']} frames ({video_seconds:.1f}s of video), {stats['processed']} processed, "
+          f"{stats['skipped']} skipped")
+    print(f" {stats['defects']} unique defects → {out_path}")
+    print(f" Elapsed {elapsed:.1f}s: {stats['frames'] / max(elapsed, 1e-9):.1f} video frames/s, "
+          f"{video_seconds / max(elapsed, 1e-9):.2f}x real time")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect and track road defects in a video.")
+    parser.add_argument("--video", required=True)
+    parser.add_argument("--weights", default=WEIGHTS)
+    parser.add_argument("--onnx", help="use an exported .onnx model with ONNX Runtime instead of --weights")
+    parser.add_argument("--output", default=OUTPUT_DIR)
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE)
+    parser.add_argument("--speed", type=float, default=SPEED_KMH, help="fixed vehicle speed in km/h")
+    parser.add_argument("--speed-log", help="CSV of (seconds, km/h) rows")
+    parser.add_argument("--no-snapshots", action="store_true")
+    args = parser.parse_args()
+
+    if args.onnx:
+        from onnx_inference import OnnxBackend
+        backend = OnnxBackend(args.onnx, conf=CONF)
+    else:
+        from sliced_inference import UltralyticsBackend
+        backend = UltralyticsBackend(args.weights, imgsz=IMGSZ, conf=CONF)
+    speed = SpeedProfile(args.speed_log) if args.speed_log else args.speed
+    process_video(args.video, backend, args.output, args.batch, speed, not args.no_snapshots)
@@ -0,0 +1,184 @@
+"""
+voc_reader.py
+
+Shared Pascal VOC XML reader for the RDD2022 and UAV-PDD2023 converters.
+
+Functionality:
+- Parses VOC XML files into (image, objects) records.
+- Streams records in chunks, optionally parsed in a process pool.
+- Assembles COCO output with deterministic image/annotation IDs
+  (sorted file order), independent of the number of workers, and streams
+  it to disk.
+- Cross-checks the XML <size> against the image headers (image_probe.py),
+  filling in missing sizes and reporting wrong ones.
+- convert_voc_dir commits the output in chunks (checkpoint.py) and resumes
+  an interrupted conversion after the last committed XML file.
+
+Used by rdd2022_to_coco.py and uavpdd2023_to_coco.py.
+"""
+
+import os
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from tqdm import tqdm
+import instrument
+import image_probe
+from checkpoint import CHUNK_SIZE as CHECKPOINT_CHUNK, RESUME, ResumableCocoWriter
+from image_probe import SizeReport, probe_dir, report_path
+
+CHUNK_SIZE = 256
+
+
+def list_xml_files(xml_dir):
+    return [os.path.join(xml_dir, f) for f in sorted(os.listdir(xml_dir)) if f.endswith(".xml")]
+
+
+def parse_voc_xml(xml_path, label_map):
+    """Returns ({file_name, width, height}, [(category_id, xmin, ymin, xmax, ymax), ...])"""
+    root = ET.parse(xml_path).getroot()
+
+    # Some files omit <size>; 0 is replaced by the image header size in with_probed_sizes()
+    image = {
+        "file_name": root.find("filename").text,
+        "width": int(root.findtext("size/width") or 0),
+        "height": int(root.findtext("size/height") or 0)
+    }
+
+    objects = []
+    for obj in root.findall("object"):
+        label = obj.find("name").text
+        if label not in label_map:
+            continue
+
+        bndbox = obj.find("bndbox")
+        objects.append((
+            label_map[label],
+            float(bndbox.find("xmin").text),
+            float(bndbox.find("ymin").text),
+            float(bndbox.find("xmax").text),
+            float(bndbox.find("ymax").text)
+        ))
+    return image, objects
+
+
+def parse_chunk(xml_paths, label_map):
+    return [parse_voc_xml(p, label_map) for p in xml_paths]
+
+
+def iter_voc_chunks(xml_files, label_map, chunk_size=CHUNK_SIZE, executor=None):
+    """Yields lists of (image, objects) records in file order.
+
+    With an executor, chunks are parsed in worker processes; at most a few
+    chunks per worker are in flight so memory stays bounded.
+    """
+    chunks = (xml_files[i:i + chunk_size] for i in range(0, len(xml_files), chunk_size))
+
+    if executor is None:
+        for chunk in chunks:
+            yield parse_chunk(chunk, label_map)
+        return
+
+    max_in_flight = 2 * getattr(executor, "_max_workers", os.cpu_count() or 1)
+    pending = deque()
+    for chunk in chunks:
+        pending.append(executor.submit(parse_chunk, chunk, label_map))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def iter_voc_records(xml_dir, label_map, chunk_size=CHUNK_SIZE, executor=None, desc=None, start=0):
+    """Records of the XML files in sorted order, from the `start`-th file on."""
+    xml_files = list_xml_files(xml_dir)[start:]
+    with tqdm(total=len(xml_files), desc=desc) as bar:
+        for chunk in iter_voc_chunks(xml_files, label_map, chunk_size, executor):
+            yield from chunk
+            bar.update(len(chunk))
+
+
+def coco_records(records, image_id=0, ann_id=0):
+    """Yields (image, annotations) COCO dicts with sequential IDs in record order, starting at the given IDs.
+
+    Skipped records (image None) come through as (None, []) without using an ID.
+    """
+    for image, objects in records:
+        if image is None:
+            yield None, []
+            continue
+        annotations = []
+        for category_id, xmin, ymin, xmax, ymax in objects:
+            bbox_width = xmax - xmin
+            bbox_height = ymax - ymin
+            annotations.append({
+                "id": ann_id,
+                "image_id": image_id,
+                "category_id": category_id,
+                "bbox": [xmin, ymin, bbox_width, bbox_height],
+                "area": bbox_width * bbox_height,
+                "iscrowd": 0
+            })
+            ann_id += 1
+
+        yield {"id": image_id, **image}, annotations
+        image_id += 1
+
+
+def with_probed_sizes(records, sizes, report):
+    """Passes records through, replacing width/height that disagree with the image header.
+
+    A record without any size (no <size> in the XML and no readable header)
+    comes through as (None, objects), so the caller skips it but still
+    counts the file.
+    """
+    for image, objects in records:
+        width, height = report.check(image, sizes.get(image["file_name"]))
+        if not (width and height):
+            print(f" Skipped (no image size): {image['file_name']}")
+            yield None, objects
+            continue
+        image["width"], image["height"] = width, height
+        yield image, objects
+
+
+def convert_voc_dir(xml_dir, label_map, categories, output_json, img_dir, executor=None, cache=None, desc=None,
+                    resume=RESUME, commit_every=CHECKPOINT_CHUNK):
+    """Converts a VOC folder to a COCO JSON, committed every `commit_every` files.
+
+    Image sizes are verified against the headers in img_dir and a mismatch
+    report is written next to the JSON. An interrupted run resumes after the
+    last committed file with the same IDs, so the output equals that of an
+    uninterrupted run.
+    """
+    xml_files = list_xml_files(xml_dir)
+    stats = [(os.path.basename(p), st.st_size, st.st_mtime_ns) for p, st in ((p, os.stat(p)) for p in xml_files)]
+    key = ["voc", stats, label_map, os.path.abspath(img_dir), image_probe.FIX_SIZES]
+
+    with instrument.span("probe sizes"):
+        sizes = probe_dir(img_dir, cache=cache)
+    with instrument.span("parse xml + write json"), \
+            ResumableCocoWriter(output_json, categories, key, resume) as writer:
+        done = writer.state.get("files", 0)
+        report = SizeReport()
+        for changes in writer.committed_changes():
+            report.replay(changes)
+        records = iter_voc_records(xml_dir, label_map, executor=executor, desc=desc, start=done)
+        pairs = coco_records(with_probed_sizes(records, sizes, report), writer.num_images, writer.num_annotations)
+        for done, (image, annotations) in enumerate(pairs, start=done + 1):
+            if image is not None:
+                writer.add_image(image)
+                writer.add_annotations(annotations)
+            if done % commit_every == 0:
+                writer.commit({"files": done}, report.changes())
+    instrument.count(images=writer.num_images, annotations=writer.num_annotations)
+    report.write(report_path(output_json))
+    print(f" Image sizes: {report.summary()}")
+    return report
+
+
+def make_executor(workers):
+    """Returns a process pool for workers > 1, otherwise None (parse inline)."""
+    if workers and workers > 1:
+        return ProcessPoolExecutor(max_workers=workers)
+    return None
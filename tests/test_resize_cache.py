@@ -0,0 +1,64 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import resize_cache
+
+BaseDataset = pytest.importorskip("ultralytics.data.base").BaseDataset
+
+
+def make_source(root, count, size=(96, 128)):
+    img_dir = os.path.join(root, "images", "train")
+    os.makedirs(img_dir)
+    rng = np.random.default_rng(0)
+    for i in range(count):
+        cv2.imwrite(os.path.join(img_dir, f"{i:03d}.jpg"), rng.integers(0, 255, (*size, 3), dtype=np.uint8))
+
+
+def array_dataset(root, imgsz, augment, max_buffer_length):
+    """A BaseDataset with only the attributes BaseDataset.__init__ (8.1.25) sets for load_image."""
+    dataset = object.__new__(BaseDataset)
+    img_dir = os.path.join(root, "images", "train")
+    dataset.im_files = [os.path.join(img_dir, f) for f in sorted(os.listdir(img_dir))]
+    n = len(dataset.im_files)
+    dataset.imgsz = imgsz
+    dataset.augment = augment
+    dataset.ims, dataset.im_hw0, dataset.im_hw = [None] * n, [None] * n, [None] * n
+    dataset.buffer = []
+    dataset.max_buffer_length = max_buffer_length
+    return dataset
+
+
+def test_array_cache_load_image_evicts_past_buffer_limit(tmp_path, monkeypatch):
+    source, output = str(tmp_path / "source"), str(tmp_path / "cache")
+    make_source(source, 6)
+    resize_cache.build_cache(source, output, imgsz=64, fmt="array", splits=["train"], workers=2)
+    monkeypatch.setattr(BaseDataset, "load_image", BaseDataset.load_image)
+    resize_cache.use_array_cache(output, ["train"])
+
+    dataset = array_dataset(output, imgsz=64, augment=True, max_buffer_length=3)
+    for i in range(len(dataset.im_files)):
+        img, hw0, hw = dataset.load_image(i)
+        assert hw0 == (96, 128)
+        assert hw == img.shape[:2] == (48, 64)
+
+    assert dataset.buffer == [4, 5]
+    assert [i for i, im in enumerate(dataset.ims) if im is not None] == [4, 5]
+    assert dataset.im_hw0[:4] == [None] * 4 and dataset.im_hw[:4] == [None] * 4
+
+
+def test_array_cache_load_image_resizes_to_dataset_imgsz(tmp_path, monkeypatch):
+    source, output = str(tmp_path / "source"), str(tmp_path / "cache")
+    make_source(source, 2)
+    resize_cache.build_cache(source, output, imgsz=64, fmt="array", splits=["train"], workers=2)
+    monkeypatch.setattr(BaseDataset, "load_image", BaseDataset.load_image)
+    resize_cache.use_array_cache(output, ["train"])
+
+    dataset = array_dataset(output, imgsz=128, augment=False, max_buffer_length=0)
+    img, hw0, hw = dataset.load_image(0)
+    assert (hw0, hw) == ((96, 128), (96, 128))
+    assert dataset.buffer == [] and dataset.ims[0] is None
+    img, _, hw = dataset.load_image(1, rect_mode=False)
+    assert hw == (128, 128)